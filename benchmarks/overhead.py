@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+"""
+Measure the overhead of the package's instrumentation against uninstrumented baselines.
+
+Runs against an in-memory SQLite database with the models of `tests/mock_models`:
+
+    python benchmarks/overhead.py --output overhead.json
+
+Each benchmark reports the best time per operation of the baseline and the instrumented
+code in nanoseconds, and the overhead in nanoseconds and as a ratio, as JSON.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+
+
+def setup_django():
+    from django.conf import settings
+
+    # Patches must not be applied at startup, the baselines are measured first
+    settings.ENABLE_QUERY_WARNINGS = False
+    settings.DATABASES['default']['NAME'] = ":memory:"
+    settings.DEBUG = False
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", run_syncdb=True, verbosity=0)
+
+
+def time_per_operation(function, number, repeat):
+    """Return the best time of `function` over `repeat` runs of `number` calls, in nanoseconds per call."""
+    # Warm up caches, e.g. compiled querysets and the connection
+    function()
+
+    return min(timeit.Timer(function).repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def result(name, baseline, instrumented):
+    return {
+        'name': name,
+        'baseline_ns': round(baseline, 1),
+        'instrumented_ns': round(instrumented, 1),
+        'overhead_ns': round(instrumented - baseline, 1),
+        'overhead_ratio': round(instrumented / baseline, 3) if baseline else None,
+    }
+
+
+def bench_attribute_access(number, repeat):
+    """`UsageTrackingDescriptor.__get__` against a plain field read."""
+    from mock_models.models import FieldTrackedSimpleModel, UntrackedSimpleModel
+
+    tracked = FieldTrackedSimpleModel(name="Tracked")
+    untracked = UntrackedSimpleModel(name="Untracked")
+
+    return result("attribute_access",
+                  time_per_operation(lambda: untracked.name, number, repeat),
+                  time_per_operation(lambda: tracked.name, number, repeat))
+
+
+def bench_instantiation(number, repeat):
+    """`FieldUsageTrackerMeta.__call__` against instantiating a plain model."""
+    from mock_models.models import FieldTrackedSimpleModel, UntrackedSimpleModel
+
+    return result("instantiation",
+                  time_per_operation(lambda: UntrackedSimpleModel(name="Untracked"), number, repeat),
+                  time_per_operation(lambda: FieldTrackedSimpleModel(name="Tracked"), number, repeat))
+
+
+def bench_lazy_load(number, repeat):
+    """An uncached forward foreign key load before and after `PatchDjangoDescriptors`."""
+    from django_query_debug.patch import PatchDjangoDescriptors
+    from mock_models.models import SimpleModel, SimpleRelatedModel
+
+    related = SimpleRelatedModel.objects.create(name="Related",
+                                                related_model=SimpleModel.objects.create(name="Simple"))
+
+    def lazy_load():
+        related._state.fields_cache.clear()
+        return related.related_model
+
+    if PatchDjangoDescriptors.applied:
+        raise RuntimeError("PatchDjangoDescriptors was applied before the baseline was measured")
+
+    baseline = time_per_operation(lazy_load, number, repeat)
+    PatchDjangoDescriptors(force=True)
+
+    return result("lazy_load", baseline, time_per_operation(lazy_load, number, repeat))
+
+
+def bench_query_capture(number, repeat):
+    """A primary key lookup, alone and inside `QueryCapture` and `analyze_block`."""
+    from django_query_debug.capture import QueryCapture
+    from django_query_debug.utils import analyze_block
+    from mock_models.models import SimpleModel
+
+    pk = SimpleModel.objects.create(name="Simple").pk
+
+    def query():
+        return SimpleModel.objects.get(pk=pk)
+
+    def captured(**capture_options):
+        def run():
+            with QueryCapture(**capture_options):
+                for _ in range(number):
+                    query()
+
+        return run
+
+    def analyzed():
+        with analyze_block(count_results=False):
+            for _ in range(number):
+                query()
+
+    def per_block(function):
+        # The whole block is timed, so that the setup and report of the block are included
+        function()
+
+        return min(timeit.Timer(function).repeat(repeat=repeat, number=1)) / number * 1e9
+
+    baseline = time_per_operation(query, number, repeat)
+
+    return [
+        result("query_capture", baseline, per_block(captured())),
+        result("query_capture_minimal", baseline,
+               per_block(captured(capture_call_sites=False, interpolate_sql=False))),
+        result("analyze_block", baseline, per_block(analyzed)),
+    ]
+
+
+BENCHMARKS = (
+    (bench_attribute_access, 100000),
+    (bench_instantiation, 10000),
+    # Measures its baseline before applying the patch, keep it after the others
+    (bench_lazy_load, 1000),
+    (bench_query_capture, 1000),
+)
+
+
+def run_benchmarks(scale=1.0, repeat=5):
+    import django
+
+    results = []
+
+    for benchmark, number in BENCHMARKS:
+        benchmark_results = benchmark(max(int(number * scale), 1), repeat)
+        results.extend(benchmark_results if isinstance(benchmark_results, list) else [benchmark_results])
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'repeat': repeat,
+        'scale': scale,
+        'results': results,
+    }
+
+
+def compare(results, previous_results, tolerance):
+    """Return the names of the benchmarks whose overhead ratio grew by more than `tolerance`."""
+    previous_ratios = {result['name']: result['overhead_ratio'] for result in previous_results['results']}
+    regressions = []
+
+    for result in results['results']:
+        previous_ratio = previous_ratios.get(result['name'])
+
+        if previous_ratio and result['overhead_ratio'] > previous_ratio * (1 + tolerance):
+            regressions.append(result['name'])
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply the number of operations per run, e.g. 0.1 for a quick run.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark, the best run is kept.")
+    parser.add_argument("--compare", help="Fail if an overhead ratio grew compared to these JSON results.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Relative growth of an overhead ratio tolerated by --compare.")
+    args = parser.parse_args()
+
+    setup_django()
+    results = run_benchmarks(scale=args.scale, repeat=args.repeat)
+    output = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            regressions = compare(results, json.load(previous_file), args.tolerance)
+
+        if regressions:
+            sys.exit("Overhead regressions: {}".format(", ".join(regressions)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+Measure the startup cost of having `django_query_debug` in `INSTALLED_APPS` with every feature off.
+
+Each run is a fresh interpreter that configures Django and calls `django.setup()`:
+
+    python benchmarks/startup.py --output startup.json
+
+Reports the best setup time in milliseconds with and without the app, the difference, and the
+modules the app adds to `sys.modules`, as JSON.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child interpreter, prints the setup time and the loaded modules as JSON
+CHILD_SCRIPT = """
+import json
+import sys
+import time
+
+start_time = time.time()
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=["django.contrib.contenttypes", "django.contrib.auth"] + sys.argv[1:],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+)
+django.setup()
+
+print(json.dumps({"setup_ms": (time.time() - start_time) * 1000, "modules": sorted(sys.modules)}))
+"""
+
+HEAVY_MODULES = ("depocs", "pygments", "six", "sqlparse")
+
+
+def run_setup(apps):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + os.environ.get("PYTHONPATH", "").split(os.pathsep)))
+    output = subprocess.check_output([sys.executable, "-c", CHILD_SCRIPT] + list(apps), env=env, cwd=ROOT)
+
+    return json.loads(output.decode("utf-8"))
+
+
+def run_benchmark(repeat=10):
+    import django
+
+    baselines = []
+    instrumented = []
+
+    # Interleaved, so that both cases see the same disk cache and machine load
+    for _ in range(repeat):
+        baselines.append(run_setup([]))
+        instrumented.append(run_setup(["django_query_debug"]))
+
+    baseline_ms = min(run['setup_ms'] for run in baselines)
+    instrumented_ms = min(run['setup_ms'] for run in instrumented)
+    added_modules = sorted(set(instrumented[0]['modules']) - set(baselines[0]['modules']))
+
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'django': django.get_version(),
+        'repeat': repeat,
+        'baseline_ms': round(baseline_ms, 2),
+        'instrumented_ms': round(instrumented_ms, 2),
+        'overhead_ms': round(instrumented_ms - baseline_ms, 2),
+        'added_modules': added_modules,
+        'heavy_modules': [module for module in HEAVY_MODULES if module in added_modules],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument("--repeat", type=int, default=10, help="Interpreters started per case, the best run is kept.")
+    parser.add_argument("--max-overhead-ms", type=float,
+                        help="Fail if the app adds more than this many milliseconds to the setup.")
+    args = parser.parse_args()
+
+    results = run_benchmark(repeat=args.repeat)
+    output = json.dumps(results, indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+    if results['heavy_modules']:
+        sys.exit("Modules imported by the disabled app: {}".format(", ".join(results['heavy_modules'])))
+
+    if args.max_overhead_ms is not None and results['overhead_ms'] > args.max_overhead_ms:
+        sys.exit("Startup overhead of {}ms exceeds {}ms".format(results['overhead_ms'], args.max_overhead_ms))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+
+from django.db import connections, DatabaseError, transaction
+
+from django_query_debug.utils import get_models_by_table, print_green
+
+
+logger = logging.getLogger('query_debug')
+
+_IDENTIFIER = r'(?:"(\w+)"|`(\w+)`|(\w+))'
+_COLUMN_RE = re.compile(r'(?:"(\w+)"|`(\w+)`|\b(\w+))\.(?:"(\w+)"|`(\w+)`)')
+_TABLE_RE = re.compile(r'\b(?:FROM|JOIN)\s+' + _IDENTIFIER + r'(?:\s+(?:AS\s+)?' + _IDENTIFIER + r')?',
+                       re.IGNORECASE)
+_CLAUSE_RE = re.compile(r'\b(WHERE|ORDER BY|GROUP BY|HAVING|LIMIT|OFFSET|FOR UPDATE)\b|\bJOIN\b.*?\bON\b',
+                        re.IGNORECASE)
+_RANGE_OPERATOR_RE = re.compile(r'^\s*(?:>=|<=|>|<|BETWEEN\b|LIKE\b|ILIKE\b)', re.IGNORECASE)
+_EQUALITY_OPERATOR_RE = re.compile(r'^\s*(?:=|IN\b|IS\b)', re.IGNORECASE)
+_KEYWORDS = {"INNER", "LEFT", "RIGHT", "OUTER", "FULL", "CROSS", "JOIN", "ON", "WHERE", "GROUP", "ORDER",
+             "LIMIT", "HAVING", "UNION", "AS", "USING", "NATURAL"}
+
+
+class IndexSuggestion(object):
+    """
+    A candidate composite index and the workload it would serve.
+    """
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        self.total_time = 0.0
+        self.query_count = 0
+        self.fingerprints = OrderedDict()
+        self.verified = None
+
+    @property
+    def name(self):
+        """Index name within Django's 30 character limit."""
+        prefix = "{}_{}".format(self.model._meta.model_name[:10], "_".join(self.fields))[:20]
+        digest = hashlib.md5("{}.{}".format(self.model._meta.db_table, self.fields).encode()).hexdigest()[:5]
+
+        return "{}_{}_idx".format(prefix, digest)
+
+    @property
+    def columns(self):
+        return [self.model._meta.get_field(field_name).column for field_name in self.fields]
+
+    def snippet(self):
+        """Return the `Meta.indexes` entry for this suggestion."""
+        return "models.Index(fields=[{}], name='{}')".format(", ".join("'{}'".format(f) for f in self.fields),
+                                                             self.name)
+
+    def __str__(self):
+        return "{}: {}".format(self.model._meta.label, self.snippet())
+
+
+def _table_aliases(sql):
+    aliases = {}
+
+    for match in _TABLE_RE.finditer(sql):
+        table = match.group(1) or match.group(2) or match.group(3)
+        alias = match.group(4) or match.group(5) or match.group(6)
+
+        aliases[table] = table
+        if alias and alias.upper() not in _KEYWORDS:
+            aliases[alias] = table
+
+    return aliases
+
+
+def _split_clauses(sql):
+    """Return (clause name, clause text) pairs for the WHERE, JOIN ... ON and ORDER BY clauses."""
+    matches = list(_CLAUSE_RE.finditer(sql))
+    clauses = []
+
+    for index, match in enumerate(matches):
+        name = (match.group(1) or "ON").upper()
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(sql)
+        clauses.append((name, sql[match.end():end]))
+
+    return clauses
+
+
+def extract_column_usage(sql):
+    """
+    Return the columns used by a SQL statement, per table.
+
+    The result maps each table name to a dict with `equality`, `range`, `join` and
+    `order_by` lists of column names, in order of appearance.
+    """
+    aliases = _table_aliases(sql)
+    usage = OrderedDict()
+
+    def add(table_alias, column, kind):
+        table = aliases.get(table_alias, table_alias)
+        table_usage = usage.setdefault(table, {'equality': [], 'range': [], 'join': [], 'order_by': []})
+
+        if column not in table_usage[kind]:
+            table_usage[kind].append(column)
+
+    for clause, text in _split_clauses(sql):
+        for match in _COLUMN_RE.finditer(text):
+            table_alias = match.group(1) or match.group(2) or match.group(3)
+            column = match.group(4) or match.group(5)
+            following = text[match.end():]
+
+            if clause == "ON":
+                add(table_alias, column, 'join')
+            elif clause == "ORDER BY":
+                add(table_alias, column, 'order_by')
+            elif clause in ("WHERE", "HAVING"):
+                if _EQUALITY_OPERATOR_RE.match(following):
+                    add(table_alias, column, 'equality')
+                elif _RANGE_OPERATOR_RE.match(following):
+                    add(table_alias, column, 'range')
+
+    return usage
+
+
+def get_existing_indexes(model):
+    """
+    Return the column tuples of the indexes a model already has, and the subset that are unique.
+    """
+    meta = model._meta
+    indexes = set()
+    unique_indexes = set()
+
+    def columns(field_names):
+        return tuple(meta.get_field(field_name.lstrip("-")).column for field_name in field_names)
+
+    for field in meta.concrete_fields:
+        if field.primary_key or field.unique:
+            unique_indexes.add((field.column,))
+        elif field.db_index:
+            indexes.add((field.column,))
+
+    for field_names in meta.unique_together:
+        unique_indexes.add(columns(field_names))
+    for field_names in getattr(meta, "index_together", []):
+        indexes.add(columns(field_names))
+    for index in meta.indexes:
+        if index.fields:
+            indexes.add(columns(index.fields))
+    for constraint in getattr(meta, "constraints", []):
+        if getattr(constraint, "fields", None) and getattr(constraint, "condition", None) is None:
+            unique_indexes.add(columns(constraint.fields))
+
+    return indexes | unique_indexes, unique_indexes
+
+
+def _candidate_columns(table_usage):
+    columns = list(table_usage['equality'])
+
+    for column in table_usage['join']:
+        if column not in columns:
+            columns.append(column)
+
+    if table_usage['range']:
+        # Only the first range condition can use the index, and the sort can't follow it
+        if table_usage['range'][0] not in columns:
+            columns.append(table_usage['range'][0])
+    else:
+        for column in table_usage['order_by']:
+            if column not in columns:
+                columns.append(column)
+
+    return tuple(columns)
+
+
+def _is_covered(candidate, existing_indexes, unique_indexes):
+    for unique_columns in unique_indexes:
+        # Equality on a unique index already returns at most one row
+        if set(unique_columns).issubset(candidate[:len(unique_columns)]):
+            return True
+
+    for index_columns in existing_indexes:
+        if index_columns[:len(candidate)] == candidate:
+            return True
+
+    return False
+
+
+def workload_from_report(report):
+    """Return (sql, query count, total time) entries from a `QueryBlockReport`."""
+    return [(stats['sql'], stats['count'], stats['time']) for stats in report.fingerprints.values()]
+
+
+def workload_from_stats(merged_stats):
+    """Return (sql, query count, total time) entries from stats merged with `merge_stats`."""
+    return [(fingerprint, count, query_time)
+            for fingerprint, (count, query_time, num_results) in merged_stats['queries'].items()]
+
+
+def advise_indexes(workload, limit=10, verify=False, using='default'):
+    """
+    Suggest composite indexes for a workload, ranked by the DB time of the queries they would serve.
+
+    `workload` is a `QueryBlockReport`, stats merged with `merge_stats`, or an iterable of
+    (sql, query count, total time) entries. Candidates already served by a primary key,
+    unique constraint, `db_index` field, `unique_together`, `index_together` or `Meta.indexes`
+    entry are skipped. With `verify=True`, each suggestion is checked on a SQLite database by
+    creating the index in a rolled back transaction and explaining the queries it should serve.
+    """
+    if hasattr(workload, "fingerprints"):
+        workload = workload_from_report(workload)
+    elif isinstance(workload, dict):
+        workload = workload_from_stats(workload)
+
+    models_by_table = get_models_by_table()
+    suggestions = OrderedDict()
+
+    for sql, query_count, total_time in workload:
+        if sql.lstrip()[:6].upper() != "SELECT":
+            continue
+
+        for table, table_usage in extract_column_usage(sql).items():
+            model = models_by_table.get(table)
+            candidate = _candidate_columns(table_usage)
+
+            if model is None or not candidate:
+                continue
+
+            fields_by_column = {field.column: field.name for field in model._meta.concrete_fields}
+
+            if any(column not in fields_by_column for column in candidate):
+                continue
+
+            existing_indexes, unique_indexes = get_existing_indexes(model)
+
+            if _is_covered(candidate, existing_indexes, unique_indexes):
+                continue
+
+            key = (model, candidate)
+
+            if key not in suggestions:
+                suggestions[key] = IndexSuggestion(model, [fields_by_column[column] for column in candidate])
+
+            suggestion = suggestions[key]
+            suggestion.total_time += total_time
+            suggestion.query_count += query_count
+            suggestion.fingerprints[sql] = total_time
+
+    ranked = sorted(suggestions.values(), key=lambda s: (s.total_time, s.query_count), reverse=True)[:limit]
+
+    if verify:
+        for suggestion in ranked:
+            suggestion.verified = verify_index_suggestion(suggestion, using=using)
+
+    return ranked
+
+
+def verify_index_suggestion(suggestion, using='default'):
+    """
+    Check whether SQLite would use a suggested index for the queries it should serve.
+
+    Returns None if the database is not SQLite or no query could be explained.
+    """
+    from django_query_debug.plans import explain_plan
+
+    query_connection = connections[using]
+
+    if query_connection.vendor != 'sqlite':
+        logger.warning("Index suggestions can only be verified on a SQLite database.")
+        return None
+
+    quote_name = query_connection.ops.quote_name
+    used = None
+
+    with transaction.atomic(using=using):
+        with query_connection.cursor() as cursor:
+            cursor.execute("CREATE INDEX {} ON {} ({})".format(
+                quote_name(suggestion.name),
+                quote_name(suggestion.model._meta.db_table),
+                ", ".join(quote_name(column) for column in suggestion.columns)
+            ))
+
+        for sql in suggestion.fingerprints:
+            try:
+                plan = explain_plan(sql, using=using)
+            except DatabaseError:
+                # Fingerprints with placeholders can't be explained
+                continue
+
+            used = bool(used) or any(node.index == suggestion.name for node in plan.nodes())
+
+        transaction.set_rollback(True, using=using)
+
+    return used
+
+
+def display_index_suggestions(suggestions):
+    """Log index suggestions with the workload they would serve."""
+    for suggestion in suggestions:
+        logger.info("-" * 60)
+        print_green(str(suggestion))
+        logger.info("Serves {} queries taking {}s".format(suggestion.query_count, suggestion.total_time))
+
+        if suggestion.verified is not None:
+            logger.info("Used by SQLite: {}".format("yes" if suggestion.verified else "no"))
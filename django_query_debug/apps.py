@@ -1,13 +1,33 @@
 from django.apps import AppConfig
 from django.conf import settings
 
-from django_query_debug.patch import PatchDjangoDescriptors
-
 
 class DjangoQueryDebugConfig(AppConfig):
     name = "django_query_debug"
 
     def ready(self):
+        # Features are imported only when enabled, so that a disabled app adds nothing to startup
+        if getattr(settings, "QUERY_DEBUG_QUEUED_LOGGING", False):
+            from django_query_debug.queued_logging import enable_queued_logging
+
+            enable_queued_logging(max_size=getattr(settings, "QUERY_DEBUG_LOG_QUEUE_SIZE", 10000),
+                                  overflow=getattr(settings, "QUERY_DEBUG_LOG_OVERFLOW", "drop_new"))
+
+        if getattr(settings, "QUERY_DEBUG_WORKLOAD_DIR", None):
+            from django_query_debug.workload import enable_workload_capture
+
+            enable_workload_capture(settings.QUERY_DEBUG_WORKLOAD_DIR,
+                                    max_file_size=getattr(settings, "QUERY_DEBUG_WORKLOAD_MAX_FILE_SIZE",
+                                                          50 * 1024 * 1024),
+                                    max_files=getattr(settings, "QUERY_DEBUG_WORKLOAD_MAX_FILES", 10))
+
+        if getattr(settings, "QUERY_DEBUG_METRICS", False):
+            from django_query_debug.metrics import enable_query_metrics
+
+            enable_query_metrics(max_fingerprints=getattr(settings, "QUERY_DEBUG_METRICS_MAX_FINGERPRINTS", 20))
+
         if getattr(settings, "ENABLE_QUERY_WARNINGS", False):
+            from django_query_debug.patch import PatchDjangoDescriptors
+
             # Apply patch
             PatchDjangoDescriptors()
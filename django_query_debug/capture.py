@@ -0,0 +1,289 @@
+from collections import OrderedDict
+from functools import partial
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.utils import CursorWrapper
+
+from django_query_debug.utils import fingerprint_sql, get_call_site
+
+try:
+    import contextvars
+except ImportError:
+    # Python < 3.7
+    contextvars = None
+
+
+_local = threading.local()
+
+
+def get_active_captures():
+    """Return the `QueryCapture`s open on this thread, outermost first."""
+    if not hasattr(_local, "captures"):
+        _local.captures = []
+
+    return _local.captures
+
+
+class CapturedQuery(object):
+    """
+    A query executed while a `QueryCapture` was open.
+
+    `sql` and `params` are what was sent to the database driver. `display_sql` has the
+    params interpolated, as in `connection.queries`. `call_site` is the
+    (filename, lineno, function) of the application code that ran the query.
+    """
+
+    __slots__ = ('sql', 'params', 'many', 'alias', 'start_time', 'duration', 'call_site',
+                 'display_sql', 'extra', '_fingerprint')
+
+    def __init__(self, sql, params, many, alias, start_time, duration, call_site=None, display_sql=None):
+        self.sql = sql
+        self.params = params
+        self.many = many
+        self.alias = alias
+        self.start_time = start_time
+        self.duration = duration
+        self.call_site = call_site
+        self.display_sql = display_sql or sql
+        self.extra = {}
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint_sql(self.sql)
+
+        return self._fingerprint
+
+    @property
+    def statement_type(self):
+        """First keyword of the statement, e.g. SELECT, INSERT or SAVEPOINT."""
+        return self.sql.lstrip().split(None, 1)[0].upper() if self.sql.strip() else ""
+
+    @property
+    def is_write(self):
+        return self.statement_type in ("INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+class QueryCapture(object):
+    """
+    Record every query executed on this thread's database connections while open.
+
+    Unlike `connection.queries`, it does not need `DEBUG = True`, covers every database
+    alias and records where each query came from. Set `capture_call_sites=False` to skip
+    the stack walk, and `interpolate_sql=False` to skip building `display_sql`.
+    """
+
+    def __init__(self, capture_call_sites=True, interpolate_sql=True):
+        self.capture_call_sites = capture_call_sites
+        self.interpolate_sql = interpolate_sql
+        self.queries = []
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self)
+            self._wrapped_connections.append(connection)
+
+        get_active_captures().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_captures().remove(self)
+
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self)
+
+        self._wrapped_connections = []
+
+    def __call__(self, execute, sql, params, many, context):
+        call_site = get_call_site() if self.capture_call_sites else None
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.time() - start_time
+            connection = context['connection']
+            display_sql = None
+
+            if self.interpolate_sql and not many:
+                try:
+                    display_sql = connection.ops.last_executed_query(context['cursor'].cursor, sql, params)
+                except Exception:
+                    display_sql = None
+
+            self.add_query(CapturedQuery(sql, params, many, connection.alias, start_time, duration,
+                                         call_site=call_site, display_sql=display_sql))
+
+    def add_query(self, query):
+        self.queries.append(query)
+
+    @property
+    def total_time(self):
+        return sum(query.duration for query in self.queries)
+
+
+_context_captures = contextvars.ContextVar("query_debug_captures", default=()) if contextvars else None
+
+
+def _get_task_name():
+    try:
+        import asyncio
+
+        task = asyncio.current_task()
+    except (ImportError, AttributeError, RuntimeError):
+        return None
+
+    return task.get_name() if task is not None and hasattr(task, "get_name") else None
+
+
+def _get_origin():
+    """
+    Return `task:<name>` in an asyncio task or an executor job it submitted,
+    `thread:<name>` otherwise.
+    """
+    # Executor jobs submitted by a task, e.g. with `sync_to_async`, run under the task's name
+    task_name = _get_task_name() or getattr(_local, "task_name", None)
+
+    if task_name is not None:
+        return "task:{}".format(task_name)
+
+    return "thread:{}".format(threading.current_thread().name)
+
+
+class ContextQueryCapture(QueryCapture):
+    """
+    Record every query of this thread, and of the threads, executor jobs and asyncio tasks
+    started inside it, while open.
+
+    Django connections are per thread, so queries are recorded by a patched `CursorWrapper`
+    for every connection whose context holds the capture. Threads started with
+    `threading.Thread` and jobs submitted to a `ThreadPoolExecutor` inside the capture get a
+    copy of its context, asyncio tasks and `sync_to_async` copy it themselves. Each query
+    has its origin in `extra['origin']`: `task:<name>` in asyncio tasks and the executor jobs
+    they submit, such as `sync_to_async` calls, `thread:<name>` otherwise.
+
+    Requires `contextvars`, available from Python 3.7.
+    """
+
+    def __init__(self, capture_call_sites=True, interpolate_sql=True):
+        if contextvars is None:
+            raise RuntimeError("ContextQueryCapture requires contextvars, available from Python 3.7")
+
+        super(ContextQueryCapture, self).__init__(capture_call_sites=capture_call_sites,
+                                                  interpolate_sql=interpolate_sql)
+        self._lock = threading.Lock()
+        self._tokens = []
+
+    def __enter__(self):
+        _install_context_patch()
+        self._tokens.append(_context_captures.set(_context_captures.get() + (self,)))
+        get_active_captures().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_captures().remove(self)
+        _context_captures.reset(self._tokens.pop())
+        _uninstall_context_patch()
+
+    def add_query(self, query):
+        query.extra['origin'] = _get_origin()
+
+        # Queries are added from every thread the capture followed
+        with self._lock:
+            self.queries.append(query)
+
+    def queries_by_origin(self):
+        """Return {origin: queries}, in order of each origin's first query."""
+        origins = OrderedDict()
+
+        for query in list(self.queries):
+            origins.setdefault(query.extra['origin'], []).append(query)
+
+        return origins
+
+
+def _run_for_task(task_name, job, *args, **kwargs):
+    previous_task_name = getattr(_local, "task_name", None)
+    _local.task_name = task_name
+
+    try:
+        return job(*args, **kwargs)
+    finally:
+        _local.task_name = previous_task_name
+
+
+_context_patch_lock = threading.Lock()
+_context_patch_count = 0
+_context_originals = []
+
+
+def _install_context_patch():
+    """Patch cursors, thread starts and executor submits while a `ContextQueryCapture` is open."""
+    global _context_patch_count
+
+    with _context_patch_lock:
+        _context_patch_count += 1
+
+        if _context_patch_count == 1:
+            _patch_context()
+
+
+def _uninstall_context_patch():
+    """Restore the originals once the last open `ContextQueryCapture` closed."""
+    global _context_patch_count
+
+    with _context_patch_lock:
+        _context_patch_count -= 1
+
+        if _context_patch_count == 0:
+            while _context_originals:
+                owner, name, original = _context_originals.pop()
+                setattr(owner, name, original)
+
+
+def _patch_context():
+    from concurrent.futures import thread as futures_thread
+
+    original_execute_with_wrappers = CursorWrapper._execute_with_wrappers
+    original_thread_start = threading.Thread.start
+    original_submit = futures_thread.ThreadPoolExecutor.submit
+
+    def execute_with_wrappers(self, sql, params, many, executor):
+        for capture in _context_captures.get():
+            # Innermost, so that the connection's own wrappers are not timed
+            executor = partial(capture, executor)
+
+        return original_execute_with_wrappers(self, sql, params, many, executor)
+
+    def thread_start(self):
+        # Executor workers outlive the capture, their jobs are wrapped by submit instead
+        if _context_captures.get() and getattr(self, "_target", None) is not futures_thread._worker:
+            self.run = partial(contextvars.copy_context().run, self.run)
+
+        return original_thread_start(self)
+
+    def submit(self, fn, *args, **kwargs):
+        if _context_captures.get():
+            job = partial(contextvars.copy_context().run, fn)
+            task_name = _get_task_name()
+
+            if task_name is not None:
+                # Thread local, `sync_to_async` runs the job in a context of its own
+                job = partial(_run_for_task, task_name, job)
+
+            return original_submit(self, job, *args, **kwargs)
+
+        return original_submit(self, fn, *args, **kwargs)
+
+    for owner, name, patched in ((CursorWrapper, '_execute_with_wrappers', execute_with_wrappers),
+                                 (threading.Thread, 'start', thread_start),
+                                 (futures_thread.ThreadPoolExecutor, 'submit', submit)):
+        _context_originals.append((owner, name, getattr(owner, name)))
+        setattr(owner, name, patched)
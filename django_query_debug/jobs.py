@@ -0,0 +1,297 @@
+from collections import Counter
+from functools import wraps
+import atexit
+import logging
+import random
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import connections
+
+from django_query_debug.patch import add_lazy_load_listener, PatchDjangoDescriptors, remove_lazy_load_listener
+from django_query_debug.sink import get_stats_sink
+from django_query_debug.utils import fingerprint_sql, print_green, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+OTHER = "other"
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+
+
+def get_active_invocations():
+    """Return the `JobInvocation`s open on this thread, outermost first."""
+    if not hasattr(_local, "invocations"):
+        _local.invocations = []
+
+    return _local.invocations
+
+
+class JobQueryStats(object):
+    """
+    Query stats of the invocations of a job, aggregated in constant memory.
+
+    Percentiles of the DB time per invocation are estimated from a random sample of
+    `reservoir_size` invocations, and exact until that many invocations were recorded.
+    At most `max_fingerprints` fingerprints and lazy load messages are tracked, the
+    others are counted under `other`. Stats are kept until `flush` logs and resets them.
+    """
+
+    def __init__(self, name, reservoir_size=1000, max_fingerprints=100):
+        self.name = name
+        self.reservoir_size = reservoir_size
+        self.max_fingerprints = max_fingerprints
+
+        self._lock = threading.Lock()
+        self._fingerprint_cache = {}
+        self._random = random.Random()
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.invocations = 0
+        self.errors = 0
+        self.query_count = 0
+        self.db_time = 0.0
+        self.max_query_count = 0
+        self.max_db_time = 0.0
+        self.db_time_sample = []
+        self.fingerprint_counts = Counter()
+        self.fingerprint_times = Counter()
+        self.lazy_loads = Counter()
+
+    def fingerprint(self, sql):
+        fingerprint = self._fingerprint_cache.get(sql)
+
+        if fingerprint is None:
+            if len(self._fingerprint_cache) >= self.max_fingerprints * 10:
+                self._fingerprint_cache.clear()
+
+            fingerprint = self._fingerprint_cache[sql] = fingerprint_sql(sql)
+
+        return fingerprint
+
+    @staticmethod
+    def _add(counter, key, value, max_keys):
+        if key not in counter and len(counter) >= max_keys:
+            key = OTHER
+
+        counter[key] += value
+
+    def record_invocation(self, invocation, failed=False):
+        with self._lock:
+            self.invocations += 1
+            self.errors += 1 if failed else 0
+            self.query_count += invocation.query_count
+            self.db_time += invocation.db_time
+            self.max_query_count = max(self.max_query_count, invocation.query_count)
+            self.max_db_time = max(self.max_db_time, invocation.db_time)
+
+            if len(self.db_time_sample) < self.reservoir_size:
+                self.db_time_sample.append(invocation.db_time)
+            else:
+                index = self._random.randrange(self.invocations)
+
+                if index < self.reservoir_size:
+                    self.db_time_sample[index] = invocation.db_time
+
+            for fingerprint, count in invocation.fingerprint_counts.items():
+                self._add(self.fingerprint_counts, fingerprint, count, self.max_fingerprints)
+                self._add(self.fingerprint_times, fingerprint, invocation.fingerprint_times[fingerprint],
+                          self.max_fingerprints)
+
+            for message, count in invocation.lazy_loads.items():
+                self._add(self.lazy_loads, message, count, self.max_fingerprints)
+
+    def get_percentiles(self):
+        """Return {percentile: DB time per invocation} for `PERCENTILES`."""
+        sample = sorted(self.db_time_sample)
+
+        if not sample:
+            return {}
+
+        return {percentile: sample[min(len(sample) - 1, int(len(sample) * percentile / 100.0))]
+                for percentile in PERCENTILES}
+
+    def _summary(self, top):
+        fingerprints = sorted(self.fingerprint_times.items(), key=lambda item: item[1], reverse=True)
+
+        return {
+            'name': self.name,
+            'elapsed': time.time() - self.start_time,
+            'invocations': self.invocations,
+            'errors': self.errors,
+            'query_count': self.query_count,
+            'db_time': self.db_time,
+            'max_query_count': self.max_query_count,
+            'max_db_time': self.max_db_time,
+            'db_time_percentiles': self.get_percentiles(),
+            'fingerprints': [(fingerprint, self.fingerprint_counts[fingerprint], fingerprint_time)
+                             for fingerprint, fingerprint_time in fingerprints[:top]],
+            'lazy_loads': self.lazy_loads.most_common(top),
+        }
+
+    def summary(self, top=10):
+        """Return the stats since the last flush as a dict, with the `top` fingerprints by DB time."""
+        with self._lock:
+            return self._summary(top)
+
+    def flush(self, top=10):
+        """Log the stats since the last flush, record their fingerprints to the stats sink and reset them."""
+        with self._lock:
+            summary = self._summary(top)
+            fingerprint_counts = dict(self.fingerprint_counts)
+            fingerprint_times = dict(self.fingerprint_times)
+            self.reset()
+
+        if not summary['invocations']:
+            return summary
+
+        display_job_summary(summary)
+        sink = get_stats_sink()
+
+        if sink is not None:
+            for fingerprint, count in fingerprint_counts.items():
+                sink.record_query(fingerprint, count=count, query_time=fingerprint_times[fingerprint])
+
+        return summary
+
+
+class JobInvocation(object):
+    """
+    Scope recording the queries and lazy loads of one invocation of a job on this thread.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+        self.query_count = 0
+        self.db_time = 0.0
+        self.fingerprint_counts = Counter()
+        self.fingerprint_times = Counter()
+        self.lazy_loads = Counter()
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        PatchDjangoDescriptors(force=True)
+
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self)
+            self._wrapped_connections.append(connection)
+
+        add_lazy_load_listener(self.record_lazy_load)
+        get_active_invocations().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_invocations().remove(self)
+        remove_lazy_load_listener(self.record_lazy_load)
+
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self)
+
+        self._wrapped_connections = []
+        self.stats.record_invocation(self, failed=exc_type is not None)
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.time() - start_time
+            fingerprint = self.stats.fingerprint(sql)
+            self.query_count += 1
+            self.db_time += duration
+            self.fingerprint_counts[fingerprint] += 1
+            self.fingerprint_times[fingerprint] += duration
+
+    def record_lazy_load(self, message):
+        self.lazy_loads[message] += 1
+
+
+_job_stats = weakref.WeakSet()
+
+
+class profile_job(object):
+    """
+    Decorator aggregating the queries and lazy loads of every invocation of a function,
+    e.g. a task or the body of a management command loop, into a `JobQueryStats`.
+
+    The summary is logged and reset every `flush_interval` seconds, checked when an
+    invocation ends, and at process exit. `flush_interval` defaults to the
+    `QUERY_DEBUG_JOB_FLUSH_INTERVAL` setting. The stats are available as the
+    `query_stats` attribute of the decorated function.
+    """
+
+    def __init__(self, name=None, flush_interval=None, reservoir_size=1000, max_fingerprints=100, top=10):
+        if flush_interval is None:
+            flush_interval = getattr(settings, "QUERY_DEBUG_JOB_FLUSH_INTERVAL", 300.0)
+
+        self.name = name
+        self.flush_interval = flush_interval
+        self.reservoir_size = reservoir_size
+        self.max_fingerprints = max_fingerprints
+        self.top = top
+
+    def __call__(self, func):
+        name = self.name or "{}.{}".format(func.__module__, getattr(func, "__name__", repr(func)))
+        stats = JobQueryStats(name, reservoir_size=self.reservoir_size, max_fingerprints=self.max_fingerprints)
+        flush_interval = self.flush_interval
+        top = self.top
+        _job_stats.add(stats)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Nested or recursive calls are part of the outer invocation
+            if any(invocation.stats is stats for invocation in get_active_invocations()):
+                return func(*args, **kwargs)
+
+            try:
+                with JobInvocation(stats):
+                    return func(*args, **kwargs)
+            finally:
+                if time.time() - stats.start_time >= flush_interval:
+                    stats.flush(top=top)
+
+        wrapper.query_stats = stats
+
+        return wrapper
+
+
+def display_job_summary(summary):
+    percentiles = summary['db_time_percentiles']
+    invocations = summary['invocations']
+
+    logger.info("-" * 60)
+    print_green("Job {}: {} invocations ({} failed) in {}s, {} queries, {}s in the database".format(
+        summary['name'], invocations, summary['errors'], round(summary['elapsed'], 3),
+        summary['query_count'], round(summary['db_time'], 6)
+    ))
+    logger.info("Queries per invocation: {} average, {} max".format(
+        round(summary['query_count'] / float(invocations), 2), summary['max_query_count']
+    ))
+    logger.info("DB time per invocation: {}, {}s max".format(
+        ", ".join("p{} {}s".format(percentile, round(percentiles[percentile], 6)) for percentile in PERCENTILES),
+        round(summary['max_db_time'], 6)
+    ))
+
+    for fingerprint, count, fingerprint_time in summary['fingerprints']:
+        logger.info("{} queries, {}s: {}".format(count, round(fingerprint_time, 6), fingerprint))
+
+    for message, count in summary['lazy_loads']:
+        print_yellow("{} lazy loads: {}".format(count, message))
+
+
+@atexit.register
+def _flush_job_stats():
+    for stats in list(_job_stats):
+        try:
+            stats.flush()
+        except Exception:
+            logger.exception("Failed to flush the query stats of job {}".format(stats.name))
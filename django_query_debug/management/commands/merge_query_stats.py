@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from django_query_debug.sink import merge_stats
+
+
+class Command(BaseCommand):
+    help = "Merge query and field usage stats written by django_query_debug stats sinks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+',
+                            help="Stats files or directories containing stats files.")
+        parser.add_argument('--output', default=None,
+                            help="Write the merged stats as JSON to this file.")
+        parser.add_argument('--limit', type=int, default=20,
+                            help="Number of fingerprints to display, ordered by total query time.")
+
+    def handle(self, *args, **options):
+        merged = merge_stats(options['paths'])
+
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                json.dump(merged, output_file, indent=2, sort_keys=True)
+
+        sorted_queries = sorted(merged['queries'].items(), key=lambda item: item[1][1], reverse=True)
+
+        self.stdout.write("Top queries by total time:")
+        for fingerprint, (count, query_time, num_results) in sorted_queries[:options['limit']]:
+            self.stdout.write("-" * 60)
+            self.stdout.write(fingerprint)
+            self.stdout.write("Count: {}, Total time: {}s, Total results: {}".format(count,
+                                                                                     round(query_time, 6),
+                                                                                     num_results))
+
+        self.stdout.write("=" * 60)
+        self.stdout.write("Field usage:")
+        for model_label in sorted(merged['field_usage']):
+            self.stdout.write("{}:".format(model_label))
+
+            for field_name, usage_count in sorted(merged['field_usage'][model_label].items()):
+                self.stdout.write("  {}: {}".format(field_name, usage_count))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from django_query_debug.profiling import get_sweep_urls, profile_endpoint
+
+
+class Command(BaseCommand):
+    help = ("Request URLs or call views several times and report their queries, DB and Python time, "
+            "lazy loads and cold versus warm runs, worst endpoints last.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*',
+                            help="URL paths starting with / or dotted paths to views.")
+        parser.add_argument('--sweep', action='store_true',
+                            help="Also profile every URL pattern that takes no arguments.")
+        parser.add_argument('--repeat', type=int, default=5, help="Number of runs per endpoint.")
+        parser.add_argument('--no-rollback', action='store_true',
+                            help="Keep the changes made by each run instead of rolling them back.")
+        parser.add_argument('--limit', type=int, default=5,
+                            help="Number of fingerprints and lazy loads to display per endpoint.")
+
+    def handle(self, *args, **options):
+        targets = list(options['targets'])
+
+        if options['sweep']:
+            targets.extend(url for url in get_sweep_urls() if url not in targets)
+
+        if not targets:
+            raise CommandError("Give URL paths or views to profile, or use --sweep.")
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1.")
+
+        # Allow the test client host, as in tests
+        try:
+            setup_test_environment()
+        except RuntimeError:
+            # Already set up by a test runner
+            test_environment = False
+        else:
+            test_environment = True
+
+        try:
+            profiles = [profile_endpoint(target, repeat=options['repeat'], rollback=not options['no_rollback'])
+                        for target in targets]
+        finally:
+            if test_environment:
+                teardown_test_environment()
+
+        profiles.sort(key=lambda profile: (profile.warm_query_count, profile.warm_db_time))
+
+        for profile in profiles:
+            self.display_profile(profile, options['limit'])
+
+        self.stdout.write("=" * 60)
+        self.stdout.write("Endpoints by warm query count:")
+        for profile in reversed(profiles):
+            self.stdout.write("  {:>8.1f} queries {:>10.6f}s  {}".format(profile.warm_query_count,
+                                                                         profile.warm_elapsed_time,
+                                                                         profile.target))
+
+    def display_profile(self, profile, limit):
+        cold = profile.cold
+
+        self.stdout.write("-" * 60)
+        self.stdout.write("{} ({})".format(profile.target, ", ".join(str(code) for code in profile.status_codes)))
+        for error in sorted(set(profile.errors)):
+            self.stdout.write("  Error: {}".format(error))
+        self.stdout.write("  Cold: {} queries, {}s (DB {}s, Python {}s)".format(
+            cold.query_count, round(cold.elapsed_time, 6), round(cold.db_time, 6), round(cold.python_time, 6)
+        ))
+        self.stdout.write("  Warm: {} queries, {}s (DB {}s, Python {}s)".format(
+            round(profile.warm_query_count, 1), round(profile.warm_elapsed_time, 6),
+            round(profile.warm_db_time, 6), round(profile.warm_python_time, 6)
+        ))
+
+        lazy_loads = profile.lazy_loads()
+        if lazy_loads:
+            self.stdout.write("  Lazy loads per run:")
+            for message, count in lazy_loads[:limit]:
+                self.stdout.write("    {}x {}".format(round(count, 1), message))
+
+        self.stdout.write("  Queries per run:")
+        for fingerprint, count, query_time in profile.fingerprints()[:limit]:
+            self.stdout.write("    {}x {}s {}".format(round(count, 1), round(query_time, 6), fingerprint))
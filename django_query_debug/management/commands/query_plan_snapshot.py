@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+from django_query_debug.snapshots import check_plan_snapshot
+
+
+class Command(BaseCommand):
+    help = ("Compare the query plans of a set of queries with a stored snapshot and "
+            "fail when a plan flips from an index to a full scan.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries',
+                            help="Dotted path to a callable returning querysets, (sql, params) tuples or SQL strings.")
+        parser.add_argument('--snapshot', required=True, help="Path of the snapshot JSON file.")
+        parser.add_argument('--update', action='store_true', help="Rewrite the snapshot with the current plans.")
+        parser.add_argument('--strict', action='store_true', help="Fail on any change of plan shape.")
+        parser.add_argument('--database', default='default', help="Database alias for SQL strings.")
+
+    def handle(self, *args, **options):
+        queries = import_string(options['queries'])()
+        changes = check_plan_snapshot(options['snapshot'], queries,
+                                      update=options['update'],
+                                      using=options['database'])
+        failures = []
+
+        for change in changes:
+            self.stdout.write("-" * 60)
+            self.stdout.write(change.describe())
+
+            if change.is_regression or (options['strict'] and change.old_shape is not None):
+                failures.append(change)
+
+        if options['update']:
+            self.stdout.write("Snapshot updated with {} change(s).".format(len(changes)))
+        elif failures:
+            raise CommandError("{} query plan(s) regressed.".format(len(failures)))
+        else:
+            self.stdout.write("No query plan regressions.")
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_query_debug.workload import read_workload, replay_workload
+
+
+class Command(BaseCommand):
+    help = ("Replay queries recorded by the workload capture against a database and report "
+            "the throughput and latency per fingerprint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+',
+                            help="Workload files or directories containing workload files.")
+        parser.add_argument('--database', default='default', help="Database alias to replay the queries on.")
+        parser.add_argument('--threads', type=int, default=1, help="Number of concurrent threads.")
+        parser.add_argument('--repeat', type=int, default=1, help="Number of times to replay the workload.")
+        parser.add_argument('--writes', action='store_true',
+                            help="Also replay INSERT, UPDATE and DELETE statements.")
+        parser.add_argument('--limit', type=int, default=20,
+                            help="Number of fingerprints to display, ordered by total time.")
+
+    def handle(self, *args, **options):
+        records = list(read_workload(options['paths'])) * options['repeat']
+
+        if not records:
+            raise CommandError("No queries found in {}.".format(", ".join(options['paths'])))
+
+        result = replay_workload(records,
+                                 using=options['database'],
+                                 threads=options['threads'],
+                                 include_writes=options['writes'])
+        sorted_stats = sorted(result.stats.values(), key=lambda stats: stats.total_time, reverse=True)
+
+        for stats in sorted_stats[:options['limit']]:
+            self.stdout.write("-" * 60)
+            self.stdout.write(stats.fingerprint)
+            self.stdout.write("Count: {}, Errors: {}, Mean: {}ms, p50: {}ms, p95: {}ms, p99: {}ms".format(
+                stats.count, stats.errors,
+                round(stats.mean * 1000, 3),
+                round(stats.percentile(50) * 1000, 3),
+                round(stats.percentile(95) * 1000, 3),
+                round(stats.percentile(99) * 1000, 3),
+            ))
+
+        self.stdout.write("=" * 60)
+        self.stdout.write("Replayed {} queries in {}s with {} thread(s): {} queries/s".format(
+            result.query_count, round(result.elapsed_time, 6), result.threads, round(result.throughput, 1)
+        ))
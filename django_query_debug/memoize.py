@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.models.sql.compiler import (SQLCompiler,
+                                           SQLDeleteCompiler,
+                                           SQLInsertCompiler,
+                                           SQLUpdateCompiler)
+from django.db.models.sql.constants import MULTI, SINGLE
+
+from django_query_debug.utils import print_green
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+_WRITE_COMPILERS = (SQLDeleteCompiler, SQLInsertCompiler, SQLUpdateCompiler)
+_READ_ONLY_PREFIXES = ("SELECT", "SAVEPOINT", "RELEASE SAVEPOINT")
+
+
+def _get_stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+
+    return _local.stack
+
+
+def get_current_memoizer():
+    """Return the innermost open `memoize_queries` scope on this thread, or None."""
+    stack = _get_stack()
+
+    return stack[-1] if stack else None
+
+
+class memoize_queries(object):
+    """
+    Scope in which identical read-only ORM queries are served from a per-scope result cache.
+
+    A query is identical when its SQL, params, database alias and result type match.
+    `select_for_update` and chunked `.iterator()` queries are never cached. Any other
+    statement on a connection, or a rollback, clears the cache for that connection.
+
+    Can be used as a context manager or decorator. When the scope exits, `hits`,
+    `misses` and `time_saved` hold the stats, which are also logged if there were hits.
+    """
+
+    def __init__(self, log_summary=True):
+        self.log_summary = log_summary
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.time_saved = 0.0
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        _install_patch()
+
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self._invalidate_on_write)
+            self._wrapped_connections.append(connection)
+
+        _get_stack().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _get_stack().remove(self)
+
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self._invalidate_on_write)
+
+        self._wrapped_connections = []
+        self.cache = {}
+
+        if self.log_summary and self.hits:
+            print_green("Query memoization: {} hits, {} misses, {}s saved".format(self.hits,
+                                                                                  self.misses,
+                                                                                  round(self.time_saved, 6)))
+
+    def __call__(self, func):
+        def wrapper(*args, **kwargs):
+            with memoize_queries(log_summary=self.log_summary):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def invalidate(self, alias):
+        keys = [key for key in self.cache if key[0] == alias]
+
+        for key in keys:
+            del self.cache[key]
+
+        if keys:
+            self.invalidations += 1
+
+    def _invalidate_on_write(self, execute, sql, params, many, context):
+        if not sql.lstrip()[:17].upper().startswith(_READ_ONLY_PREFIXES):
+            self.invalidate(context['connection'].alias)
+
+        return execute(sql, params, many, context)
+
+
+def _is_cacheable(compiler, result_type, chunked_fetch):
+    if result_type not in (MULTI, SINGLE) or chunked_fetch:
+        return False
+
+    return not isinstance(compiler, _WRITE_COMPILERS) and not compiler.query.select_for_update
+
+
+def _invalidate_all(alias):
+    """Invalidate every open scope on this thread, outer scopes may hold rows that were rolled back."""
+    for memoizer in _get_stack():
+        memoizer.invalidate(alias)
+
+
+_original_execute_sql = None
+
+
+def _install_patch():
+    """Patch the SQL compiler and connection rollbacks once, on first use."""
+    global _original_execute_sql
+
+    if _original_execute_sql is not None:
+        return
+
+    _original_execute_sql = SQLCompiler.execute_sql
+    original_rollback = BaseDatabaseWrapper.rollback
+    original_savepoint_rollback = BaseDatabaseWrapper.savepoint_rollback
+
+    def execute_sql(self, result_type=MULTI, *args, **kwargs):
+        memoizer = get_current_memoizer()
+        chunked_fetch = kwargs.get("chunked_fetch", args[0] if args else False)
+
+        if memoizer is None or not _is_cacheable(self, result_type, chunked_fetch):
+            return _original_execute_sql(self, result_type, *args, **kwargs)
+
+        try:
+            sql, params = self.as_sql()
+            key = (self.using, sql, tuple(params), result_type)
+            cached = memoizer.cache.get(key)
+        except Exception:
+            # Empty results and unhashable params are left to the original method
+            return _original_execute_sql(self, result_type, *args, **kwargs)
+
+        if cached is not None:
+            result, duration = cached
+            memoizer.hits += 1
+            memoizer.time_saved += duration
+
+            return list(result) if result_type == MULTI else result
+
+        # Reuse the compiled SQL instead of compiling the query twice
+        self.as_sql = lambda *as_sql_args, **as_sql_kwargs: (sql, params)
+        start_time = time.time()
+
+        try:
+            result = _original_execute_sql(self, result_type, *args, **kwargs)
+        finally:
+            del self.as_sql
+
+        if result_type == MULTI:
+            result = list(result)
+
+        memoizer.misses += 1
+        memoizer.cache[key] = (result, time.time() - start_time)
+
+        return list(result) if result_type == MULTI else result
+
+    def rollback(self, *args, **kwargs):
+        _invalidate_all(self.alias)
+
+        return original_rollback(self, *args, **kwargs)
+
+    def savepoint_rollback(self, *args, **kwargs):
+        _invalidate_all(self.alias)
+
+        return original_savepoint_rollback(self, *args, **kwargs)
+
+    SQLCompiler.execute_sql = execute_sql
+    BaseDatabaseWrapper.rollback = rollback
+    BaseDatabaseWrapper.savepoint_rollback = savepoint_rollback
@@ -0,0 +1,216 @@
+from collections import OrderedDict
+import logging
+import threading
+import tracemalloc
+
+from django.db.models.query import ModelIterable, QuerySet
+
+from django_query_debug.utils import fingerprint_sql, get_call_site, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+
+
+def get_active_profilers():
+    """Return the `QuerysetMemoryProfiler`s open on this thread, outermost first."""
+    if not hasattr(_local, "profilers"):
+        _local.profilers = []
+
+    return _local.profilers
+
+
+def _format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return "{}{}".format(round(size, 1), unit)
+        size /= 1024.0
+
+    return "{}GiB".format(round(size, 1))
+
+
+class QuerysetMemoryStats(object):
+    """
+    Memory allocated by the evaluations of one query fingerprint from one call site.
+
+    `peak` is the largest peak of a single evaluation and `retained` the total memory
+    still allocated when the evaluations returned, mostly the result caches.
+    """
+
+    def __init__(self, fingerprint, call_site, model, returns_instances):
+        self.fingerprint = fingerprint
+        self.call_site = call_site
+        self.model = model
+        self.returns_instances = returns_instances
+        self.evaluations = 0
+        self.rows = 0
+        self.peak = 0
+        self.retained = 0
+
+    @property
+    def bytes_per_row(self):
+        return self.retained / float(self.rows) if self.rows else 0.0
+
+    @property
+    def bytes_per_instance(self):
+        return self.bytes_per_row if self.returns_instances else None
+
+    def suggestion(self, threshold):
+        if self.peak < threshold:
+            return None
+
+        if self.returns_instances:
+            return "Use .iterator(chunk_size=2000) to stream the instances, or .values() to skip building them"
+
+        return "Use .iterator(chunk_size=2000) to stream the results"
+
+    def describe(self):
+        filename, lineno, function = self.call_site or ("<unknown>", 0, "<unknown>")
+
+        return "{} evaluation(s) of {} rows from {}:{} in {}: peak {}, retained {}, {} per row".format(
+            self.evaluations, self.rows, filename, lineno, function, _format_bytes(self.peak),
+            _format_bytes(self.retained), _format_bytes(self.bytes_per_row)
+        )
+
+
+class _Evaluation(object):
+    def __init__(self, start_memory, query_index):
+        self.start_memory = start_memory
+        self.query_index = query_index
+        self.peak = start_memory
+
+
+class QuerysetMemoryProfiler(object):
+    """
+    Measure the memory allocated by each queryset evaluation with `tracemalloc`.
+
+    Evaluations are attributed to the fingerprint of the first query they run and
+    to the application code that evaluated the queryset. Tracing is started while
+    the profiler is open if it was not already running. Snapshots taken when the
+    profiler opens and closes give the code locations that retained the most memory.
+    """
+
+    def __init__(self, capture, threshold=10 * 1024 * 1024):
+        self.capture = capture
+        self.threshold = threshold
+        self.stats = OrderedDict()
+        self.top_retained = []
+        self._evaluations = []
+        self._started_tracing = False
+        self._start_snapshot = None
+
+    def __enter__(self):
+        _install_patch()
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        self._start_snapshot = tracemalloc.take_snapshot()
+        get_active_profilers().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_profilers().remove(self)
+
+        snapshot = tracemalloc.take_snapshot()
+        self.top_retained = [stat for stat in snapshot.compare_to(self._start_snapshot, 'lineno')[:10]
+                             if stat.size_diff > 0]
+        self._start_snapshot = None
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _fold_peak(self):
+        """Keep the peak of the evaluations in progress before the traced peak is reset."""
+        current, peak = tracemalloc.get_traced_memory()
+
+        for evaluation in self._evaluations:
+            evaluation.peak = max(evaluation.peak, peak)
+
+        return current
+
+    def start_evaluation(self):
+        current = self._fold_peak()
+
+        # Python < 3.9 can only report the peak since tracing started
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+        self._evaluations.append(_Evaluation(current, len(self.capture.queries)))
+
+    def end_evaluation(self, queryset, rows, call_site):
+        self._fold_peak()
+        evaluation = self._evaluations.pop()
+        current = tracemalloc.get_traced_memory()[0]
+        queries = [query for query in self.capture.queries[evaluation.query_index:]
+                   if query.statement_type == "SELECT"]
+
+        if not queries:
+            return
+
+        fingerprint = fingerprint_sql(queries[0].sql)
+        key = (fingerprint, call_site)
+
+        if key not in self.stats:
+            self.stats[key] = QuerysetMemoryStats(fingerprint, call_site, queryset.model,
+                                                  issubclass(queryset._iterable_class, ModelIterable))
+
+        stats = self.stats[key]
+        stats.evaluations += 1
+        stats.rows += rows
+        stats.peak = max(stats.peak, evaluation.peak - evaluation.start_memory)
+        stats.retained += max(current - evaluation.start_memory, 0)
+
+    def get_stats(self):
+        """Return the `QuerysetMemoryStats`, largest peak first."""
+        return sorted(self.stats.values(), key=lambda stats: stats.peak, reverse=True)
+
+
+def display_memory_stats(stats_list, top_retained, threshold):
+    for stats in stats_list:
+        logger.info("-" * 60)
+        logger.info("Memory: {}".format(stats.describe()))
+        logger.info(stats.fingerprint)
+
+        suggestion = stats.suggestion(threshold)
+        if suggestion:
+            print_yellow(suggestion)
+
+    if top_retained:
+        logger.info("-" * 60)
+        logger.info("Top retained allocations:")
+        for stat in top_retained:
+            logger.info(str(stat))
+
+
+_original_fetch_all = None
+
+
+def _install_patch():
+    """Patch `QuerySet._fetch_all` once, on first use."""
+    global _original_fetch_all
+
+    if _original_fetch_all is not None:
+        return
+
+    _original_fetch_all = QuerySet._fetch_all
+
+    def _fetch_all(self):
+        profilers = get_active_profilers()
+
+        if not profilers or self._result_cache is not None:
+            return _original_fetch_all(self)
+
+        profiler = profilers[-1]
+        profiler.start_evaluation()
+
+        try:
+            _original_fetch_all(self)
+        finally:
+            profiler.end_evaluation(self, len(self._result_cache or ()), get_call_site())
+
+    QuerySet._fetch_all = _fetch_all
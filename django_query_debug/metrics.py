@@ -0,0 +1,468 @@
+from collections import Counter
+import bisect
+import threading
+import time
+import weakref
+
+from django.apps import apps
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse
+
+from django_query_debug.patch import add_lazy_load_listener, PatchDjangoDescriptors, remove_lazy_load_listener
+from django_query_debug.utils import fingerprint_sql
+
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFAULT_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+NO_VIEW = "none"
+OTHER = "other"
+
+
+class _Histogram(object):
+    __slots__ = ('bucket_counts', 'sum', 'count')
+
+    def __init__(self, size):
+        self.bucket_counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class _Shard(object):
+    """Metrics recorded by one thread, only ever updated by that thread."""
+
+    def __init__(self, metrics):
+        self.queries = Counter()
+        self.db_seconds = Counter()
+        self.duplicates = Counter()
+        self.fingerprint_queries = Counter()
+        self.fingerprint_seconds = Counter()
+        self.lazy_loads = Counter()
+        self.request_db_seconds = {}
+        self.request_queries = {}
+        self.max_keys = metrics.max_tracked_fingerprints
+
+
+class _RequestState(object):
+    __slots__ = ('view', 'query_count', 'db_time', 'seen')
+
+    def __init__(self, view):
+        self.view = view
+        self.query_count = 0
+        self.db_time = 0.0
+        self.seen = set()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 9))
+
+    return str(value)
+
+
+class QueryMetrics(object):
+    """
+    In-process counters and histograms of queries, DB time, duplicate queries, lazy loads and
+    field usage, rendered in the OpenMetrics text format.
+
+    Updates take no lock: every thread records into its own shard, and the shards are only
+    merged when rendered. Fingerprints are exposed as the `max_fingerprints` most frequent
+    plus `other`, and at most `max_tracked_fingerprints` distinct fingerprints and lazy loads
+    are tracked per thread. The shards of threads that ended are folded into a single
+    retired shard, so recycled threads do not grow memory.
+    """
+
+    def __init__(self, max_fingerprints=20, max_tracked_fingerprints=1000, buckets=DEFAULT_BUCKETS,
+                 count_buckets=DEFAULT_COUNT_BUCKETS):
+        self.max_fingerprints = max_fingerprints
+        self.max_tracked_fingerprints = max_tracked_fingerprints
+        self.buckets = tuple(buckets)
+        self.count_buckets = tuple(count_buckets)
+
+        self._local = threading.local()
+        # (thread weakref, shard) of the threads that recorded metrics
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._retired = _Shard(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+
+        if shard is None:
+            shard = self._local.shard = _Shard(self)
+
+            # Once per thread
+            with self._shards_lock:
+                self._retire_dead_shards()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+
+        return shard
+
+    def _retire_dead_shards(self):
+        """Fold the shards of the threads that ended into the retired shard, under `_shards_lock`."""
+        live_shards = []
+
+        for thread_ref, shard in self._shards:
+            thread = thread_ref()
+
+            if thread is not None and thread.is_alive():
+                live_shards.append((thread_ref, shard))
+            else:
+                self._retire(shard)
+
+        self._shards = live_shards
+
+    def _retire(self, shard):
+        retired = self._retired
+
+        for attribute in ('queries', 'db_seconds', 'duplicates'):
+            getattr(retired, attribute).update(getattr(shard, attribute))
+
+        for fingerprint, count in shard.fingerprint_queries.items():
+            key = fingerprint
+
+            if key not in retired.fingerprint_queries and len(retired.fingerprint_queries) >= retired.max_keys:
+                key = OTHER
+
+            retired.fingerprint_queries[key] += count
+            retired.fingerprint_seconds[key] += shard.fingerprint_seconds[fingerprint]
+
+        for message, count in shard.lazy_loads.items():
+            key = message
+
+            if key not in retired.lazy_loads and len(retired.lazy_loads) >= retired.max_keys:
+                key = OTHER
+
+            retired.lazy_loads[key] += count
+
+        for attribute in ('request_db_seconds', 'request_queries'):
+            retired_histograms = getattr(retired, attribute)
+
+            for key, histogram in getattr(shard, attribute).items():
+                total = retired_histograms.get(key)
+
+                if total is None:
+                    retired_histograms[key] = histogram
+                else:
+                    total.bucket_counts = [a + b for a, b in zip(total.bucket_counts, histogram.bucket_counts)]
+                    total.sum += histogram.sum
+                    total.count += histogram.count
+
+    def _collect_shards(self):
+        """Return the retired and live shards, under `_shards_lock` since it guards the retired shard."""
+        self._retire_dead_shards()
+
+        return [self._retired] + [shard for thread_ref, shard in self._shards]
+
+    def begin_request(self, view):
+        self._local.request = _RequestState(view)
+
+    def set_request_view(self, view):
+        request = getattr(self._local, "request", None)
+
+        if request is not None:
+            request.view = view
+
+    def end_request(self):
+        """Record the DB time and query count of the current request."""
+        request = getattr(self._local, "request", None)
+
+        if request is None:
+            return
+
+        self._local.request = None
+        shard = self._shard()
+        self._observe(shard.request_db_seconds, request.view, self.buckets, request.db_time)
+        self._observe(shard.request_queries, request.view, self.count_buckets, request.query_count)
+
+    @staticmethod
+    def _observe(histograms, key, buckets, value):
+        histogram = histograms.get(key)
+
+        if histogram is None:
+            histogram = histograms[key] = _Histogram(len(buckets))
+
+        index = bisect.bisect_left(buckets, value)
+
+        if index < len(buckets):
+            histogram.bucket_counts[index] += 1
+
+        histogram.sum += value
+        histogram.count += 1
+
+    def record_query(self, sql, params, duration):
+        shard = self._shard()
+        request = getattr(self._local, "request", None)
+        view = request.view if request is not None else NO_VIEW
+
+        shard.queries[view] += 1
+        shard.db_seconds[view] += duration
+
+        if request is not None:
+            request.query_count += 1
+            request.db_time += duration
+            key = (sql, repr(params))
+
+            if key in request.seen:
+                shard.duplicates[view] += 1
+            else:
+                request.seen.add(key)
+
+        fingerprint = fingerprint_sql(sql)
+
+        if fingerprint not in shard.fingerprint_queries and len(shard.fingerprint_queries) >= shard.max_keys:
+            fingerprint = OTHER
+
+        shard.fingerprint_queries[fingerprint] += 1
+        shard.fingerprint_seconds[fingerprint] += duration
+
+    def record_lazy_load(self, message):
+        shard = self._shard()
+
+        if message not in shard.lazy_loads and len(shard.lazy_loads) >= shard.max_keys:
+            message = OTHER
+
+        shard.lazy_loads[message] += 1
+
+    def _merged(self, attribute):
+        merged = Counter()
+
+        with self._shards_lock:
+            for shard in self._collect_shards():
+                # Copied first, the owning thread may be adding keys
+                merged.update(dict(getattr(shard, attribute)))
+
+        return merged
+
+    def _merged_histograms(self, attribute, size):
+        merged = {}
+
+        with self._shards_lock:
+            for shard in self._collect_shards():
+                for key, histogram in list(getattr(shard, attribute).items()):
+                    if key not in merged:
+                        merged[key] = _Histogram(size)
+
+                    total = merged[key]
+                    total.bucket_counts = [a + b for a, b in zip(total.bucket_counts, histogram.bucket_counts)]
+                    total.sum += histogram.sum
+                    total.count += histogram.count
+
+        return merged
+
+    def _top_fingerprints(self):
+        """Return {fingerprint: (count, seconds)} for the most frequent fingerprints, plus `other`."""
+        counts = self._merged('fingerprint_queries')
+        seconds = self._merged('fingerprint_seconds')
+        top = {}
+        top_count = 0
+
+        for fingerprint, count in counts.most_common():
+            if fingerprint != OTHER and top_count < self.max_fingerprints:
+                top[fingerprint] = (count, seconds[fingerprint])
+                top_count += 1
+            else:
+                other_count, other_seconds = top.get(OTHER, (0, 0.0))
+                top[OTHER] = (other_count + count, other_seconds + seconds[fingerprint])
+
+        return top
+
+    def render(self):
+        """Return all metrics in the OpenMetrics text format."""
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            lines.append("# HELP {} {}".format(name, help_text))
+
+            for suffix, labels, value in samples:
+                label_text = ",".join('{}="{}"'.format(label, _escape(label_value))
+                                      for label, label_value in labels)
+                lines.append("{}{}{} {}".format(name, suffix, "{" + label_text + "}" if label_text else "",
+                                                _format_value(value)))
+
+        def counter_samples(label, counter):
+            return [("_total", [(label, key)], value) for key, value in sorted(counter.items())]
+
+        family("query_debug_queries", "counter", "Queries executed.",
+               counter_samples("view", self._merged('queries')))
+        family("query_debug_db_seconds", "counter", "Time spent executing queries.",
+               counter_samples("view", self._merged('db_seconds')))
+        family("query_debug_duplicate_queries", "counter",
+               "Queries repeated with the same SQL and params within a request.",
+               counter_samples("view", self._merged('duplicates')))
+
+        top = self._top_fingerprints()
+        family("query_debug_fingerprint_queries", "counter", "Queries executed per fingerprint.",
+               [("_total", [("fingerprint", fingerprint)], count)
+                for fingerprint, (count, seconds) in sorted(top.items())])
+        family("query_debug_fingerprint_db_seconds", "counter", "Time spent executing queries per fingerprint.",
+               [("_total", [("fingerprint", fingerprint)], seconds)
+                for fingerprint, (count, seconds) in sorted(top.items())])
+
+        family("query_debug_lazy_loads", "counter", "Lazy loads of uncached relations and deferred fields.",
+               counter_samples("lazy_load", self._merged('lazy_loads')))
+
+        for name, attribute, buckets, help_text in (
+            ("query_debug_request_db_seconds", 'request_db_seconds', self.buckets, "DB time per request."),
+            ("query_debug_request_queries", 'request_queries', self.count_buckets, "Queries per request."),
+        ):
+            samples = []
+
+            for view, histogram in sorted(self._merged_histograms(attribute, len(buckets)).items()):
+                cumulative = 0
+
+                for bound, bucket_count in zip(buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    samples.append(("_bucket", [("view", view), ("le", _format_value(float(bound)))], cumulative))
+
+                samples.append(("_bucket", [("view", view), ("le", "+Inf")], histogram.count))
+                samples.append(("_sum", [("view", view)], float(histogram.sum)))
+                samples.append(("_count", [("view", view)], histogram.count))
+
+            family(name, "histogram", help_text, samples)
+
+        family("query_debug_field_usage_ratio", "gauge", "Share of the fields of a FieldUsageMixin model read.",
+               [("", [("model", label)], ratio) for label, ratio in get_field_usage_ratios()])
+
+        lines.append("# EOF")
+
+        return "\n".join(lines) + "\n"
+
+
+def get_field_usage_ratios():
+    """Return (model label, ratio of fields read at least once) for the `FieldUsageMixin` models in use."""
+    ratios = []
+
+    for model in apps.get_models():
+        field_usage = model.__dict__.get("_field_usage")
+
+        if field_usage:
+            used_count = sum(1 for usage_count in list(field_usage.values()) if usage_count)
+            ratios.append((model._meta.label, used_count / float(len(field_usage))))
+
+    return sorted(ratios)
+
+
+class MetricsRecorder(object):
+    """
+    Connection execute wrapper that records every query to a `QueryMetrics`.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __call__(self, execute, sql, params, many, context):
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.metrics.record_query(sql, params, time.time() - start_time)
+
+
+_metrics = None
+_recorder = None
+
+
+def get_query_metrics():
+    """Return the process wide `QueryMetrics` enabled by `enable_query_metrics`, or None."""
+    return _metrics
+
+
+def _add_recorder(sender, connection, **kwargs):
+    if _recorder is not None and _recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_recorder)
+
+
+def enable_query_metrics(**metrics_options):
+    """
+    Record the queries of every connection, in every thread, and the lazy loads detected by
+    `PatchDjangoDescriptors`, which is applied if needed.
+
+    Add `QueryMetricsMiddleware` to label the metrics by view and record per request histograms.
+    """
+    global _metrics, _recorder
+
+    disable_query_metrics()
+
+    _metrics = QueryMetrics(**metrics_options)
+    _recorder = MetricsRecorder(_metrics)
+    connection_created.connect(_add_recorder, dispatch_uid="query_debug_metrics")
+
+    for alias in connections:
+        _add_recorder(None, connections[alias])
+
+    PatchDjangoDescriptors(force=True)
+    add_lazy_load_listener(_metrics.record_lazy_load, all_threads=True)
+
+    return _metrics
+
+
+def disable_query_metrics():
+    global _metrics, _recorder
+
+    if _metrics is None:
+        return
+
+    connection_created.disconnect(dispatch_uid="query_debug_metrics")
+
+    for alias in connections:
+        if _recorder in connections[alias].execute_wrappers:
+            connections[alias].execute_wrappers.remove(_recorder)
+
+    remove_lazy_load_listener(_metrics.record_lazy_load, all_threads=True)
+    _metrics = None
+    _recorder = None
+
+
+class QueryMetricsMiddleware(object):
+    """
+    Label the query metrics of each request with its view, and record the DB time and
+    query count per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = get_query_metrics()
+
+        if metrics is None:
+            return self.get_response(request)
+
+        # Relabeled by process_view once the view is resolved
+        metrics.begin_request(NO_VIEW)
+
+        try:
+            return self.get_response(request)
+        finally:
+            metrics.end_request()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = get_query_metrics()
+
+        if metrics is None:
+            return
+
+        match = getattr(request, "resolver_match", None)
+
+        if match is not None and match.url_name:
+            metrics.set_request_view(match.view_name)
+        else:
+            metrics.set_request_view("{}.{}".format(view_func.__module__, getattr(view_func, "__name__", "view")))
+
+
+def metrics_view(request):
+    """Serve the query metrics in the OpenMetrics text format."""
+    metrics = get_query_metrics()
+    body = metrics.render() if metrics is not None else "# EOF\n"
+
+    return HttpResponse(body, content_type=OPENMETRICS_CONTENT_TYPE)
@@ -0,0 +1,16 @@
+from django_query_debug.memoize import memoize_queries
+
+
+class QueryMemoizationMiddleware(object):
+    """
+    Serve identical read-only queries from a per-request cache.
+
+    See `django_query_debug.memoize.memoize_queries`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with memoize_queries():
+            return self.get_response(request)
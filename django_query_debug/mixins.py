@@ -7,7 +7,9 @@ from django.db.models.fields.related import RelatedField, ManyToManyRel, Foreign
 from django.db.models.fields.related_descriptors import ManyToManyDescriptor
 from six import with_metaclass
 
-from django_query_debug.utils import FieldUsageSession, print_green, print_yellow
+from django_query_debug.overfetch import record_field_read
+from django_query_debug.session import FieldUsageSession
+from django_query_debug.utils import print_green, print_yellow
 
 logger = logging.getLogger('query_debug')
 
@@ -20,17 +22,19 @@ class UsageTrackingDescriptor(object):
     def __get__(self, instance, owner):
         if not FieldUsageSession.has_current or not FieldUsageSession.current.disable_tracking:
             instance.get_field_usage()[self.field_name] += 1
+            record_field_read(instance, self.field_name)
 
         if hasattr(self.value, "__get__"):
             return self.value.__get__(instance, owner)
 
-        return self.value
+        return instance.__dict__.get(self.field_name, self.value)
 
     def __set__(self, instance, value):
         if hasattr(self.value, "__set__"):
             self.value.__set__(instance, value)
         else:
-            self.value = value
+            # Field values are per instance, Django's field descriptors read them from __dict__
+            instance.__dict__[self.field_name] = value
 
 
 class FieldUsageTrackerMeta(ModelBase):
@@ -94,6 +98,32 @@ class FieldUsageMixin(with_metaclass(FieldUsageTrackerMeta)):
             for field_name in self._field_usage.keys()
         }
 
+    def export_field_usage(self, sink=None):
+        """
+        Record the current field usage to a stats sink and reset the counts.
+
+        Defaults to the sink configured by `QUERY_DEBUG_STATS_DIR`.
+        Counts are reset so that repeated exports only record new usage.
+        """
+        from django_query_debug.sink import get_stats_sink
+
+        if sink is None:
+            sink = get_stats_sink()
+
+        if sink is None:
+            return
+
+        # Swap in fresh counts before recording so concurrent increments go to the new dict
+        field_usage = self.get_field_usage()
+        reset_usage = {field_name: 0 for field_name in field_usage}
+
+        if "_field_usage" in self.__dict__:
+            self._field_usage = reset_usage
+        else:
+            type(self)._field_usage = reset_usage
+
+        sink.record_field_usage(self._meta.label, field_usage)
+
     @staticmethod
     def _indented_msg(msg, indent_level):
         return "{}{}".format(' ' * indent_level, msg)
@@ -0,0 +1,461 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+import weakref
+
+from django.db.models.base import Model
+from django.db.models.query import ModelIterable, RawQuerySet, RelatedPopulator
+
+from django_query_debug.capture import _get_origin
+from django_query_debug.utils import print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+
+
+def get_active_trackers():
+    """Return the `InstanceUsageTracker`s open on this thread, outermost first."""
+    if not hasattr(_local, "trackers"):
+        _local.trackers = []
+
+    return _local.trackers
+
+
+def _get_hydrations():
+    """Return the queryset iterations building instances on this thread, innermost last."""
+    if not hasattr(_local, "hydrations"):
+        _local.hydrations = []
+
+    return _local.hydrations
+
+
+class _Hydration(object):
+    """
+    One queryset iteration. Its query is the first SELECT each tracker captured
+    once the iteration started, found on first use.
+    """
+
+    def __init__(self, trackers):
+        self.starts = {tracker: len(tracker.capture.queries) for tracker in trackers}
+        self.queries = {}
+
+
+def _iterate_with_hydration(iterator, trackers):
+    hydration = _Hydration(trackers)
+    hydrations = _get_hydrations()
+
+    while True:
+        # Only current while the iteration runs, not while the caller handles an instance
+        hydrations.append(hydration)
+
+        try:
+            instance = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            hydrations.pop()
+
+        yield instance
+
+
+def _get_path_stack():
+    """Return the `select_related` path being populated on this thread, as a list of field names."""
+    if not hasattr(_local, "paths"):
+        _local.paths = []
+
+    return _local.paths
+
+
+def _value_size(value):
+    """Approximate size in bytes of a value loaded from the database."""
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return 8
+    if hasattr(value, '__len__'):
+        return len(value)
+
+    return len(str(value))
+
+
+def record_field_read(instance, field_name):
+    """Called by `FieldUsageMixin` descriptors when a field of an instance is read."""
+    for tracker in get_active_trackers():
+        tracker.record_field_read(instance, field_name)
+
+
+class InstanceFetch(object):
+    """
+    Instances of one model hydrated from the results of one query.
+
+    `path` is the `select_related` path of instances loaded by a join, e.g. `author__publisher`,
+    and None for the instances of the queried model. `populate_time` is the time spent building
+    the instances of the path and its nested paths.
+    """
+
+    def __init__(self, query, model, field_names, path=None):
+        self.query = query
+        self.model = model
+        self.field_names = list(field_names)
+        self.path = path
+        self.populate_time = 0.0
+        self.tracks_field_usage = hasattr(model, 'get_field_usage')
+        self.sizes = []
+        self.reads = []
+
+    def add(self, values):
+        self.sizes.append([_value_size(value) for value in values])
+        self.reads.append(None)
+
+        return len(self.sizes) - 1
+
+    def mark_read(self, index, field_name):
+        try:
+            field_name = self.model._meta.get_field(field_name).attname
+        except Exception:
+            pass
+
+        if self.reads[index] is None:
+            self.reads[index] = set()
+
+        self.reads[index].add(field_name)
+
+    @property
+    def instance_count(self):
+        return len(self.sizes)
+
+    @property
+    def used_instance_count(self):
+        return sum(1 for reads in self.reads if reads is not None)
+
+    @property
+    def fields_read(self):
+        fields_read = set()
+
+        for reads in self.reads:
+            fields_read.update(reads or ())
+
+        return [field_name for field_name in self.field_names if field_name in fields_read]
+
+    @property
+    def total_bytes(self):
+        return sum(sum(sizes) for sizes in self.sizes)
+
+    @property
+    def wasted_bytes(self):
+        """Bytes of the values loaded into instances that were never read."""
+        wasted = 0
+
+        for sizes, reads in zip(self.sizes, self.reads):
+            if reads is None:
+                wasted += sum(sizes)
+            else:
+                wasted += sum(size for field_name, size in zip(self.field_names, sizes) if field_name not in reads)
+
+        return wasted
+
+
+class OverFetchFinding(object):
+    """
+    A query that loaded more rows or columns than the code used.
+    """
+
+    def __init__(self, fetch, rows, suggestion):
+        self.query = fetch.query
+        self.model = fetch.model
+        self.rows = rows
+        self.instances = fetch.instance_count
+        self.used_instances = fetch.used_instance_count
+        self.fields = fetch.field_names
+        self.fields_read = fetch.fields_read
+        self.total_bytes = fetch.total_bytes
+        self.wasted_bytes = fetch.wasted_bytes
+        self.suggestion = suggestion
+
+    def describe(self):
+        return "{}: {} rows, {} instances, {} used, {}/{} fields read, ~{} of ~{} bytes unused".format(
+            self.model._meta.label, self.rows, self.instances, self.used_instances,
+            len(self.fields_read), len(self.fields), self.wasted_bytes, self.total_bytes
+        )
+
+
+class InstanceUsageTracker(object):
+    """
+    Attribute the model instances created with `Model.from_db` to the queries captured
+    by a `QueryCapture`, and the field reads of `FieldUsageMixin` models to those instances.
+    """
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.fetches = OrderedDict()
+        # Keyed by id() since model instances compare and hash by primary key
+        self._instances = {}
+
+    def __enter__(self):
+        _install_patch()
+        get_active_trackers().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_trackers().remove(self)
+
+    def _find_query(self, alias):
+        """Return the query of the innermost queryset iteration on this thread, or None."""
+        hydrations = _get_hydrations()
+
+        if not hydrations:
+            return None
+
+        hydration = hydrations[-1]
+
+        if self not in hydration.queries:
+            start = hydration.starts.get(self)
+            origin = _get_origin()
+            hydration.queries[self] = None
+
+            if start is not None:
+                for query in self.capture.queries[start:]:
+                    # A `ContextQueryCapture` also has the queries of other threads and tasks
+                    same_origin = query.extra.get('origin', origin) == origin
+
+                    if query.alias == alias and query.statement_type == "SELECT" and same_origin:
+                        hydration.queries[self] = query
+                        break
+
+        return hydration.queries[self]
+
+    def record_instance(self, model, alias, field_names, values, instance, path=None):
+        query = self._find_query(alias)
+
+        if query is None:
+            return
+
+        key = (id(query), model, path)
+
+        if key not in self.fetches:
+            self.fetches[key] = InstanceFetch(query, model, field_names, path=path)
+
+        index = self.fetches[key].add(values)
+        instance_id = id(instance)
+        self._instances[instance_id] = (weakref.ref(instance, lambda ref: self._instances.pop(instance_id, None)),
+                                        self.fetches[key], index)
+
+    def record_populate_time(self, model, alias, path, populate_time):
+        query = self._find_query(alias)
+        fetch = self.fetches.get((id(query), model, path)) if query is not None else None
+
+        if fetch is not None:
+            fetch.populate_time += populate_time
+
+    def record_field_read(self, instance, field_name):
+        entry = self._instances.get(id(instance))
+
+        if entry is not None and entry[0]() is instance:
+            entry[1].mark_read(entry[2], field_name)
+
+    def find_over_fetching(self, row_counts=None, min_rows=100, used_ratio=0.1):
+        """
+        Return `OverFetchFinding`s sorted by wasted bytes, largest first.
+
+        Flags instances that were never read, queries of at least `min_rows` rows of which at most
+        `used_ratio` were used, and queries of at least `min_rows` rows that read less than half
+        the columns. Only `FieldUsageMixin` models report reads, other models are skipped.
+        `row_counts` maps the display SQL of queries to the rows they returned.
+        """
+        findings = []
+
+        for fetch in self.fetches.values():
+            if not fetch.tracks_field_usage or fetch.path is not None:
+                continue
+
+            instances = fetch.instance_count
+            used_instances = fetch.used_instance_count
+            fields_read = fetch.fields_read
+            rows = (row_counts or {}).get(fetch.query.display_sql) or instances
+            model_name = fetch.model.__name__
+
+            if used_instances == 0:
+                suggestion = ("No field of the {} loaded instances was read, "
+                              "use .exists() or .count()".format(instances))
+            elif instances >= min_rows and used_instances <= instances * used_ratio:
+                suggestion = ("Only {} of {} {} instances were used, filter or slice "
+                              "the queryset".format(used_instances, instances, model_name))
+            elif instances >= min_rows and len(fields_read) * 2 < len(fetch.field_names):
+                suggestion = ("Only [{}] were read, use .values_list() or .only() with "
+                              "these fields".format(", ".join("'{}'".format(field) for field in fields_read)))
+            else:
+                continue
+
+            findings.append(OverFetchFinding(fetch, rows, suggestion))
+
+        return sorted(findings, key=lambda finding: finding.wasted_bytes, reverse=True)
+
+    def find_wasted_joins(self):
+        """
+        Return `WastedJoin`s for the `select_related` paths whose instances were never read,
+        or of which less than half the columns were read, most costly first.
+
+        Only paths to `FieldUsageMixin` models report reads, other paths are skipped.
+        """
+        findings = []
+
+        for fetch in self.fetches.values():
+            if fetch.path is None or not fetch.tracks_field_usage:
+                continue
+
+            query_fetches = [other for other in self.fetches.values() if other.query is fetch.query]
+            # The path and the paths joined through it
+            path_fetches = [other for other in query_fetches
+                            if other.path is not None and (other.path + "__").startswith(fetch.path + "__")]
+            used = any(other.used_instance_count for other in path_fetches)
+            fields_read = fetch.fields_read
+
+            if not used:
+                suggestion = "Remove '{}' from select_related(), none of its {} instances were read".format(
+                    fetch.path, fetch.instance_count
+                )
+            elif len(fields_read) * 2 < len(fetch.field_names):
+                suggestion = "Only [{}] of '{}' were read, limit its columns with .only()".format(
+                    ", ".join("'{}__{}'".format(fetch.path, field) for field in fields_read), fetch.path
+                )
+            else:
+                continue
+
+            path_columns = sum(len(other.field_names) for other in path_fetches)
+            total_columns = sum(len(other.field_names) for other in query_fetches)
+            findings.append(WastedJoin(fetch, path_columns / float(total_columns), suggestion))
+
+        return sorted(findings, key=lambda finding: finding.cost, reverse=True)
+
+
+class WastedJoin(object):
+    """
+    A `select_related` path whose joined instances, or most of their columns, were not read.
+
+    `populate_time` is the measured time spent building its instances. `estimated_db_time`
+    is the query time in proportion to the share of the selected columns the path adds.
+    """
+
+    def __init__(self, fetch, column_share, suggestion):
+        self.query = fetch.query
+        self.path = fetch.path
+        self.model = fetch.model
+        self.instances = fetch.instance_count
+        self.used_instances = fetch.used_instance_count
+        self.fields = fetch.field_names
+        self.fields_read = fetch.fields_read
+        self.column_share = column_share
+        self.populate_time = fetch.populate_time
+        self.estimated_db_time = fetch.query.duration * column_share
+        self.suggestion = suggestion
+
+    @property
+    def cost(self):
+        return self.populate_time + self.estimated_db_time
+
+    def describe(self):
+        return "{} ({}): {} instances, {} used, {}/{} fields read, {}% of the columns, " \
+               "~{}s in the database, {}s building instances".format(
+                   self.path, self.model._meta.label, self.instances, self.used_instances, len(self.fields_read),
+                   len(self.fields), int(round(self.column_share * 100)), round(self.estimated_db_time, 6),
+                   round(self.populate_time, 6)
+               )
+
+
+def display_over_fetching(findings):
+    for finding in findings:
+        logger.info("-" * 60)
+        print_yellow("Over-fetching: {}".format(finding.describe()))
+        logger.info(finding.suggestion)
+
+
+def display_wasted_joins(findings):
+    for finding in findings:
+        logger.info("-" * 60)
+        print_yellow("Wasted select_related: {}".format(finding.describe()))
+        logger.info(finding.suggestion)
+
+
+_original_from_db = None
+
+
+def _install_patch():
+    """Patch `Model.from_db`, queryset iteration and the `select_related` populators once, on first use."""
+    global _original_from_db
+
+    if _original_from_db is not None:
+        return
+
+    _original_from_db = Model.from_db.__func__
+
+    def from_db(cls, db, field_names, values):
+        instance = _original_from_db(cls, db, field_names, values)
+        trackers = get_active_trackers()
+
+        if trackers:
+            path = "__".join(_get_path_stack()) or None
+
+            for tracker in trackers:
+                tracker.record_instance(cls, db, field_names, values, instance, path=path)
+
+        return instance
+
+    original_populator_init = RelatedPopulator.__init__
+    original_populate = RelatedPopulator.populate
+
+    def populator_init(self, klass_info, select, db):
+        original_populator_init(self, klass_info, select, db)
+
+        field = klass_info['field']
+        self._query_debug_name = field.related_query_name() if klass_info['reverse'] else field.name
+
+    def populate(self, row, from_obj):
+        trackers = get_active_trackers()
+
+        if not trackers:
+            return original_populate(self, row, from_obj)
+
+        paths = _get_path_stack()
+        paths.append(self._query_debug_name)
+        path = "__".join(paths)
+        start_time = time.time()
+
+        try:
+            return original_populate(self, row, from_obj)
+        finally:
+            elapsed = time.time() - start_time
+            paths.pop()
+
+            for tracker in trackers:
+                tracker.record_populate_time(self.model_cls, self.db, path, elapsed)
+
+    original_model_iter = ModelIterable.__iter__
+    # Django 2.0 iterates raw querysets in `__iter__`
+    raw_iterator_name = "iterator" if hasattr(RawQuerySet, "iterator") else "__iter__"
+    original_raw_iterator = getattr(RawQuerySet, raw_iterator_name)
+
+    def model_iter(self):
+        trackers = get_active_trackers()
+
+        if not trackers:
+            return original_model_iter(self)
+
+        return _iterate_with_hydration(original_model_iter(self), list(trackers))
+
+    def raw_iterator(self):
+        trackers = get_active_trackers()
+
+        if not trackers:
+            return original_raw_iterator(self)
+
+        return _iterate_with_hydration(original_raw_iterator(self), list(trackers))
+
+    Model.from_db = classmethod(from_db)
+    ModelIterable.__iter__ = model_iter
+    setattr(RawQuerySet, raw_iterator_name, raw_iterator)
+    RelatedPopulator.__init__ = populator_init
+    RelatedPopulator.populate = populate
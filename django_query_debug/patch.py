@@ -1,5 +1,7 @@
 import logging
+import threading
 
+from django.apps import apps
 from django.conf import settings
 from django.db.models.base import Model
 from django.db.models.fields import related_descriptors
@@ -11,21 +13,55 @@ from django_query_debug.utils import TracebackLogger
 
 logger = logging.getLogger('query_debug')
 
+_lazy_load_listeners = []
+_local = threading.local()
+
+
+def _get_thread_listeners():
+    if not hasattr(_local, "listeners"):
+        _local.listeners = []
+
+    return _local.listeners
+
+
+def add_lazy_load_listener(listener, all_threads=False):
+    """
+    Call `listener(message)` for every lazy load detected by the patched descriptors on
+    this thread, or on every thread with `all_threads=True`.
+
+    Lazy loads are only detected once `PatchDjangoDescriptors` has been applied.
+    """
+    (_lazy_load_listeners if all_threads else _get_thread_listeners()).append(listener)
+
+
+def remove_lazy_load_listener(listener, all_threads=False):
+    (_lazy_load_listeners if all_threads else _get_thread_listeners()).remove(listener)
+
 
 class PatchDjangoDescriptors(object):
     """
     Monkey patch the builtin Django fields and descriptors
     to add query warnings.
+
+    The patch is applied once per process. Pass `force=True` to apply it
+    for lazy load listeners when `ENABLE_QUERY_WARNINGS` is disabled.
     """
 
-    def __init__(self):
+    applied = False
+
+    def __init__(self, force=False):
         # The ForwardOneToOneDescriptor does not need to be patched because
         # it will call ForwardManyToOneDescriptor if a query is made.
 
-        if not getattr(settings, "ENABLE_QUERY_WARNINGS", False):
+        if not force and not getattr(settings, "ENABLE_QUERY_WARNINGS", False):
             # Query Warnings disabled, don't apply patch
             return
 
+        if PatchDjangoDescriptors.applied:
+            return
+
+        PatchDjangoDescriptors.applied = True
+
         self._patch_with_warnings(ReverseOneToOneDescriptor,
                                   "get_queryset",
                                   self.get_warning_for_reverse_one_to_one_descriptor)
@@ -37,6 +73,9 @@ class PatchDjangoDescriptors(object):
         self.monkey_patch_many_to_many_factory()
         self.monkey_patch_reverse_many_to_one_factory()
 
+        if apps.is_installed("django.contrib.contenttypes"):
+            self.monkey_patch_generic_relations()
+
     @staticmethod
     def _patch_with_warnings(obj, original_method_name, get_warning):
         """
@@ -47,6 +86,10 @@ class PatchDjangoDescriptors(object):
         def wrapper(*args, **kwargs):
             warning_message = get_warning(*args, **kwargs)
 
+            if warning_message:
+                for listener in _lazy_load_listeners + _get_thread_listeners():
+                    listener(warning_message)
+
             if warning_message and getattr(settings, "ENABLE_QUERY_WARNINGS", False):
                 logger.warning(warning_message)
                 TracebackLogger.print_traceback()
@@ -123,3 +166,74 @@ class PatchDjangoDescriptors(object):
             return related_manager
 
         related_descriptors.create_reverse_many_to_one_manager = create_reverse_many_to_one_manager
+
+    def monkey_patch_generic_relations(self):
+        """Warn about uncached generic foreign keys and generic relations, and `ContentType` cache misses."""
+        from django.contrib.contenttypes import fields as generic_fields
+        from django.contrib.contenttypes.models import ContentTypeManager
+
+        self._patch_with_warnings(generic_fields.GenericForeignKey,
+                                  "__get__",
+                                  self.get_warning_for_generic_foreign_key)
+        self._patch_with_warnings(ContentTypeManager, "get_for_id", self.get_warning_for_content_type_id)
+        self._patch_with_warnings(ContentTypeManager, "get_for_model", self.get_warning_for_content_type_model)
+
+        original_create_generic_related_manager = generic_fields.create_generic_related_manager
+
+        def get_warning_message(manager):
+            prefetch_cache = getattr(manager.instance, "_prefetched_objects_cache", None)
+
+            if not prefetch_cache or manager.prefetch_cache_name not in prefetch_cache:
+                return "Accessing uncached GenericRelation field {}.{}, use prefetch_related('{}')".format(
+                    manager.instance.__class__.__name__, manager.prefetch_cache_name, manager.prefetch_cache_name
+                )
+
+        def create_generic_related_manager(*args, **kwargs):
+            related_manager = original_create_generic_related_manager(*args, **kwargs)
+
+            self._patch_with_warnings(related_manager, "get_queryset", get_warning_message)
+
+            return related_manager
+
+        generic_fields.create_generic_related_manager = create_generic_related_manager
+
+    @staticmethod
+    def get_warning_for_generic_foreign_key(descriptor, instance, cls=None):
+        if instance is None:
+            return None
+
+        ct_field = instance._meta.get_field(descriptor.ct_field)
+
+        if getattr(instance, ct_field.get_attname(), None) is None:
+            # No related object, nothing to fetch
+            return None
+
+        if hasattr(descriptor, "get_cached_value"):
+            rel_obj = descriptor.get_cached_value(instance, default=None)
+        else:
+            rel_obj = getattr(instance, descriptor.cache_attr, None)
+
+        if rel_obj is not None and rel_obj.pk == rel_obj._meta.pk.to_python(getattr(instance, descriptor.fk_field)):
+            return None
+
+        return "Accessing uncached GenericForeignKey field {}.{}, use prefetch_related('{}')".format(
+            instance.__class__.__name__, descriptor.name, descriptor.name
+        )
+
+    @staticmethod
+    def get_warning_for_content_type_id(manager, id):
+        if id not in manager._cache.get(manager.db, {}):
+            return "ContentType cache miss for id {}".format(id)
+
+        return None
+
+    @staticmethod
+    def get_warning_for_content_type_model(manager, model, for_concrete_model=True):
+        opts = manager._get_opts(model, for_concrete_model)
+
+        try:
+            manager._get_from_cache(opts)
+        except KeyError:
+            return "ContentType cache miss for {}".format(opts.label)
+
+        return None
@@ -0,0 +1,278 @@
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.db.models.query import ModelIterable
+from django.db.models.sql import compiler
+
+from django_query_debug.utils import fingerprint_sql, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+
+PHASE_COMPILE = 'compile'
+PHASE_EXECUTE = 'execute'
+PHASE_FETCH = 'fetch'
+PHASE_HYDRATE = 'hydrate'
+PHASES = (PHASE_COMPILE, PHASE_EXECUTE, PHASE_FETCH, PHASE_HYDRATE)
+
+_PHASE_ADVICE = {
+    PHASE_COMPILE: "Most time is spent compiling SQL, build the queryset once and reuse it",
+    PHASE_EXECUTE: "Most time is spent in the database, check the query plan and indexes",
+    PHASE_FETCH: "Most time is spent fetching and converting rows, fetch fewer rows or columns",
+    PHASE_HYDRATE: "Most time is spent building model instances, use .values() or .values_list()",
+}
+
+
+def get_active_timers():
+    """Return the `PhaseTimer`s open on this thread, outermost first."""
+    if not hasattr(_local, "timers"):
+        _local.timers = []
+
+    return _local.timers
+
+
+class PhaseStats(object):
+    """
+    Time spent per phase by the queries of one fingerprint.
+
+    `compile` is the time spent in `as_sql`, `execute` in the database cursor, `fetch`
+    fetching rows and applying the field converters, and `hydrate` building model
+    instances from the rows.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.times = OrderedDict((phase, 0.0) for phase in PHASES)
+
+    @property
+    def total_time(self):
+        return sum(self.times.values())
+
+    @property
+    def dominant_phase(self):
+        return max(PHASES, key=lambda phase: self.times[phase])
+
+    @property
+    def advice(self):
+        return _PHASE_ADVICE[self.dominant_phase]
+
+    def describe(self):
+        return ", ".join("{} {}s".format(phase, round(phase_time, 6)) for phase, phase_time in self.times.items())
+
+
+class PhaseTimer(object):
+    """
+    Split the time of ORM queries into SQL compilation, execution, row fetching and
+    model hydration, per fingerprint.
+
+    Only the queries of this thread are timed, and only while the timer is open.
+    """
+
+    def __init__(self):
+        self.stats = OrderedDict()
+        self.last_stats = None
+        self.pending_compile_time = 0.0
+        self.phase_totals = dict((phase, 0.0) for phase in PHASES)
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        _install_patch()
+
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self)
+            self._wrapped_connections.append(connection)
+
+        get_active_timers().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_timers().remove(self)
+
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self)
+
+        self._wrapped_connections = []
+
+    def __call__(self, execute, sql, params, many, context):
+        compile_time = self.pending_compile_time
+        self.pending_compile_time = 0.0
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            fingerprint = fingerprint_sql(sql)
+
+            if fingerprint not in self.stats:
+                self.stats[fingerprint] = PhaseStats(fingerprint)
+
+            self.last_stats = self.stats[fingerprint]
+            self.last_stats.count += 1
+            self.add(self.last_stats, PHASE_COMPILE, compile_time)
+            self.add(self.last_stats, PHASE_EXECUTE, time.time() - start_time)
+
+    def add(self, stats, phase, phase_time):
+        if stats is not None:
+            stats.times[phase] += phase_time
+            self.phase_totals[phase] += phase_time
+
+    def query_time(self):
+        """Total time of the compile, execute and fetch phases."""
+        return sum(self.phase_totals[phase] for phase in (PHASE_COMPILE, PHASE_EXECUTE, PHASE_FETCH))
+
+    def get_stats(self):
+        """Return the `PhaseStats`, slowest first."""
+        return sorted(self.stats.values(), key=lambda stats: stats.total_time, reverse=True)
+
+
+def display_phase_stats(stats_list):
+    for stats in stats_list:
+        logger.info("-" * 60)
+        logger.info("Phases of {} quer{}: {}".format(stats.count, "y" if stats.count == 1 else "ies", stats.fingerprint))
+        logger.info(stats.describe())
+        print_yellow(stats.advice)
+
+
+def _timed_rows(rows, phase_stats):
+    """Yield `rows`, adding the time spent getting each row to the fetch phase."""
+    iterator = iter(rows)
+
+    while True:
+        start_time = time.time()
+
+        try:
+            row = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            elapsed = time.time() - start_time
+
+            for timer, stats in phase_stats:
+                timer.add(stats, PHASE_FETCH, elapsed)
+
+        yield row
+
+
+def _timed_instances(objs, timers):
+    """Yield model instances, adding the time not spent on the query itself to the hydrate phase."""
+    iterator = iter(objs)
+    phase_stats = None
+
+    while True:
+        start_time = time.time()
+        query_times = [timer.query_time() for timer in timers]
+
+        try:
+            obj = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            elapsed = time.time() - start_time
+
+            if phase_stats is None:
+                # The query runs on the first iteration
+                phase_stats = [(timer, timer.last_stats) for timer in timers]
+
+            for (timer, stats), query_time in zip(phase_stats, query_times):
+                timer.add(stats, PHASE_HYDRATE, max(elapsed - (timer.query_time() - query_time), 0.0))
+
+        yield obj
+
+
+_patched = False
+
+
+def _patch_as_sql(compiler_class):
+    original_as_sql = compiler_class.__dict__['as_sql']
+
+    def as_sql(self, *args, **kwargs):
+        timers = get_active_timers()
+        depth = getattr(_local, "as_sql_depth", 0)
+
+        if not timers or depth:
+            return original_as_sql(self, *args, **kwargs)
+
+        # Only time the outermost call, subqueries and subclasses call as_sql again
+        _local.as_sql_depth = depth + 1
+        start_time = time.time()
+
+        try:
+            return original_as_sql(self, *args, **kwargs)
+        finally:
+            _local.as_sql_depth = depth
+            elapsed = time.time() - start_time
+
+            for timer in timers:
+                timer.pending_compile_time += elapsed
+
+    compiler_class.as_sql = as_sql
+
+
+def _install_patch():
+    """Patch the SQL compilers and model iterable once, on first use."""
+    global _patched
+
+    if _patched:
+        return
+
+    _patched = True
+
+    for compiler_class in (compiler.SQLCompiler, compiler.SQLInsertCompiler, compiler.SQLDeleteCompiler,
+                           compiler.SQLUpdateCompiler, compiler.SQLAggregateCompiler):
+        _patch_as_sql(compiler_class)
+
+    original_execute_sql = compiler.SQLCompiler.execute_sql
+    original_results_iter = compiler.SQLCompiler.results_iter
+    original_model_iter = ModelIterable.__iter__
+
+    def execute_sql(self, *args, **kwargs):
+        timers = get_active_timers()
+
+        if not timers:
+            return original_execute_sql(self, *args, **kwargs)
+
+        totals = [(timer.phase_totals[PHASE_COMPILE], timer.phase_totals[PHASE_EXECUTE]) for timer in timers]
+        start_time = time.time()
+
+        try:
+            return original_execute_sql(self, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start_time
+
+            for timer, (compile_total, execute_total) in zip(timers, totals):
+                # Rows fetched with fetchall and time outside as_sql and the cursor
+                compile_time = timer.phase_totals[PHASE_COMPILE] - compile_total
+                execute_time = timer.phase_totals[PHASE_EXECUTE] - execute_total
+                other_time = elapsed - compile_time - execute_time
+                timer.add(timer.last_stats, PHASE_FETCH, max(other_time, 0.0))
+                # Compiled but not executed, e.g. for empty results
+                timer.pending_compile_time = 0.0
+
+    def results_iter(self, *args, **kwargs):
+        rows = original_results_iter(self, *args, **kwargs)
+        timers = get_active_timers()
+
+        if not timers:
+            return rows
+
+        return _timed_rows(rows, [(timer, timer.last_stats) for timer in timers])
+
+    def model_iter(self):
+        timers = get_active_timers()
+
+        if not timers:
+            return original_model_iter(self)
+
+        return _timed_instances(original_model_iter(self), list(timers))
+
+    compiler.SQLCompiler.execute_sql = execute_sql
+    compiler.SQLCompiler.results_iter = results_iter
+    ModelIterable.__iter__ = model_iter
@@ -0,0 +1,365 @@
+import json
+import logging
+import re
+
+from django.db import connections
+import six
+
+
+logger = logging.getLogger('query_debug')
+
+SEVERITY_INFO = 1
+SEVERITY_WARNING = 2
+SEVERITY_CRITICAL = 3
+
+SEVERITY_NAMES = {
+    SEVERITY_INFO: "INFO",
+    SEVERITY_WARNING: "WARNING",
+    SEVERITY_CRITICAL: "CRITICAL",
+}
+
+# Prefixes returning a plan that can be parsed into a tree, without executing the query
+STRUCTURED_EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN',
+    'postgresql': 'EXPLAIN (FORMAT JSON)',
+    'mysql': 'EXPLAIN',
+}
+
+_SQLITE_TABLE_RE = re.compile(r"^(?:SCAN|SEARCH)(?: TABLE)? (\S+)")
+_SQLITE_INDEX_RE = re.compile(r"USING (?:COVERING |AUTOMATIC (?:PARTIAL )?(?:COVERING )?)?INDEX (\S+)")
+
+
+class PlanNode(object):
+    """
+    A single step of a query plan.
+
+    `estimated_cost` and `estimated_rows` are None when the database does not provide them.
+    """
+
+    def __init__(self, operation, detail="", table=None, index=None,
+                 estimated_cost=None, estimated_rows=None, children=None):
+        self.operation = operation
+        self.detail = detail
+        self.table = table
+        self.index = index
+        self.estimated_cost = estimated_cost
+        self.estimated_rows = estimated_rows
+        self.children = children or []
+
+    def walk(self, depth=0):
+        """Yield (depth, node) for this node and all of its descendants."""
+        yield depth, self
+
+        for child in self.children:
+            for descendant in child.walk(depth + 1):
+                yield descendant
+
+    def __str__(self):
+        text = self.detail or self.operation
+        estimates = []
+
+        if self.estimated_cost is not None:
+            estimates.append("cost={}".format(self.estimated_cost))
+        if self.estimated_rows is not None:
+            estimates.append("rows={}".format(self.estimated_rows))
+        if estimates:
+            text = "{} ({})".format(text, ", ".join(estimates))
+
+        return text
+
+
+class PlanFinding(object):
+    """
+    A potential problem detected in a query plan.
+    """
+
+    def __init__(self, severity, message, node=None):
+        self.severity = severity
+        self.message = message
+        self.node = node
+
+    def __str__(self):
+        return "[{}] {}".format(SEVERITY_NAMES[self.severity], self.message)
+
+    def __repr__(self):
+        return "<PlanFinding {}>".format(self)
+
+
+class QueryPlan(object):
+    """
+    Query plan parsed into a tree of `PlanNode` objects, with the problems found in it.
+    """
+
+    def __init__(self, vendor, root, large_table_rows=1000):
+        self.vendor = vendor
+        self.root = root
+        self.findings = detect_plan_problems(self, large_table_rows=large_table_rows)
+
+    @property
+    def severity(self):
+        """Highest severity of the findings, 0 if there are none."""
+        return max([finding.severity for finding in self.findings] or [0])
+
+    @property
+    def estimated_cost(self):
+        return self.root.estimated_cost
+
+    @property
+    def estimated_rows(self):
+        return self.root.estimated_rows
+
+    def nodes(self):
+        return [node for depth, node in self.root.walk()]
+
+    def __str__(self):
+        return "\n".join("{}{}".format("  " * depth, node) for depth, node in self.root.walk())
+
+
+def _to_number(value):
+    if value is None:
+        return None
+
+    try:
+        return float(value) if "." in str(value) else int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_sqlite_plan(rows):
+    """
+    Parse the (id, parent, notused, detail) rows of SQLite's `EXPLAIN QUERY PLAN`.
+    """
+    root = PlanNode("QUERY PLAN")
+    nodes = {0: root}
+
+    for row in rows:
+        node_id, parent_id, detail = row[0], row[1], row[-1]
+        table_match = _SQLITE_TABLE_RE.match(detail)
+        index_match = _SQLITE_INDEX_RE.search(detail)
+        node = PlanNode(detail.split(" ")[0],
+                        detail=detail,
+                        table=table_match.group(1) if table_match else None,
+                        index=index_match.group(1) if index_match else None)
+
+        nodes[node_id] = node
+        nodes.get(parent_id, root).children.append(node)
+
+    return root
+
+
+def parse_postgres_plan(data):
+    """
+    Parse the output of PostgreSQL's `EXPLAIN (FORMAT JSON)`.
+    """
+    if isinstance(data, (list, tuple)) and data and isinstance(data[0], (list, tuple)):
+        # Result rows, the plan is in the first column of the first row
+        data = data[0][0]
+    if isinstance(data, six.string_types + (bytes,)):
+        data = json.loads(data)
+    if isinstance(data, list):
+        data = data[0]
+
+    def parse_node(plan):
+        operation = plan.get("Node Type", "")
+        details = [operation]
+
+        if plan.get("Relation Name"):
+            details.append("on {}".format(plan["Relation Name"]))
+        if plan.get("Index Name"):
+            details.append("using {}".format(plan["Index Name"]))
+
+        return PlanNode(operation,
+                        detail=" ".join(details),
+                        table=plan.get("Relation Name"),
+                        index=plan.get("Index Name"),
+                        estimated_cost=plan.get("Total Cost"),
+                        estimated_rows=plan.get("Plan Rows"),
+                        children=[parse_node(child) for child in plan.get("Plans", [])])
+
+    return parse_node(data["Plan"])
+
+
+def parse_mysql_plan(rows, columns):
+    """
+    Parse the tabular output of MySQL's `EXPLAIN`.
+
+    MySQL lists the tables in join order, so each row becomes a child of a single root node.
+    """
+    root = PlanNode("QUERY PLAN")
+    total_rows = None
+
+    for row in rows:
+        values = dict(zip([column.lower() for column in columns], row))
+        access_type = values.get("type") or ""
+        extra = values.get("extra") or ""
+        details = [str(values.get("select_type") or "SIMPLE"), "on {}".format(values.get("table")),
+                   "type={}".format(access_type)]
+
+        if values.get("key"):
+            details.append("using {}".format(values["key"]))
+        if extra:
+            details.append("({})".format(extra))
+
+        estimated_rows = _to_number(values.get("rows"))
+        root.children.append(PlanNode(access_type,
+                                      detail=" ".join(details),
+                                      table=values.get("table"),
+                                      index=values.get("key"),
+                                      estimated_rows=estimated_rows))
+
+        if estimated_rows is not None:
+            total_rows = estimated_rows * (total_rows or 1)
+
+    root.estimated_rows = total_rows
+
+    return root
+
+
+def _is_large(node, large_table_rows):
+    return node.estimated_rows is not None and node.estimated_rows >= large_table_rows
+
+
+def _full_scan_finding(node, large_table_rows):
+    if node.estimated_rows is None:
+        return PlanFinding(SEVERITY_WARNING, "Full scan on {}".format(node.table), node)
+    if _is_large(node, large_table_rows):
+        return PlanFinding(SEVERITY_CRITICAL,
+                           "Full scan on large table {} (~{} rows)".format(node.table, node.estimated_rows),
+                           node)
+
+    return PlanFinding(SEVERITY_INFO, "Full scan on small table {}".format(node.table), node)
+
+
+def _detect_sqlite_problems(plan, large_table_rows):
+    findings = []
+
+    for depth, node in plan.root.walk():
+        detail = node.detail
+
+        if node.operation == "SCAN" and node.table and node.index is None:
+            findings.append(_full_scan_finding(node, large_table_rows))
+        elif "AUTOMATIC" in detail and "INDEX" in detail:
+            findings.append(PlanFinding(SEVERITY_WARNING,
+                                        "Automatic index built on {}, a permanent index is missing".format(node.table),
+                                        node))
+        if detail.startswith("USE TEMP B-TREE"):
+            findings.append(PlanFinding(SEVERITY_WARNING, "Temporary B-tree {}".format(detail[len("USE TEMP B-TREE "):].lower()), node))
+        if detail.startswith("CORRELATED"):
+            findings.append(PlanFinding(SEVERITY_WARNING, "Correlated subquery runs once per row", node))
+
+        # Tables after the first in a join are looked up once per outer row
+        scans = [child for child in node.children if child.operation in ("SCAN", "SEARCH") and child.table]
+        for inner in scans[1:]:
+            if inner.operation == "SCAN" and inner.index is None:
+                findings.append(PlanFinding(SEVERITY_CRITICAL,
+                                            "Nested loop without an index on {}".format(inner.table),
+                                            inner))
+
+    return findings
+
+
+def _detect_postgres_problems(plan, large_table_rows):
+    findings = []
+
+    for depth, node in plan.root.walk():
+        if node.operation == "Seq Scan":
+            findings.append(_full_scan_finding(node, large_table_rows))
+        elif node.operation == "Sort" and _is_large(node, large_table_rows):
+            findings.append(PlanFinding(SEVERITY_WARNING, "Sorting ~{} rows".format(node.estimated_rows), node))
+        elif node.operation == "Nested Loop" and len(node.children) > 1:
+            inner = node.children[1]
+
+            if inner.operation == "Seq Scan":
+                findings.append(PlanFinding(SEVERITY_CRITICAL,
+                                            "Nested loop without an index on {}".format(inner.table),
+                                            inner))
+
+    return findings
+
+
+def _detect_mysql_problems(plan, large_table_rows):
+    findings = []
+
+    for index, node in enumerate(plan.root.children):
+        extra = node.detail
+
+        if node.operation == "ALL":
+            if index > 0:
+                findings.append(PlanFinding(SEVERITY_CRITICAL,
+                                            "Nested loop without an index on {}".format(node.table),
+                                            node))
+            else:
+                findings.append(_full_scan_finding(node, large_table_rows))
+        if "Using join buffer" in extra and node.operation != "ALL":
+            findings.append(PlanFinding(SEVERITY_WARNING, "Join buffer used for {}".format(node.table), node))
+        if "Using temporary" in extra:
+            findings.append(PlanFinding(SEVERITY_WARNING, "Temporary table used for {}".format(node.table), node))
+        if "Using filesort" in extra:
+            findings.append(PlanFinding(SEVERITY_WARNING, "Filesort used for {}".format(node.table), node))
+
+    return findings
+
+
+def detect_plan_problems(plan, large_table_rows=1000):
+    """
+    Return the `PlanFinding`s of a `QueryPlan`, most severe first.
+
+    Full scans are only critical on tables estimated to have at least `large_table_rows` rows.
+    """
+    detectors = {
+        'sqlite': _detect_sqlite_problems,
+        'postgresql': _detect_postgres_problems,
+        'mysql': _detect_mysql_problems,
+    }
+
+    if plan.vendor not in detectors:
+        return []
+
+    findings = detectors[plan.vendor](plan, large_table_rows)
+
+    return sorted(findings, key=lambda finding: finding.severity, reverse=True)
+
+
+def parse_plan(vendor, rows, columns=None, large_table_rows=1000):
+    """
+    Parse the rows returned by a `STRUCTURED_EXPLAIN_PREFIXES` query into a `QueryPlan`.
+    """
+    if vendor == 'sqlite':
+        root = parse_sqlite_plan(rows)
+    elif vendor == 'postgresql':
+        root = parse_postgres_plan(rows)
+    elif vendor == 'mysql':
+        root = parse_mysql_plan(rows, columns or [])
+    else:
+        raise ValueError("Query plan parsing is not available for '{}' database.".format(vendor))
+
+    return QueryPlan(vendor, root, large_table_rows=large_table_rows)
+
+
+def explain_plan(sql, params=None, using='default', large_table_rows=1000, timeout=None):
+    """
+    Return the `QueryPlan` of a SQL statement, or None if the database is not supported.
+
+    The query itself is not executed.
+    """
+    from django_query_debug.utils import run_explain
+
+    db_vendor = connections[using].vendor
+
+    if db_vendor not in STRUCTURED_EXPLAIN_PREFIXES:
+        logger.warning("Query plan explanation is not available for '{}' database.".format(db_vendor))
+        return None
+
+    columns, rows = run_explain(sql, params, using=using, prefix=STRUCTURED_EXPLAIN_PREFIXES[db_vendor],
+                                timeout=timeout)
+
+    return parse_plan(db_vendor, rows, columns=columns, large_table_rows=large_table_rows)
+
+
+def explain_queryset_plan(queryset, large_table_rows=1000, timeout=None):
+    """
+    Return the `QueryPlan` of a queryset.
+    """
+    query, params = queryset.query.sql_with_params()
+
+    return explain_plan(query, params, using=queryset.db, large_table_rows=large_table_rows, timeout=timeout)
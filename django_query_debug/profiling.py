@@ -0,0 +1,192 @@
+from collections import Counter, OrderedDict
+import time
+
+from django.db import transaction
+from django.test import Client, RequestFactory
+from django.urls import get_resolver, URLPattern, URLResolver
+from django.utils.module_loading import import_string
+
+from django_query_debug.capture import QueryCapture
+from django_query_debug.patch import add_lazy_load_listener, PatchDjangoDescriptors, remove_lazy_load_listener
+
+
+class EndpointRun(object):
+    """
+    Queries, lazy loads and timings of one request to an endpoint.
+    """
+
+    def __init__(self, status_code, elapsed_time, queries, lazy_loads, error=None):
+        self.status_code = status_code
+        self.elapsed_time = elapsed_time
+        self.queries = queries
+        self.lazy_loads = lazy_loads
+        self.error = error
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def db_time(self):
+        return sum(query.duration for query in self.queries)
+
+    @property
+    def python_time(self):
+        return max(self.elapsed_time - self.db_time, 0.0)
+
+
+class EndpointProfile(object):
+    """
+    Runs of one endpoint. The first run is cold, the following runs are warm.
+    """
+
+    def __init__(self, target, runs):
+        self.target = target
+        self.runs = runs
+
+    @property
+    def cold(self):
+        return self.runs[0]
+
+    @property
+    def warm(self):
+        return self.runs[1:] or self.runs
+
+    @property
+    def status_codes(self):
+        return sorted(set(run.status_code for run in self.runs if run.status_code is not None))
+
+    @property
+    def errors(self):
+        return [run.error for run in self.runs if run.error is not None]
+
+    def _warm_mean(self, attribute):
+        return sum(getattr(run, attribute) for run in self.warm) / float(len(self.warm))
+
+    @property
+    def warm_query_count(self):
+        return self._warm_mean('query_count')
+
+    @property
+    def warm_elapsed_time(self):
+        return self._warm_mean('elapsed_time')
+
+    @property
+    def warm_db_time(self):
+        return self._warm_mean('db_time')
+
+    @property
+    def warm_python_time(self):
+        return self._warm_mean('python_time')
+
+    def fingerprints(self):
+        """Return (fingerprint, count, total time) per run, most frequent first, from the warm runs."""
+        counts = Counter()
+        times = Counter()
+
+        for run in self.warm:
+            for query in run.queries:
+                counts[query.fingerprint] += 1
+                times[query.fingerprint] += query.duration
+
+        return [(fingerprint, count / float(len(self.warm)), times[fingerprint] / len(self.warm))
+                for fingerprint, count in counts.most_common()]
+
+    def lazy_loads(self):
+        """Return (message, count per run) from the warm runs, most frequent first."""
+        counts = Counter(message for run in self.warm for message in run.lazy_loads)
+
+        return [(message, count / float(len(self.warm))) for message, count in counts.most_common()]
+
+
+def _call_target(target, client, request_factory):
+    if target.startswith("/"):
+        return client.get(target)
+
+    view = import_string(target)
+
+    if hasattr(view, "as_view"):
+        view = view.as_view()
+
+    response = view(request_factory.get("/"))
+
+    if hasattr(response, "render") and not getattr(response, "is_rendered", True):
+        response.render()
+
+    return response
+
+
+def profile_endpoint(target, repeat=5, rollback=True):
+    """
+    Request a URL path with the test `Client`, or call a dotted path view with a GET request,
+    `repeat` times and return an `EndpointProfile`.
+
+    Lazy loads are detected with `PatchDjangoDescriptors`, which is applied if needed.
+    With `rollback=True`, each run is wrapped in a transaction that is rolled back, so that
+    every run starts from the same data.
+    """
+    PatchDjangoDescriptors(force=True)
+
+    client = Client()
+    request_factory = RequestFactory()
+    runs = []
+
+    for index in range(repeat):
+        lazy_loads = []
+        listener = lazy_loads.append
+        add_lazy_load_listener(listener)
+        status_code = None
+        error = None
+        start_time = time.time()
+
+        try:
+            with transaction.atomic():
+                # Captured inside the transaction, to leave out its own savepoint and rollback queries
+                with QueryCapture() as capture:
+                    try:
+                        status_code = _call_target(target, client, request_factory).status_code
+                    except Exception as exception:
+                        error = "{}: {}".format(type(exception).__name__, exception)
+
+                if rollback:
+                    transaction.set_rollback(True)
+        finally:
+            remove_lazy_load_listener(listener)
+
+        runs.append(EndpointRun(status_code, time.time() - start_time, capture.queries, lazy_loads, error=error))
+
+    return EndpointProfile(target, runs)
+
+
+def _pattern_path(pattern):
+    """Return the literal path of a URL pattern, or None if it takes arguments."""
+    if hasattr(pattern, "regex") and not hasattr(pattern, "_route"):
+        path = pattern.regex.pattern.lstrip("^").rstrip("$").replace("\\Z", "").replace("\\/", "/")
+    else:
+        path = str(pattern)
+
+    if any(character in path for character in "<>()[]{}?*+|\\"):
+        return None
+
+    return path
+
+
+def get_sweep_urls(urlconf=None):
+    """Return the URL paths of every route without arguments, in `urlconf` order."""
+    urls = OrderedDict()
+
+    def walk(patterns, prefix):
+        for url_pattern in patterns:
+            path = _pattern_path(url_pattern.pattern)
+
+            if path is None:
+                continue
+
+            if isinstance(url_pattern, URLResolver):
+                walk(url_pattern.url_patterns, prefix + path)
+            elif isinstance(url_pattern, URLPattern):
+                urls["/" + prefix + path] = None
+
+    walk(get_resolver(urlconf).url_patterns, "")
+
+    return list(urls)
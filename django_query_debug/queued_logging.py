@@ -0,0 +1,174 @@
+import atexit
+import logging
+import threading
+
+from six.moves import queue
+
+
+logger = logging.getLogger('query_debug')
+
+OVERFLOW_DROP_NEW = 'drop_new'
+OVERFLOW_DROP_OLD = 'drop_old'
+OVERFLOW_BLOCK = 'block'
+
+
+class QueuedHandler(logging.Handler):
+    """
+    Logging handler that hands records to a background thread through a bounded queue.
+
+    The background thread passes each record to the target handlers, and to the handlers
+    of the parent loggers if `propagate_to` is given. When the queue is full, the
+    `overflow` policy decides what happens to the record:
+
+    * `drop_new`: discard the new record
+    * `drop_old`: discard the oldest queued record to make room
+    * `block`: wait for room, up to `block_timeout` seconds, then discard the new record
+
+    The number of dropped records is logged once the queue has room again.
+    """
+
+    def __init__(self, handlers, propagate_to=None, max_size=10000, overflow=OVERFLOW_DROP_NEW, block_timeout=1.0):
+        super(QueuedHandler, self).__init__()
+
+        if overflow not in (OVERFLOW_DROP_NEW, OVERFLOW_DROP_OLD, OVERFLOW_BLOCK):
+            raise ValueError("Unknown overflow policy '{}'".format(overflow))
+
+        self.handlers = list(handlers)
+        self.propagate_to = propagate_to
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped_count = 0
+        self._dropped_lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=max_size)
+
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="query-debug-log-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        if self._stopped:
+            self._dispatch(record)
+            return
+
+        try:
+            if self.overflow == OVERFLOW_BLOCK:
+                self.queue.put(record, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow != OVERFLOW_DROP_OLD:
+                self._count_dropped()
+                return
+
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+            except queue.Empty:
+                pass
+
+            self._count_dropped()
+
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self._count_dropped()
+
+    def _count_dropped(self):
+        with self._dropped_lock:
+            self.dropped_count += 1
+
+    def _dispatch(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+        if self.propagate_to is not None:
+            self.propagate_to.handle(record)
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+
+            try:
+                if record is None:
+                    return
+
+                self._dispatch(record)
+                self._report_dropped()
+            except Exception:
+                self.handleError(record)
+            finally:
+                self.queue.task_done()
+
+    def _report_dropped(self):
+        if not self.dropped_count or not self.queue.empty():
+            return
+
+        with self._dropped_lock:
+            dropped_count, self.dropped_count = self.dropped_count, 0
+
+        if not dropped_count:
+            return
+
+        record = logger.makeRecord(logger.name, logging.WARNING, __file__, 0,
+                                   "Dropped {} query_debug log records, log queue was full".format(dropped_count),
+                                   None, None)
+        self._dispatch(record)
+
+    def flush(self):
+        """Wait until every queued record has been written."""
+        if not self._stopped:
+            self.queue.join()
+
+    def close(self):
+        if not self._stopped:
+            self._stopped = True
+            self.queue.put(None)
+            self._thread.join()
+            self._report_dropped()
+
+        super(QueuedHandler, self).close()
+
+
+_queued_handler = None
+_original_config = None
+
+
+def enable_queued_logging(max_size=10000, overflow=OVERFLOW_DROP_NEW):
+    """
+    Move the handlers of the `query_debug` logger behind a `QueuedHandler`.
+
+    Propagation to parent loggers is also moved to the background thread.
+    """
+    global _queued_handler, _original_config
+
+    if _queued_handler is not None:
+        return _queued_handler
+
+    _original_config = (list(logger.handlers), logger.propagate)
+    _queued_handler = QueuedHandler(logger.handlers,
+                                    propagate_to=logger.parent if logger.propagate else None,
+                                    max_size=max_size,
+                                    overflow=overflow)
+
+    logger.handlers = [_queued_handler]
+    logger.propagate = False
+
+    return _queued_handler
+
+
+def disable_queued_logging():
+    """Write any queued records and restore the original `query_debug` handlers."""
+    global _queued_handler, _original_config
+
+    if _queued_handler is None:
+        return
+
+    _queued_handler.close()
+    logger.handlers, logger.propagate = _original_config
+    _queued_handler = None
+    _original_config = None
+
+
+atexit.register(disable_queued_logging)
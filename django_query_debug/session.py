@@ -0,0 +1,10 @@
+from depocs import Scoped
+
+
+class FieldUsageSession(Scoped):
+    """
+    Prevent field usage increases.
+    """
+
+    def __init__(self, disable_tracking=False):
+        self.disable_tracking = disable_tracking
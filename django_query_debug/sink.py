@@ -0,0 +1,231 @@
+from collections import defaultdict
+import atexit
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger('query_debug')
+
+
+class StatsSink(object):
+    """
+    Collects query and field usage stats in memory and appends them in batches
+    to a per-process JSON lines file.
+
+    Recording only updates in-memory counters. A background thread writes the
+    pending counters as a single line every `flush_interval` seconds, or sooner
+    once `max_pending` distinct keys are waiting. Files written by every worker
+    can be combined offline with `merge_stats` or the `merge_query_stats` command.
+    """
+
+    def __init__(self, directory, flush_interval=10.0, max_pending=10000):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._pending_queries = {}
+        self._pending_field_usage = defaultdict(dict)
+        self._pending_count = 0
+
+    @property
+    def path(self):
+        filename = "query-debug-{}-{}.jsonl".format(socket.gethostname(), os.getpid())
+
+        return os.path.join(self.directory, filename)
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            # First use, or first use after a fork; stats recorded by the parent belong to the parent.
+            self._reset_pending()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="query-debug-stats-sink")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake_up.wait(self.flush_interval)
+            self._wake_up.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush query debug stats to {}".format(self.directory))
+
+    def record_query(self, fingerprint, count=1, query_time=0.0, num_results=0):
+        self._ensure_started()
+
+        with self._lock:
+            stats = self._pending_queries.get(fingerprint)
+
+            if stats is None:
+                stats = self._pending_queries[fingerprint] = [0, 0.0, 0]
+                self._pending_count += 1
+
+            stats[0] += count
+            stats[1] += query_time
+            stats[2] += num_results
+            overflow = self._pending_count >= self.max_pending
+
+        if overflow:
+            self._wake_up.set()
+
+    def record_block(self, report):
+        """Record the per fingerprint stats of a `QueryBlockReport`."""
+        for fingerprint, stats in report.fingerprints.items():
+            self.record_query(fingerprint,
+                              count=stats['count'],
+                              query_time=stats['time'],
+                              num_results=stats['num_results'])
+
+    def record_field_usage(self, model_label, field_usage):
+        self._ensure_started()
+
+        with self._lock:
+            model_usage = self._pending_field_usage[model_label]
+
+            for field_name, usage_count in field_usage.items():
+                if field_name not in model_usage:
+                    model_usage[field_name] = 0
+                    self._pending_count += 1
+
+                model_usage[field_name] += usage_count
+
+            overflow = self._pending_count >= self.max_pending
+
+        if overflow:
+            self._wake_up.set()
+
+    def flush(self):
+        """Append all pending stats to the sink file as a single line."""
+        with self._lock:
+            if not self._pending_count:
+                return
+
+            queries = self._pending_queries
+            field_usage = self._pending_field_usage
+            self._reset_pending()
+
+        line = json.dumps({
+            'timestamp': time.time(),
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'queries': queries,
+            'field_usage': field_usage,
+        }, sort_keys=True)
+
+        with self._flush_lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            with open(self.path, 'a') as stats_file:
+                stats_file.write(line + "\n")
+
+    def close(self):
+        self._closed = True
+        self._wake_up.set()
+        self.flush()
+
+
+def merge_stats(paths):
+    """
+    Merge stats files written by `StatsSink` instances.
+
+    Directories are expanded to the `.jsonl` files they contain.
+    Truncated lines, e.g. from a worker killed mid-write, are skipped.
+    """
+    merged = {
+        'queries': {},
+        'field_usage': {},
+    }
+
+    for stats_path in _expand_paths(paths):
+        with open(stats_path) as stats_file:
+            for line in stats_file:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    logger.warning("Skipping malformed line in {}".format(stats_path))
+                    continue
+
+                _merge_batch(merged, batch)
+
+    return merged
+
+
+def _merge_batch(merged, batch):
+    for fingerprint, (count, query_time, num_results) in batch.get('queries', {}).items():
+        stats = merged['queries'].setdefault(fingerprint, [0, 0.0, 0])
+        stats[0] += count
+        stats[1] += query_time
+        stats[2] += num_results
+
+    for model_label, field_usage in batch.get('field_usage', {}).items():
+        model_usage = merged['field_usage'].setdefault(model_label, {})
+
+        for field_name, usage_count in field_usage.items():
+            model_usage[field_name] = model_usage.get(field_name, 0) + usage_count
+
+
+def _expand_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for filename in sorted(os.listdir(path)):
+                if filename.endswith(".jsonl"):
+                    yield os.path.join(path, filename)
+        else:
+            yield path
+
+
+_stats_sink = None
+_stats_sink_lock = threading.Lock()
+
+
+def get_stats_sink():
+    """
+    Return the process wide sink configured by `QUERY_DEBUG_STATS_DIR`, or None if unset.
+    """
+    global _stats_sink
+
+    directory = getattr(settings, "QUERY_DEBUG_STATS_DIR", None)
+
+    if not directory:
+        return None
+
+    if _stats_sink is None or _stats_sink.directory != directory:
+        with _stats_sink_lock:
+            if _stats_sink is None or _stats_sink.directory != directory:
+                if _stats_sink is not None:
+                    _stats_sink.close()
+
+                _stats_sink = StatsSink(directory,
+                                        flush_interval=getattr(settings, "QUERY_DEBUG_STATS_FLUSH_INTERVAL", 10.0))
+
+    return _stats_sink
+
+
+@atexit.register
+def _flush_stats_sink():
+    if _stats_sink is not None:
+        _stats_sink.close()
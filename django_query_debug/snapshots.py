@@ -0,0 +1,237 @@
+from collections import OrderedDict
+import json
+import logging
+import os
+
+from django_query_debug.plans import explain_plan
+from django_query_debug.utils import fingerprint_sql, print_green, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+ACCESS_FULL_SCAN = 'full scan'
+ACCESS_INDEX = 'index'
+
+
+def _access_kind(vendor, node):
+    """Return how a plan node reads its table, or None if it does not read a table."""
+    if not node.table:
+        return None
+
+    if vendor == 'sqlite':
+        if node.operation == "SCAN" and node.index is None:
+            return ACCESS_FULL_SCAN
+    elif vendor == 'postgresql':
+        if node.operation == "Seq Scan":
+            return ACCESS_FULL_SCAN
+    elif vendor == 'mysql':
+        if node.operation == "ALL":
+            return ACCESS_FULL_SCAN
+
+    return ACCESS_INDEX if node.index or node.operation == "SEARCH" else None
+
+
+def plan_shape(plan):
+    """
+    Return the normalized shape of a `QueryPlan`.
+
+    The shape keeps the operations, tables and indexes of the plan tree but not the
+    estimates, so it only changes when the database picks a different plan.
+    """
+    shape = []
+
+    for depth, node in plan.root.walk():
+        if depth == 0 and not node.table:
+            continue
+
+        if node.table:
+            label = node.operation
+            label += " on {}".format(node.table)
+            if node.index:
+                label += " using {}".format(node.index)
+        else:
+            label = node.detail or node.operation
+
+        shape.append({
+            'depth': depth,
+            'label': label,
+            'table': node.table,
+            'access': _access_kind(plan.vendor, node),
+        })
+
+    return shape
+
+
+class PlanChange(object):
+    """
+    A difference between a snapshotted plan shape and the current one.
+
+    `flips` lists the (table, old access, new access) tuples where a table is read differently.
+    """
+
+    def __init__(self, fingerprint, old_shape, new_shape):
+        self.fingerprint = fingerprint
+        self.old_shape = old_shape
+        self.new_shape = new_shape
+        self.flips = self._find_flips()
+
+    def _find_flips(self):
+        def access_by_table(shape):
+            return OrderedDict((entry['table'], entry['access']) for entry in shape or [] if entry['table'])
+
+        old_access = access_by_table(self.old_shape)
+        new_access = access_by_table(self.new_shape)
+
+        return [(table, old_access[table], access)
+                for table, access in new_access.items()
+                if table in old_access and old_access[table] != access]
+
+    @property
+    def is_regression(self):
+        """True if a table that was read with an index is now fully scanned."""
+        return any(old == ACCESS_INDEX and new == ACCESS_FULL_SCAN for table, old, new in self.flips)
+
+    def describe(self):
+        lines = [self.fingerprint]
+
+        if self.old_shape is None:
+            lines.append("  New query, not in snapshot")
+        elif self.new_shape is None:
+            lines.append("  Query no longer captured")
+
+        for table, old, new in self.flips:
+            lines.append("  {}: {} -> {}".format(table, old, new))
+
+        if self.old_shape is not None and self.new_shape is not None:
+            lines.append("  Before:")
+            lines.extend("    {}{}".format("  " * entry['depth'], entry['label']) for entry in self.old_shape)
+            lines.append("  After:")
+            lines.extend("    {}{}".format("  " * entry['depth'], entry['label']) for entry in self.new_shape)
+
+        return "\n".join(lines)
+
+
+class PlanSnapshot(object):
+    """
+    Plan shapes per query fingerprint, stored in a JSON file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.plans = OrderedDict()
+
+        if os.path.exists(path):
+            with open(path) as snapshot_file:
+                self.plans = json.load(snapshot_file, object_pairs_hook=OrderedDict)
+
+    def record(self, fingerprint, sql, plan):
+        self.plans[fingerprint] = {
+            'sql': sql,
+            'vendor': plan.vendor,
+            'shape': plan_shape(plan),
+        }
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(self.path, 'w') as snapshot_file:
+            json.dump(self.plans, snapshot_file, indent=2)
+
+    def compare(self, current):
+        """
+        Return the `PlanChange`s between this snapshot and another one, ignoring unchanged plans.
+        """
+        changes = []
+
+        for fingerprint in OrderedDict.fromkeys(list(self.plans) + list(current.plans)):
+            old_shape = self.plans.get(fingerprint, {}).get('shape')
+            new_shape = current.plans.get(fingerprint, {}).get('shape')
+
+            if old_shape != new_shape:
+                changes.append(PlanChange(fingerprint, old_shape, new_shape))
+
+        return changes
+
+
+def capture_plans(queries, using='default'):
+    """
+    Explain queries and return their plans in an in-memory `PlanSnapshot`.
+
+    `queries` may contain querysets, (sql, params) tuples and SQL strings.
+    A `QueryBlockReport` can also be given to use the plans it already fetched.
+    """
+    snapshot = PlanSnapshot(path="")
+
+    if hasattr(queries, 'plans'):
+        for fingerprint, plan in queries.plans.items():
+            snapshot.record(fingerprint, queries.fingerprints[fingerprint]['sql'], plan)
+
+        return snapshot
+
+    for query in queries:
+        query_using = using
+
+        if hasattr(query, 'query'):
+            sql, params = query.query.sql_with_params()
+            query_using = query.db
+        elif isinstance(query, (list, tuple)):
+            sql, params = query
+        else:
+            sql, params = query, None
+
+        plan = explain_plan(sql, params, using=query_using)
+
+        if plan is not None:
+            snapshot.record(fingerprint_sql(sql), sql, plan)
+
+    return snapshot
+
+
+def check_plan_snapshot(path, queries, update=False, using='default'):
+    """
+    Compare the current plans of `queries` with the snapshot stored at `path`.
+
+    Returns the `PlanChange`s. With `update=True`, or if the snapshot does not exist yet,
+    the snapshot is rewritten with the current plans.
+    """
+    snapshot = PlanSnapshot(path)
+    current = capture_plans(queries, using=using)
+    changes = snapshot.compare(current)
+
+    if update or not os.path.exists(path):
+        current.path = path
+        current.save()
+
+    return changes
+
+
+def assert_plans_unchanged(path, queries, allow_changes=True, using='default'):
+    """
+    Test helper that fails when a snapshotted plan flips from an index to a full scan.
+
+    With `allow_changes=False`, any change of plan shape fails.
+    """
+    changes = check_plan_snapshot(path, queries, using=using)
+    failures = [change for change in changes
+                if change.is_regression or (not allow_changes and change.old_shape is not None)]
+
+    if failures:
+        raise AssertionError("Query plans changed:\n{}".format(
+            "\n".join(change.describe() for change in failures)
+        ))
+
+
+def display_plan_changes(changes):
+    """Log plan changes, regressions first."""
+    for change in sorted(changes, key=lambda change: change.is_regression, reverse=True):
+        logger.info("-" * 60)
+
+        if change.is_regression:
+            print_yellow("Plan regression:")
+        else:
+            print_green("Plan changed:")
+
+        logger.info(change.describe())
@@ -0,0 +1,260 @@
+from collections import Counter, OrderedDict
+import logging
+import threading
+import time
+
+from django.db import connections
+from django.template.base import Node
+
+from django_query_debug.capture import _get_origin
+from django_query_debug.patch import add_lazy_load_listener, PatchDjangoDescriptors, remove_lazy_load_listener
+from django_query_debug.utils import fingerprint_sql, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+
+
+def get_active_template_trackers():
+    """Return the `TemplateTracker`s open on this thread, outermost first."""
+    if not hasattr(_local, "trackers"):
+        _local.trackers = []
+
+    return _local.trackers
+
+
+def _get_node_stack():
+    if not hasattr(_local, "nodes"):
+        _local.nodes = []
+
+    return _local.nodes
+
+
+class TemplateLocation(object):
+    """
+    A template node: the template name, the line of its tag or variable and its source,
+    e.g. `{{ book.author.name }}` or `{% for book in books %}`.
+    """
+
+    __slots__ = ('template_name', 'lineno', 'source')
+
+    def __init__(self, template_name, lineno, source):
+        self.template_name = template_name
+        self.lineno = lineno
+        self.source = source
+
+    @classmethod
+    def from_node(cls, node):
+        origin = getattr(node, 'origin', None)
+        token = getattr(node, 'token', None)
+        template_name = (origin.template_name or origin.name) if origin is not None else None
+        contents = token.contents if token is not None else type(node).__name__
+
+        if type(node).__name__ == 'VariableNode':
+            source = "{{{{ {} }}}}".format(contents)
+        else:
+            source = "{{% {} %}}".format(contents)
+
+        return cls(template_name or "<unknown>", getattr(token, 'lineno', None), source)
+
+    def _key(self):
+        return self.template_name, self.lineno, self.source
+
+    def __eq__(self, other):
+        return isinstance(other, TemplateLocation) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __str__(self):
+        return "{}:{} {}".format(self.template_name, self.lineno, self.source)
+
+    def __repr__(self):
+        return "<TemplateLocation {}>".format(self)
+
+
+def get_template_location():
+    """
+    Return the (node, loop) `TemplateLocation`s of the template node rendering on this thread,
+    or (None, None) outside templates. `loop` is the innermost `{% for %}` enclosing the node.
+    """
+    nodes = _get_node_stack()
+
+    if not nodes:
+        return None, None
+
+    loop = None
+
+    for node in reversed(nodes[:-1]):
+        if type(node).__name__ == 'ForNode':
+            loop = TemplateLocation.from_node(node)
+            break
+
+    return TemplateLocation.from_node(nodes[-1]), loop
+
+
+class TemplateLocationStats(object):
+    """
+    Queries and lazy loads of one template node.
+    """
+
+    def __init__(self, location, loop=None):
+        self.location = location
+        self.loop = loop
+        self.count = 0
+        self.total_time = 0.0
+        self.fingerprints = Counter()
+        self.lazy_loads = Counter()
+
+    @property
+    def suggestion(self):
+        if self.loop is None or self.count < 2:
+            return None
+
+        if self.lazy_loads:
+            return "Prefetch the relations read in the loop {} with select_related() or " \
+                   "prefetch_related()".format(self.loop)
+
+        return "{} queries run inside the loop {}, fetch them once in the view".format(self.count, self.loop)
+
+    def describe(self):
+        return "{}: {} quer{}, {}s".format(self.location, self.count, "y" if self.count == 1 else "ies",
+                                           round(self.total_time, 6))
+
+
+class TemplateTracker(object):
+    """
+    Attribute queries and lazy loads on this thread to the Django template node being rendered.
+
+    Queries are aggregated per template location with their count and time. Lazy loads
+    are recorded from `PatchDjangoDescriptors`, which is applied if needed. When a
+    `QueryCapture` opened before the tracker is given, its queries run inside templates
+    get `extra['template']` and `extra['template_loop']`.
+    """
+
+    def __init__(self, capture=None):
+        self.capture = capture
+        self.stats = OrderedDict()
+        self._locations = []
+        self._capture_start = 0
+        self._origin = None
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        _install_patch()
+        PatchDjangoDescriptors(force=True)
+
+        if self.capture is not None:
+            self._capture_start = len(self.capture.queries)
+            self._origin = _get_origin()
+
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self)
+            self._wrapped_connections.append(connection)
+
+        add_lazy_load_listener(self.record_lazy_load)
+        get_active_template_trackers().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_template_trackers().remove(self)
+        remove_lazy_load_listener(self.record_lazy_load)
+
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self)
+
+        self._wrapped_connections = []
+
+        if self.capture is not None:
+            # Both saw the queries of this thread in the same order, a `ContextQueryCapture`
+            # also has the queries of other threads and tasks
+            queries = [query for query in self.capture.queries[self._capture_start:]
+                       if query.extra.get('origin', self._origin) == self._origin]
+
+            for query, (location, loop) in zip(queries, self._locations):
+                if location is not None:
+                    query.extra['template'] = location
+                    query.extra['template_loop'] = loop
+
+        self._locations = []
+
+    def _get_stats(self, location, loop):
+        if location not in self.stats:
+            self.stats[location] = TemplateLocationStats(location, loop)
+
+        return self.stats[location]
+
+    def __call__(self, execute, sql, params, many, context):
+        location, loop = get_template_location()
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.time() - start_time
+
+            if self.capture is not None:
+                self._locations.append((location, loop))
+
+            if location is not None:
+                stats = self._get_stats(location, loop)
+                stats.count += 1
+                stats.total_time += duration
+                stats.fingerprints[fingerprint_sql(sql)] += 1
+
+    def record_lazy_load(self, message):
+        location, loop = get_template_location()
+
+        if location is not None:
+            self._get_stats(location, loop).lazy_loads[message] += 1
+
+    def get_stats(self):
+        """Return the `TemplateLocationStats`, most queries first."""
+        return sorted(self.stats.values(), key=lambda stats: (stats.count, stats.total_time), reverse=True)
+
+
+def display_template_stats(stats_list):
+    for stats in stats_list:
+        logger.info("-" * 60)
+        logger.info("Template {}".format(stats.describe()))
+
+        for message, count in stats.lazy_loads.most_common():
+            logger.info("{}x {}".format(count, message))
+
+        if stats.suggestion:
+            print_yellow(stats.suggestion)
+
+
+_patched = False
+
+
+def _install_patch():
+    """Patch `Node.render_annotated` once, on first use, to track the node being rendered."""
+    global _patched
+
+    if _patched:
+        return
+
+    _patched = True
+
+    original_render_annotated = Node.render_annotated
+
+    def render_annotated(self, context):
+        if not get_active_template_trackers():
+            return original_render_annotated(self, context)
+
+        nodes = _get_node_stack()
+        nodes.append(self)
+
+        try:
+            return original_render_annotated(self, context)
+        finally:
+            nodes.pop()
+
+    Node.render_annotated = render_annotated
@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from django_query_debug.utils import get_call_site, print_yellow
+
+
+logger = logging.getLogger('query_debug')
+
+_local = threading.local()
+
+
+def get_active_trackers():
+    """Return the `TransactionTracker`s open on this thread, outermost first."""
+    if not hasattr(_local, "trackers"):
+        _local.trackers = []
+
+    return _local.trackers
+
+
+def _get_atomic_entries():
+    """
+    Return {id(Atomic): entries} for the atomic blocks open on this thread.
+
+    Kept per thread, an `Atomic` used as a decorator is shared by every thread.
+    """
+    if not hasattr(_local, "atomic_entries"):
+        _local.atomic_entries = {}
+
+    return _local.atomic_entries
+
+
+class AtomicBlock(object):
+    """
+    An `atomic()` block that exited while a `TransactionTracker` was open.
+
+    `savepoint` is True for nested blocks that created a savepoint, and
+    `query_count` counts the queries the block ran, including its nested blocks.
+    """
+
+    def __init__(self, alias, call_site, depth, savepoint, duration, query_count, rolled_back):
+        self.alias = alias
+        self.call_site = call_site
+        self.depth = depth
+        self.savepoint = savepoint
+        self.duration = duration
+        self.query_count = query_count
+        self.rolled_back = rolled_back
+
+    def describe(self):
+        filename, lineno, function = self.call_site or ("<unknown>", 0, "<unknown>")
+
+        return "{} on {} from {}:{} in {}: {}s, {} queries{}".format(
+            "Savepoint" if self.savepoint else ("Nested atomic" if self.depth else "Transaction"),
+            self.alias, filename, lineno, function, round(self.duration, 6), self.query_count,
+            ", rolled back" if self.rolled_back else ""
+        )
+
+
+class TransactionTracker(object):
+    """
+    Record connection lifecycle and transaction activity on this thread while open.
+
+    Counts connection opens and closes with the time spent connecting, commits, rollbacks
+    and savepoints with the time spent on them, and the duration of each `atomic()` block.
+    """
+
+    def __init__(self, capture=None):
+        self.capture = capture
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connect_time = 0.0
+        self.transactions = 0
+        self.commits = 0
+        self.rollbacks = 0
+        self.savepoints = 0
+        self.savepoint_releases = 0
+        self.savepoint_rollbacks = 0
+        self.overhead_time = 0.0
+        self.atomic_blocks = []
+
+    def __enter__(self):
+        _install_patch()
+        get_active_trackers().append(self)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        get_active_trackers().remove(self)
+
+    @property
+    def query_index(self):
+        return len(self.capture.queries) if self.capture is not None else 0
+
+    @property
+    def has_activity(self):
+        return any((self.connections_opened, self.connections_closed, self.commits, self.rollbacks,
+                    self.savepoints, self.atomic_blocks))
+
+    def slow_atomic_blocks(self, threshold):
+        """Return the atomic blocks that took at least `threshold` seconds, slowest first."""
+        return sorted((block for block in self.atomic_blocks if block.duration >= threshold),
+                      key=lambda block: block.duration, reverse=True)
+
+
+def display_transaction_stats(tracker, atomic_time_threshold):
+    if not tracker.has_activity:
+        return
+
+    logger.info("-" * 60)
+    logger.info("Connections opened: {} ({}s), closed: {}".format(tracker.connections_opened,
+                                                                  round(tracker.connect_time, 6),
+                                                                  tracker.connections_closed))
+    logger.info("Transactions: {}, commits: {}, rollbacks: {}".format(tracker.transactions,
+                                                                      tracker.commits,
+                                                                      tracker.rollbacks))
+    logger.info("Savepoints: {}, released: {}, rolled back: {}".format(tracker.savepoints,
+                                                                       tracker.savepoint_releases,
+                                                                       tracker.savepoint_rollbacks))
+    logger.info("Time spent on transaction control: {}s".format(round(tracker.overhead_time, 6)))
+
+    if tracker.connections_opened:
+        conn_max_ages = set(database.get('CONN_MAX_AGE', 0) for database in settings.DATABASES.values())
+
+        if conn_max_ages == {0}:
+            print_yellow("CONN_MAX_AGE is 0, a new connection is opened for every request")
+
+    for block in tracker.slow_atomic_blocks(atomic_time_threshold):
+        print_yellow(block.describe())
+
+
+_patched = False
+
+
+def _timed(method, counter):
+    """Wrap a connection method to count its calls and add its time to the transaction overhead."""
+    def wrapper(self, *args, **kwargs):
+        trackers = get_active_trackers()
+
+        if not trackers:
+            return method(self, *args, **kwargs)
+
+        start_time = time.time()
+
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start_time
+
+            for tracker in trackers:
+                setattr(tracker, counter, getattr(tracker, counter) + 1)
+                tracker.overhead_time += elapsed
+
+    return wrapper
+
+
+def _install_patch():
+    """Patch the connection wrapper and `Atomic` once, on first use."""
+    global _patched
+
+    if _patched:
+        return
+
+    _patched = True
+
+    original_connect = BaseDatabaseWrapper.connect
+    original_close = BaseDatabaseWrapper.close
+    original_atomic_enter = transaction.Atomic.__enter__
+    original_atomic_exit = transaction.Atomic.__exit__
+
+    def connect(self, *args, **kwargs):
+        trackers = get_active_trackers()
+        start_time = time.time()
+
+        try:
+            return original_connect(self, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start_time
+
+            for tracker in trackers:
+                tracker.connections_opened += 1
+                tracker.connect_time += elapsed
+
+    def close(self, *args, **kwargs):
+        is_open = self.connection is not None and not self.closed_in_transaction
+
+        try:
+            return original_close(self, *args, **kwargs)
+        finally:
+            if is_open:
+                for tracker in get_active_trackers():
+                    tracker.connections_closed += 1
+
+    def atomic_enter(self):
+        trackers = get_active_trackers()
+
+        if not trackers:
+            return original_atomic_enter(self)
+
+        connection = transaction.get_connection(self.using)
+        depth = len(connection.savepoint_ids) + 1 if connection.in_atomic_block else 0
+        call_site = get_call_site()
+        query_indexes = [(tracker, tracker.query_index) for tracker in trackers]
+        start_time = time.time()
+
+        original_atomic_enter(self)
+
+        if depth == 0:
+            for tracker in trackers:
+                tracker.transactions += 1
+
+        savepoint = depth > 0 and connection.savepoint_ids[-1] is not None
+
+        # The same Atomic is reused by recursive calls when used as a decorator
+        entries = _get_atomic_entries().setdefault(id(self), [])
+        entries.append((connection.alias, call_site, depth, savepoint, start_time, query_indexes))
+
+    def atomic_exit(self, exc_type, exc_value, traceback):
+        atomic_entries = _get_atomic_entries()
+        entries = atomic_entries.get(id(self))
+
+        if not entries:
+            return original_atomic_exit(self, exc_type, exc_value, traceback)
+
+        alias, call_site, depth, savepoint, start_time, query_indexes = entries.pop()
+
+        if not entries:
+            del atomic_entries[id(self)]
+
+        rolled_back = exc_type is not None or transaction.get_connection(self.using).needs_rollback
+
+        try:
+            return original_atomic_exit(self, exc_type, exc_value, traceback)
+        finally:
+            duration = time.time() - start_time
+
+            for tracker, query_index in query_indexes:
+                tracker.atomic_blocks.append(AtomicBlock(alias, call_site, depth, savepoint, duration,
+                                                         tracker.query_index - query_index, rolled_back))
+
+    BaseDatabaseWrapper.connect = connect
+    BaseDatabaseWrapper.close = close
+    BaseDatabaseWrapper.commit = _timed(BaseDatabaseWrapper.commit, 'commits')
+    BaseDatabaseWrapper.rollback = _timed(BaseDatabaseWrapper.rollback, 'rollbacks')
+    BaseDatabaseWrapper.savepoint = _timed(BaseDatabaseWrapper.savepoint, 'savepoints')
+    BaseDatabaseWrapper.savepoint_commit = _timed(BaseDatabaseWrapper.savepoint_commit, 'savepoint_releases')
+    BaseDatabaseWrapper.savepoint_rollback = _timed(BaseDatabaseWrapper.savepoint_rollback,
+                                                    'savepoint_rollbacks')
+    transaction.Atomic.__enter__ = atomic_enter
+    transaction.Atomic.__exit__ = atomic_exit
@@ -1,28 +1,23 @@
 from collections import OrderedDict
 from contextlib import contextmanager
 from functools import partial
+import json
+import linecache
 import logging
+import os
+import re
+import sys
+import sysconfig
 import time
-import traceback
 
-from depocs import Scoped
-from django.db import connection, connections, reset_queries
+import django
+from django.db import connections, DatabaseError, transaction
 import six
-import sqlparse
 
 
 logger = logging.getLogger('query_debug')
 
 
-class FieldUsageSession(Scoped):
-    """
-    Prevent field usage increases.
-    """
-
-    def __init__(self, disable_tracking=False):
-        self.disable_tracking = disable_tracking
-
-
 class StringFormatter(object):
     formatters = {
         'GREEN': '\033[92m',
@@ -62,6 +57,9 @@ def format_sql(sql):
 
     If the pygments package is available, it will be used for syntax highlighting.
     """
+    # Imported on first use, they are only needed once a query is logged
+    import sqlparse
+
     formatted_sql = sqlparse.format(sql, reindent=True, keyword_case='upper')
 
     try:
@@ -80,8 +78,146 @@ def format_sql(sql):
     return formatted_sql
 
 
+class LazyFormattedSQL(object):
+    """
+    Defer `format_sql` until a log record is rendered.
+
+    Pass as a `%s` logging argument so the formatting runs on the handler's thread.
+    """
+
+    def __init__(self, sql):
+        self.sql = sql
+
+    def __str__(self):
+        return format_sql(self.sql)
+
+
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r"(?<![\w\".])-?\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s")
+_IN_LIST_RE = re.compile(r"\bIN\s*\((?:\s*\?\s*,?)+\)", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def fingerprint_sql(sql):
+    """
+    Normalize a SQL statement so that queries differing only by literal values
+    share the same fingerprint.
+
+    String and numeric literals and `%s` placeholders are replaced with `?`, so raw and
+    interpolated SQL share fingerprints, and `IN (...)` lists are collapsed.
+    """
+    fingerprint = _STRING_LITERAL_RE.sub("?", sql)
+    fingerprint = _NUMBER_LITERAL_RE.sub("?", fingerprint)
+    fingerprint = _PLACEHOLDER_RE.sub("?", fingerprint)
+    fingerprint = _IN_LIST_RE.sub("IN (...)", fingerprint)
+
+    return _WHITESPACE_RE.sub(" ", fingerprint).strip()
+
+
+class QueryBlockReport(object):
+    """
+    Query statistics collected by `analyze_block`.
+
+    `queries` maps each distinct SQL statement to its stats and
+    `fingerprints` aggregates those stats by normalized SQL.
+    `write_runs` lists repeated single-row writes that could be batched and
+    `over_fetching` the queries that loaded rows or columns that were not used, and
+    `wasted_joins` the `select_related` paths whose instances or columns were not read.
+    `memory` holds the memory allocated per queryset evaluation site when profiled,
+    and `phases` the compile, execute, fetch and hydrate times per fingerprint.
+    `transactions` is the `TransactionTracker` with connection, transaction, savepoint
+    and atomic block stats. `templates` holds the queries and lazy loads per template
+    location when tracked, and `origins` the query count and time per thread or task
+    when threads are followed.
+    """
+
+    def __init__(self):
+        self.elapsed_time = 0.0
+        self.query_count = 0
+        self.total_query_time = 0.0
+        self.total_objects_fetched = 0
+        self.duplicate_query_count = 0
+        self.queries = OrderedDict()
+        self.fingerprints = OrderedDict()
+        self.plans = OrderedDict()
+        self.write_runs = []
+        self.over_fetching = []
+        self.wasted_joins = []
+        self.memory = []
+        self.phases = []
+        self.transactions = None
+        self.templates = []
+        self.origins = OrderedDict()
+
+    def add_fingerprint_stats(self, sql, query_time, num_results, alias='default'):
+        fingerprint = fingerprint_sql(sql)
+
+        if fingerprint not in self.fingerprints:
+            self.fingerprints[fingerprint] = {
+                'count': 0,
+                'time': 0.0,
+                'num_results': 0,
+                'sql': sql,
+                'alias': alias,
+            }
+
+        stats = self.fingerprints[fingerprint]
+        stats['count'] += 1
+        stats['time'] += query_time
+        stats['num_results'] += num_results
+
+    def plans_by_severity(self):
+        """Return (fingerprint, plan) pairs, most severe plan first and slowest first for equal severity."""
+        return sorted(self.plans.items(),
+                      key=lambda item: (item[1].severity, self.fingerprints[item[0]]['time']),
+                      reverse=True)
+
+
+_plan_cache = {}
+
+
+def get_cached_plan(sql, fingerprint=None, using='default'):
+    """
+    Return the `QueryPlan` of a SQL statement, fetching it at most once per fingerprint.
+
+    Only SELECT statements are explained. Returns None if no plan is available.
+    """
+    if fingerprint is None:
+        fingerprint = fingerprint_sql(sql)
+
+    cache_key = (using, fingerprint)
+
+    if cache_key not in _plan_cache:
+        from django_query_debug.plans import explain_plan
+
+        plan = None
+
+        if sql.lstrip()[:6].upper() == "SELECT":
+            try:
+                plan = explain_plan(sql, using=using)
+            except DatabaseError as e:
+                logger.warning("Could not explain query: {}".format(e))
+
+        _plan_cache[cache_key] = plan
+
+    return _plan_cache[cache_key]
+
+
+def _should_explain(stats, explain_time_threshold, explain_count_threshold):
+    if explain_time_threshold is not None and stats['time'] >= explain_time_threshold:
+        return True
+    if explain_count_threshold is not None and stats['count'] >= explain_count_threshold:
+        return True
+
+    return False
+
+
 @contextmanager
-def analyze_block():
+def analyze_block(count_results=True, explain_time_threshold=None, explain_count_threshold=None,
+                  track_instances=False, profile_memory=False, memory_threshold=10 * 1024 * 1024,
+                  profile_phases=False, atomic_time_threshold=0.1, track_templates=False,
+                  follow_threads=False):
     """
     Context manager to analyze query usage of a block of code.
 
@@ -90,53 +226,210 @@ def analyze_block():
     * Query counts and duplicate queries
     * Total rows fetched and serialized
     * Raw SQL statement, query time, and total rows fetched per query
+    * Single-row writes repeated from one call site, with bulk alternatives
+
+    Queries are captured on every database alias, `DEBUG` does not need to be enabled.
+
+    Yields a `QueryBlockReport` that is populated when the block exits.
+    If a stats sink is configured, the report is also recorded to it.
+
+    Counting results re-executes each distinct SELECT once, pass `count_results=False`
+    to skip that when the block runs somewhere the extra DB load matters.
+
+    With `track_instances=True`, model instances are attributed to the query that loaded
+    them, and field reads of `FieldUsageMixin` models to those instances, to report
+    queries that fetched rows or columns that were never used, and `select_related` joins
+    whose instances, or most of their columns, were never read.
+
+    With `profile_memory=True`, `tracemalloc` measures the peak and retained memory of each
+    queryset evaluation, grouped by fingerprint and call site. Evaluations that peak above
+    `memory_threshold` bytes get an `.iterator()` or `.values()` recommendation.
+
+    With `profile_phases=True`, the time of each fingerprint is split into SQL compilation,
+    database execution, row fetching and conversion, and model instance hydration.
+
+    With `track_templates=True`, queries and lazy loads are attributed to the Django template
+    node being rendered, and aggregated per template location in `report.templates`.
+
+    With `follow_threads=True`, the queries of threads, `ThreadPoolExecutor` jobs and asyncio
+    tasks started inside the block are captured too, and `report.origins` holds the query
+    count and time per thread or task. The other stats only cover the calling thread.
+
+    Connection opens and closes, commits, rollbacks, savepoints and the duration of each
+    `atomic()` block are recorded, and blocks slower than `atomic_time_threshold` seconds
+    are logged with their call site.
+
+    Fingerprints whose total time in seconds reaches `explain_time_threshold`, or whose
+    count reaches `explain_count_threshold`, are explained automatically. Plans are cached
+    per fingerprint for the life of the process and stored in `report.plans`.
     """
-    reset_queries()
+    from django_query_debug.capture import ContextQueryCapture, QueryCapture
+    from django_query_debug.overfetch import display_over_fetching, display_wasted_joins, InstanceUsageTracker
+    from django_query_debug.sink import get_stats_sink
+    from django_query_debug.transactions import display_transaction_stats, TransactionTracker
+    from django_query_debug.writes import detect_row_by_row_writes
+
+    report = QueryBlockReport()
+    capture = ContextQueryCapture() if follow_threads else QueryCapture()
+    transaction_tracker = TransactionTracker(capture)
+    tracker = InstanceUsageTracker(capture) if track_instances else None
+    memory_profiler = None
+
+    if profile_memory:
+        from django_query_debug.memory import display_memory_stats, QuerysetMemoryProfiler
+
+        memory_profiler = QuerysetMemoryProfiler(capture, threshold=memory_threshold)
+
+    phase_timer = None
+
+    if profile_phases:
+        from django_query_debug.phases import display_phase_stats, PhaseTimer
+
+        phase_timer = PhaseTimer()
+
+    template_tracker = None
+
+    if track_templates:
+        from django_query_debug.templates import display_template_stats, TemplateTracker
+
+        template_tracker = TemplateTracker(capture)
+
+    scopes = [scope for scope in (capture, transaction_tracker, tracker, memory_profiler, phase_timer,
+                                  template_tracker)
+              if scope is not None]
+
+    for scope in scopes:
+        scope.__enter__()
+
     start_time = time.time()
 
-    yield
+    try:
+        yield report
+    finally:
+        for scope in reversed(scopes):
+            scope.__exit__(None, None, None)
 
     elapsed_time = time.time() - start_time
-    sql_queries = list(connection.queries)
-    query_count = len(sql_queries)
+    query_count = len(capture.queries)
     total_query_time = 0.0
     total_objects_fetched = 0
     duplicate_query_count = 0
-    analyzed_queries = OrderedDict()
+    analyzed_queries = report.queries
 
-    for index, query in enumerate(sql_queries):
-        query_time = float(query['time'])
-        total_query_time += float(query['time'])
+    for index, query in enumerate(capture.queries):
+        query_time = query.duration
+        total_query_time += query_time
+        sql = query.display_sql
 
-        if query['sql'] in analyzed_queries:
+        if sql in analyzed_queries:
             # Duplicate
             duplicate_query_count += 1
-            analyzed_queries[query['sql']]['seen'] += 1
+            analyzed_queries[sql]['seen'] += 1
             # average out the time
-            analyzed_queries[query['sql']]['time'] = (analyzed_queries[query['sql']]['time'] + query_time) / 2.0
+            analyzed_queries[sql]['time'] = (analyzed_queries[sql]['time'] + query_time) / 2.0
         else:
-            with connection.cursor() as cursor:
-                cursor.execute(query['sql'])
-                rows_fetched = len(cursor.fetchall())
+            rows_fetched = 0
 
-            analyzed_queries[query['sql']] = {
+            if count_results and query.statement_type == "SELECT":
+                with connections[query.alias].cursor() as cursor:
+                    cursor.execute(query.sql, query.params)
+                    rows_fetched = len(cursor.fetchall())
+
+            analyzed_queries[sql] = {
                 'time': query_time,
                 'num_results': rows_fetched,
                 'seen': 1,
+                'alias': query.alias,
+            }
+
+        total_objects_fetched += analyzed_queries[sql]['num_results']
+        report.add_fingerprint_stats(sql, query_time, analyzed_queries[sql]['num_results'], query.alias)
+
+    report.elapsed_time = elapsed_time
+    report.query_count = query_count
+    report.total_query_time = total_query_time
+    report.total_objects_fetched = total_objects_fetched
+    report.duplicate_query_count = duplicate_query_count
+    report.write_runs = detect_row_by_row_writes(capture.queries)
+    report.transactions = transaction_tracker
+
+    if follow_threads:
+        for origin, origin_queries in capture.queries_by_origin().items():
+            report.origins[origin] = {
+                'count': len(origin_queries),
+                'time': sum(query.duration for query in origin_queries),
             }
 
-        total_objects_fetched += analyzed_queries[query['sql']]['num_results']
-        total_query_time += float(query['time'])
+    if memory_profiler is not None:
+        report.memory = memory_profiler.get_stats()
+
+    if phase_timer is not None:
+        report.phases = phase_timer.get_stats()
+
+    if template_tracker is not None:
+        report.templates = template_tracker.get_stats()
+
+    if track_instances:
+        row_counts = None
+
+        if count_results:
+            row_counts = {sql: analysis['num_results'] for sql, analysis in analyzed_queries.items()}
+
+        report.over_fetching = tracker.find_over_fetching(row_counts=row_counts)
+        report.wasted_joins = tracker.find_wasted_joins()
+
+    for fingerprint, stats in report.fingerprints.items():
+        if _should_explain(stats, explain_time_threshold, explain_count_threshold):
+            plan = get_cached_plan(stats['sql'], fingerprint=fingerprint, using=stats['alias'])
+
+            if plan is not None:
+                report.plans[fingerprint] = plan
+
+    sink = get_stats_sink()
+
+    if sink is not None:
+        sink.record_block(report)
 
     for index, (sql, analysis) in enumerate(analyzed_queries.items()):
         logger.info("-" * 60)
         logger.info("Query {} summary".format(index))
-        logger.info("SQL Statement:\n{}".format(format_sql(sql)))
+        logger.info("SQL Statement:\n%s", LazyFormattedSQL(sql))
         logger.info("Query time: {}s".format(analysis['time']))
-        logger.info("Number of results: {}".format(analysis['num_results']))
+        if count_results:
+            logger.info("Number of results: {}".format(analysis['num_results']))
         if analysis['seen'] > 1:
             logger.info("Duplicated {} times".format(analysis['seen']))
 
+        plan = report.plans.get(fingerprint_sql(sql))
+        if plan is not None:
+            logger.info("Query plan:\n{}".format(plan))
+            for finding in plan.findings:
+                print_yellow(str(finding))
+
+    for write_run in report.write_runs:
+        logger.info("-" * 60)
+        print_yellow("Row-by-row writes: {}".format(write_run.describe()))
+        logger.info(write_run.suggestion)
+
+    display_over_fetching(report.over_fetching)
+    display_wasted_joins(report.wasted_joins)
+    display_transaction_stats(report.transactions, atomic_time_threshold)
+
+    if memory_profiler is not None:
+        display_memory_stats(report.memory, memory_profiler.top_retained, memory_threshold)
+
+    if phase_timer is not None:
+        display_phase_stats(report.phases)
+
+    if template_tracker is not None:
+        display_template_stats(report.templates)
+
+    if len(report.origins) > 1:
+        logger.info("-" * 60)
+
+        for origin, origin_stats in report.origins.items():
+            logger.info("{}: {} queries, {}s".format(origin, origin_stats['count'], round(origin_stats['time'], 6)))
+
     percent_query_time = round(total_query_time / elapsed_time * 100.0, 2)
     logger.info("=" * 60)
     logger.info("Elapsed time: {}s".format(elapsed_time))
@@ -147,46 +440,156 @@ def analyze_block():
     logger.info("Total objects fetched: {}".format(total_objects_fetched))
 
 
-def explain_queryset(queryset):
-    supported_db_and_prefixes = {
-        'sqlite': 'EXPLAIN QUERY PLAN',
-        'postgresql': 'EXPLAIN ANALYZE',
-        'mysql': 'EXPLAIN'
-    }
+EXPLAIN_MODES = ('plan', 'analyze', 'buffers')
+EXPLAIN_FORMATS = ('text', 'json')
+
+
+def get_explain_prefix(vendor, mode='plan', format='text'):
+    """
+    Return the EXPLAIN prefix for a database vendor, mode and output format.
+
+    `plan` only plans the query, `analyze` executes it to report actual timings and
+    `buffers` also reports buffer usage. Raises ValueError for unsupported combinations.
+    """
+    if mode not in EXPLAIN_MODES:
+        raise ValueError("Unknown explain mode '{}'".format(mode))
+    if format not in EXPLAIN_FORMATS:
+        raise ValueError("Unknown explain format '{}'".format(format))
+
+    if vendor == 'postgresql':
+        options = []
+
+        if mode in ('analyze', 'buffers'):
+            options.append('ANALYZE')
+        if mode == 'buffers':
+            options.append('BUFFERS')
+        if format == 'json':
+            options.append('FORMAT JSON')
+
+        return 'EXPLAIN ({})'.format(', '.join(options)) if options else 'EXPLAIN'
+    elif vendor == 'mysql':
+        if mode == 'buffers' or (mode == 'analyze' and format == 'json'):
+            raise ValueError("Explain mode '{}' with format '{}' is not available for MySQL".format(mode, format))
+
+        if mode == 'analyze':
+            return 'EXPLAIN ANALYZE'
+
+        return 'EXPLAIN FORMAT=JSON' if format == 'json' else 'EXPLAIN'
+    elif vendor == 'sqlite':
+        if mode != 'plan' or format != 'text':
+            raise ValueError("SQLite only supports the 'plan' explain mode with 'text' format")
+
+        return 'EXPLAIN QUERY PLAN'
+
+    return None
+
+
+@contextmanager
+def _statement_timeout(query_connection, timeout):
+    """
+    Abort statements on a connection that run longer than `timeout` seconds.
+
+    Must be used inside a transaction on PostgreSQL so the setting is scoped to it.
+    """
+    if timeout is None:
+        yield
+        return
+
+    if query_connection.vendor == 'postgresql':
+        with query_connection.cursor() as cursor:
+            cursor.execute("SET LOCAL statement_timeout = %s", [int(timeout * 1000)])
+        yield
+    elif query_connection.vendor == 'mysql':
+        with query_connection.cursor() as cursor:
+            cursor.execute("SELECT @@SESSION.max_execution_time")
+            previous_timeout = cursor.fetchone()[0]
+            cursor.execute("SET SESSION max_execution_time = %s", [int(timeout * 1000)])
+        try:
+            yield
+        finally:
+            with query_connection.cursor() as cursor:
+                cursor.execute("SET SESSION max_execution_time = %s", [previous_timeout])
+    elif query_connection.vendor == 'sqlite':
+        deadline = time.time() + timeout
+
+        query_connection.ensure_connection()
+        # A non-zero return value interrupts the running statement
+        query_connection.connection.set_progress_handler(lambda: time.time() > deadline, 1000)
+        try:
+            yield
+        finally:
+            query_connection.connection.set_progress_handler(None, 1000)
+    else:
+        yield
+
+
+def run_explain(sql, params=None, using='default', prefix='EXPLAIN', timeout=None):
+    """
+    Execute a SQL statement with an EXPLAIN prefix and return the (columns, rows) of the result.
+
+    Runs in a transaction that is rolled back, so explaining a write with ANALYZE leaves no
+    changes behind. `timeout` limits the run time in seconds.
+    """
+    query_connection = connections[using]
+
+    with transaction.atomic(using=using):
+        with _statement_timeout(query_connection, timeout):
+            with query_connection.cursor() as cursor:
+                cursor.execute('{} {}'.format(prefix, sql), params)
+                columns = [column[0] for column in cursor.description or []]
+                rows = cursor.fetchall()
+
+        transaction.set_rollback(True, using=using)
 
-    query_connection = connections[queryset.db]
-    db_vendor = query_connection.vendor
+    return columns, rows
 
-    if db_vendor not in supported_db_and_prefixes:
+
+def explain_sql(sql, params=None, using='default', mode='plan', format='text', timeout=None):
+    """
+    Return the query plan of a SQL statement as a string.
+
+    See `get_explain_prefix` for the available modes and formats. The default `plan`
+    mode never executes the query.
+    """
+    db_vendor = connections[using].vendor
+    prefix = get_explain_prefix(db_vendor, mode=mode, format=format)
+
+    if prefix is None:
         logger.warning("Query plan explanation is not available for '{}' database.".format(db_vendor))
         return None
 
     # Execute the query with the explain prefix
-    cursor = query_connection.cursor()
-    query, params = queryset.query.sql_with_params()
-    cursor.execute('{} {}'.format(supported_db_and_prefixes[db_vendor], query), params)
+    columns, results = run_explain(sql, params, using=using, prefix=prefix, timeout=timeout)
 
-    results = cursor.fetchall()
+    def parse_column(column):
+        if isinstance(column, six.string_types):
+            return column
+        if format == 'json':
+            return json.dumps(column)
 
-    def parse_result(result):
-        if not isinstance(result, str):
-            return ' '.join(str(c) for c in result)
-        else:
-            return result
+        return str(column)
+
+    return '\n'.join(' '.join(parse_column(c) for c in result) for result in results)
+
+
+def explain_queryset(queryset, mode='plan', format='text', timeout=None):
+    query, params = queryset.query.sql_with_params()
 
-    return '\n'.join(parse_result(result) for result in results)
+    return explain_sql(query, params, using=queryset.db, mode=mode, format=format, timeout=timeout)
 
 
-def analyze_queryset(qs):
+def analyze_queryset(qs, mode='plan', format='text', timeout=None):
     """
     Analyze SQL query of queryset.
+
+    See `explain_queryset` for the options.
     """
 
-    if hasattr(qs, 'explain'):
+    if hasattr(qs, 'explain') and (mode, format, timeout) == ('plan', 'text', None):
         # Django 2.1+ has this feature built-in
         query_explained = qs.explain()
     else:
-        query_explained = explain_queryset(qs)
+        query_explained = explain_queryset(qs, mode=mode, format=format, timeout=timeout)
 
     if not query_explained:
         return
@@ -194,6 +597,101 @@ def analyze_queryset(qs):
     logger.info("SQL Query explain: ")
     logger.info(query_explained)
 
+    from django_query_debug.plans import explain_queryset_plan
+
+    plan = explain_queryset_plan(qs, timeout=timeout)
+
+    if plan is None:
+        return
+
+    if plan.estimated_cost is not None or plan.estimated_rows is not None:
+        logger.info("Estimated cost: {}, estimated rows: {}".format(plan.estimated_cost, plan.estimated_rows))
+
+    for finding in plan.findings:
+        print_yellow(str(finding))
+
+
+_LIBRARY_PATHS = tuple(set(
+    os.path.normcase(os.path.abspath(path)) + os.sep
+    for path in [sysconfig.get_paths().get(name) for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')] + [
+        os.path.dirname(django.__file__),
+        os.path.dirname(__file__),
+    ]
+    if path
+))
+_library_code_cache = {}
+
+
+def _is_library_code(code):
+    """Return True if the code object belongs to Django, this package, or an installed library."""
+    try:
+        return _library_code_cache[code]
+    except KeyError:
+        filename = os.path.normcase(os.path.abspath(code.co_filename))
+        is_library = filename.startswith(_LIBRARY_PATHS) or code.co_filename.startswith("<")
+        _library_code_cache[code] = is_library
+
+        return is_library
+
+
+def get_call_stack(limit=7, skip=1):
+    """
+    Return up to `limit` (filename, lineno, function) tuples of application code,
+    most recent call last.
+
+    Library frames are skipped. If the stack has no application frames,
+    the innermost frames are returned instead.
+    """
+    frame = sys._getframe(skip)
+    stack = []
+    fallback_stack = []
+
+    while frame is not None and len(stack) < limit:
+        code = frame.f_code
+        entry = (code.co_filename, frame.f_lineno, code.co_name)
+
+        if not _is_library_code(code):
+            stack.append(entry)
+        elif len(fallback_stack) < limit:
+            fallback_stack.append(entry)
+
+        frame = frame.f_back
+
+    if not stack:
+        stack = fallback_stack
+
+    stack.reverse()
+
+    return stack
+
+
+def get_call_site():
+    """Return the (filename, lineno, function) of the innermost application frame."""
+    stack = get_call_stack(limit=1, skip=2)
+
+    return stack[-1] if stack else None
+
+
+class LazyStack(object):
+    """
+    Stack entries that are only rendered, with their source lines, when logged.
+    """
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def __str__(self):
+        lines = []
+
+        for filename, lineno, function in self.stack:
+            lines.append('  File "{}", line {}, in {}'.format(filename, lineno, function))
+            source_line = linecache.getline(filename, lineno).strip()
+
+            if source_line:
+                lines.append("    {}".format(source_line))
+
+        return "\n".join(lines)
+
 
 class TracebackLogger(object):
     """
@@ -201,15 +699,18 @@ class TracebackLogger(object):
     """
 
     @staticmethod
-    def print_traceback():
+    def print_traceback(limit=7):
         """
         Print the traceback containing the method that triggered the query.
 
-        Ignore the last 3 entries which would be the __getattribute__,
-        warn_on_cold_cache, and the _print_traceback methods in this class.
+        Only application frames are included; frames from Django, this package and
+        installed libraries are skipped. Source lines are read when the record is rendered,
+        and nothing is captured unless the `query_debug` logger is enabled for DEBUG.
         """
-        stack = traceback.extract_stack(limit=7)[:-2]
-        traceback.print_list(stack, file=TracebackLogger)
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+
+        logger.debug("Traceback (most recent call last):\n%s", LazyStack(get_call_stack(limit=limit, skip=2)))
 
     @staticmethod
     def write(log):
@@ -217,3 +718,22 @@ class TracebackLogger(object):
 
 
 formatter = StringFormatter()
+
+
+def get_models_by_table():
+    """Return installed models, including auto-created through models, keyed by table name."""
+    from django.apps import apps
+
+    return {model._meta.db_table: model for model in apps.get_models(include_auto_created=True)}
+
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # Resolved on first use, so that the patch can import utils without loading depocs
+        if name == 'FieldUsageSession':
+            from django_query_debug.session import FieldUsageSession  # noqa: F811
+            return FieldUsageSession
+
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+else:
+    from django_query_debug.session import FieldUsageSession  # noqa: F401
@@ -0,0 +1,417 @@
+from collections import OrderedDict
+import atexit
+import datetime
+import decimal
+import gzip
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from six.moves import queue
+
+from django_query_debug.utils import fingerprint_sql, get_call_site
+
+
+logger = logging.getLogger('query_debug')
+
+
+def _serialize_params(params, many):
+    if many:
+        # executemany may be given an iterator, which is consumed by then
+        return [list(row) for row in params] if isinstance(params, (list, tuple)) else None
+    if isinstance(params, (list, tuple)):
+        return list(params)
+
+    return params
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).decode('latin-1')
+
+    return str(value)
+
+
+class WorkloadWriter(object):
+    """
+    Append query records to rotating gzip compressed JSON lines files from a background thread.
+
+    Recording only puts the record on a queue of at most `max_pending` records, records
+    are dropped when it is full. The background thread writes the pending records every
+    `flush_interval` seconds as one gzip member, and starts a new file once the current one
+    holds `max_file_size` uncompressed bytes. Only the newest `max_files` files of the
+    process are kept.
+    """
+
+    def __init__(self, directory, max_file_size=50 * 1024 * 1024, max_files=10, max_pending=10000,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.max_file_size = max_file_size
+        self.max_files = max_files
+        self.flush_interval = flush_interval
+        self.dropped_count = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._closed = False
+        self._file_index = 0
+        self._file_size = 0
+        self._paths = []
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            # First use, or first use after a fork; records queued by the parent belong to the parent.
+            self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._file_index = 0
+            self._file_size = 0
+            self._paths = []
+            self._thread = threading.Thread(target=self._run, name="query-debug-workload-writer")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while not self._closed:
+            time.sleep(self.flush_interval)
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write query workload to {}".format(self.directory))
+
+    @property
+    def path(self):
+        filename = "workload-{}-{}-{:04d}.jsonl.gz".format(socket.gethostname(), os.getpid(), self._file_index)
+
+        return os.path.join(self.directory, filename)
+
+    def record(self, query_record):
+        self._ensure_started()
+
+        try:
+            self._queue.put_nowait(query_record)
+        except queue.Full:
+            with self._lock:
+                self.dropped_count += 1
+
+    def flush(self):
+        """Write all queued records to the current file as a single gzip member."""
+        records = []
+
+        while True:
+            try:
+                records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        if not records:
+            return
+
+        data = "".join(json.dumps(record, default=_json_default, sort_keys=True) + "\n"
+                       for record in records).encode('utf-8')
+
+        with self._flush_lock:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+
+            if self._file_size and self._file_size + len(data) > self.max_file_size:
+                self._file_index += 1
+                self._file_size = 0
+
+            path = self.path
+
+            if path not in self._paths:
+                self._paths.append(path)
+
+            with gzip.open(path, 'ab') as workload_file:
+                workload_file.write(data)
+
+            self._file_size += len(data)
+
+            while len(self._paths) > self.max_files:
+                os.remove(self._paths.pop(0))
+
+    def close(self):
+        self._closed = True
+        self.flush()
+
+        if self.dropped_count:
+            logger.warning("Dropped {} workload records, the workload queue was full".format(self.dropped_count))
+
+
+class WorkloadRecorder(object):
+    """
+    Connection execute wrapper that sends every query to a `WorkloadWriter`.
+
+    Each record holds the fingerprint, SQL, params, database alias, start time, duration
+    and, unless `capture_call_sites=False`, the call site of the query.
+    """
+
+    def __init__(self, writer, capture_call_sites=True):
+        self.writer = writer
+        self.capture_call_sites = capture_call_sites
+
+    def __call__(self, execute, sql, params, many, context):
+        call_site = get_call_site() if self.capture_call_sites else None
+        start_time = time.time()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.time() - start_time
+            # Serialized by the writer thread
+            self.writer.record({
+                'fingerprint': fingerprint_sql(sql),
+                'sql': sql,
+                'params': _serialize_params(params, many),
+                'many': many,
+                'alias': context['connection'].alias,
+                'start': start_time,
+                'duration': duration,
+                'call_site': call_site,
+            })
+
+
+class capture_workload(object):
+    """
+    Record the queries of this thread to `directory` while open.
+    """
+
+    def __init__(self, directory, capture_call_sites=True, **writer_options):
+        self.writer = WorkloadWriter(directory, **writer_options)
+        self.recorder = WorkloadRecorder(self.writer, capture_call_sites=capture_call_sites)
+        self._wrapped_connections = []
+
+    def __enter__(self):
+        for alias in connections:
+            connection = connections[alias]
+            connection.execute_wrappers.append(self.recorder)
+            self._wrapped_connections.append(connection)
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for connection in self._wrapped_connections:
+            connection.execute_wrappers.remove(self.recorder)
+
+        self._wrapped_connections = []
+        self.writer.close()
+
+
+_recorder = None
+
+
+def _add_recorder(sender, connection, **kwargs):
+    if _recorder is not None and _recorder not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_recorder)
+
+
+def enable_workload_capture(directory, capture_call_sites=True, **writer_options):
+    """
+    Record the queries of every connection, in every thread, to `directory`.
+
+    Connections of other threads that are already open are not recorded until they reconnect.
+    """
+    global _recorder
+
+    disable_workload_capture()
+
+    _recorder = WorkloadRecorder(WorkloadWriter(directory, **writer_options),
+                                 capture_call_sites=capture_call_sites)
+    connection_created.connect(_add_recorder, dispatch_uid="query_debug_workload_capture")
+
+    for alias in connections:
+        _add_recorder(None, connections[alias])
+
+
+@atexit.register
+def disable_workload_capture():
+    global _recorder
+
+    if _recorder is None:
+        return
+
+    connection_created.disconnect(dispatch_uid="query_debug_workload_capture")
+
+    for alias in connections:
+        if _recorder in connections[alias].execute_wrappers:
+            connections[alias].execute_wrappers.remove(_recorder)
+
+    _recorder.writer.close()
+    _recorder = None
+
+
+def read_workload(paths):
+    """
+    Yield the query records of workload files, oldest file first.
+
+    Directories are expanded to the `.jsonl.gz` files they contain. Files truncated by a
+    killed process are read up to the last complete record.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            workload_paths = [os.path.join(path, filename) for filename in sorted(os.listdir(path))
+                              if filename.endswith(".jsonl.gz")]
+        else:
+            workload_paths = [path]
+
+        for workload_path in workload_paths:
+            for record in _read_workload_file(workload_path):
+                yield record
+
+
+def _read_workload_file(path):
+    with gzip.open(path, 'rb') as workload_file:
+        while True:
+            try:
+                line = workload_file.readline()
+            except (EOFError, IOError, zlib.error):
+                logger.warning("Skipping truncated end of {}".format(path))
+                return
+
+            if not line:
+                return
+
+            try:
+                yield json.loads(line.decode('utf-8'))
+            except ValueError:
+                logger.warning("Skipping malformed line in {}".format(path))
+
+
+class ReplayStats(object):
+    """
+    Latencies of the replayed queries of one fingerprint.
+    """
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.latencies = []
+        self.errors = 0
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    @property
+    def total_time(self):
+        return sum(self.latencies)
+
+    @property
+    def mean(self):
+        return self.total_time / self.count if self.count else 0.0
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0.0
+
+        latencies = sorted(self.latencies)
+
+        return latencies[min(int(len(latencies) * percent / 100.0), len(latencies) - 1)]
+
+
+class ReplayResult(object):
+    def __init__(self, stats, elapsed_time, threads):
+        self.stats = stats
+        self.elapsed_time = elapsed_time
+        self.threads = threads
+
+    @property
+    def query_count(self):
+        return sum(stats.count for stats in self.stats.values())
+
+    @property
+    def throughput(self):
+        """Queries per second over the whole replay."""
+        return self.query_count / self.elapsed_time if self.elapsed_time else 0.0
+
+
+def _replay(records, using, stats, lock, close_connection):
+    connection = connections[using]
+
+    try:
+        with connection.cursor() as cursor:
+            for record in records:
+                params = record['params']
+
+                if isinstance(params, list) and not record.get('many'):
+                    params = tuple(params)
+
+                start_time = time.time()
+                failed = False
+
+                try:
+                    if record.get('many'):
+                        cursor.executemany(record['sql'], params)
+                    else:
+                        cursor.execute(record['sql'], params)
+
+                        if cursor.description is not None:
+                            cursor.fetchall()
+                except Exception:
+                    failed = True
+
+                elapsed = time.time() - start_time
+
+                with lock:
+                    if record['fingerprint'] not in stats:
+                        stats[record['fingerprint']] = ReplayStats(record['fingerprint'])
+
+                    fingerprint_stats = stats[record['fingerprint']]
+
+                    if failed:
+                        fingerprint_stats.errors += 1
+                    else:
+                        fingerprint_stats.latencies.append(elapsed)
+    finally:
+        if close_connection:
+            connection.close()
+
+
+def replay_workload(records, using='default', threads=1, include_writes=False):
+    """
+    Run recorded queries against the `using` database and measure their latency per fingerprint.
+
+    Only SELECT statements are replayed unless `include_writes=True`. With more than one
+    thread, the records are dealt round-robin to `threads` threads with their own connections.
+    Failed queries are counted as errors and do not stop the replay.
+    """
+    records = [record for record in records
+               if record['params'] is not None or not record.get('many')]
+    records = [record for record in records
+               if include_writes or record['sql'].lstrip()[:6].upper() == "SELECT"]
+    stats = OrderedDict()
+    lock = threading.Lock()
+    start_time = time.time()
+
+    if threads <= 1:
+        _replay(records, using, stats, lock, close_connection=False)
+    else:
+        workers = [threading.Thread(target=_replay, args=(records[index::threads], using, stats, lock, True))
+                   for index in range(threads)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    return ReplayResult(stats, time.time() - start_time, threads)
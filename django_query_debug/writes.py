@@ -0,0 +1,124 @@
+from collections import OrderedDict
+import re
+
+from django_query_debug.utils import get_models_by_table
+
+
+_INSERT_RE = re.compile(r'^\s*INSERT\s+INTO\s+["`]?(\w+)["`]?\s*\(([^)]*)\)', re.IGNORECASE)
+_UPDATE_RE = re.compile(r'^\s*UPDATE\s+["`]?(\w+)["`]?\s+SET\s+(.*?)\s+WHERE\s', re.IGNORECASE | re.DOTALL)
+_DELETE_RE = re.compile(r'^\s*DELETE\s+FROM\s+["`]?(\w+)["`]?', re.IGNORECASE)
+_SET_COLUMN_RE = re.compile(r'["`]?(\w+)["`]?\s*=\s*%s')
+_COLUMN_NAME_RE = re.compile(r'["`]?(\w+)["`]?')
+
+
+class WriteRun(object):
+    """
+    Repeated single-row writes with the same fingerprint from the same call site.
+    """
+
+    def __init__(self, fingerprint, call_site, statement_type):
+        self.fingerprint = fingerprint
+        self.call_site = call_site
+        self.statement_type = statement_type
+        self.count = 0
+        self.total_time = 0.0
+        self.model = None
+        self.fields = []
+        self.queries = []
+
+    @property
+    def suggestion(self):
+        model_name = self.model.__name__ if self.model is not None else "Model"
+        fields = ", ".join("'{}'".format(field) for field in self.fields)
+
+        if self.statement_type == "INSERT":
+            return "Use {}.objects.bulk_create(objs) instead of saving each object".format(model_name)
+        if self.statement_type == "UPDATE":
+            if self._same_values():
+                return "Use {}.objects.filter(...).update(...) to set [{}] in one query".format(model_name, fields)
+
+            return "Use {}.objects.bulk_update(objs, [{}])".format(model_name, fields)
+
+        return "Use {}.objects.filter(pk__in=...).delete() to delete in one query".format(model_name)
+
+    def _same_values(self):
+        """True if every UPDATE sets the same values, only the WHERE params differ."""
+        set_count = len(self.fields)
+        values = set()
+
+        for query in self.queries:
+            try:
+                values.add(tuple(query.params[:set_count]))
+            except TypeError:
+                return False
+
+        return len(values) == 1
+
+    def describe(self):
+        filename, lineno, function = self.call_site or ("<unknown>", 0, "<unknown>")
+        model_label = self.model._meta.label if self.model is not None else "unknown model"
+
+        return "{} single-row {} statements on {} ({}s) from {}:{} in {}".format(
+            self.count, self.statement_type, model_label, round(self.total_time, 6), filename, lineno, function
+        )
+
+
+def _model_and_fields(query, models_by_table):
+    sql = query.sql
+
+    for pattern in (_INSERT_RE, _UPDATE_RE, _DELETE_RE):
+        match = pattern.match(sql)
+
+        if match:
+            break
+    else:
+        return None, []
+
+    model = models_by_table.get(match.group(1))
+
+    if pattern is _INSERT_RE:
+        columns = _COLUMN_NAME_RE.findall(match.group(2))
+    elif pattern is _UPDATE_RE:
+        columns = _SET_COLUMN_RE.findall(match.group(2))
+    else:
+        columns = []
+
+    if model is None:
+        return None, columns
+
+    fields_by_column = {field.column: field.name for field in model._meta.concrete_fields}
+
+    return model, [fields_by_column.get(column, column) for column in columns]
+
+
+def detect_row_by_row_writes(queries, min_count=5):
+    """
+    Return `WriteRun`s for writes repeated at least `min_count` times from one call site,
+    most expensive first.
+
+    `queries` are `CapturedQuery` objects. Multi-row statements such as bulk inserts
+    or `executemany` calls are not counted.
+    """
+    models_by_table = get_models_by_table()
+    runs = OrderedDict()
+
+    for query in queries:
+        if not query.is_write or query.many:
+            continue
+
+        key = (query.fingerprint, query.call_site)
+
+        if key not in runs:
+            runs[key] = WriteRun(query.fingerprint, query.call_site, query.statement_type)
+
+        run = runs[key]
+        run.count += 1
+        run.total_time += query.duration
+        run.queries.append(query)
+
+    detected = [run for run in runs.values() if run.count >= min_count]
+
+    for run in detected:
+        run.model, run.fields = _model_and_fields(run.queries[0], models_by_table)
+
+    return sorted(detected, key=lambda run: run.total_time, reverse=True)
@@ -23,13 +23,13 @@ DESCRIPTION = 'Helper methods and mixins for debugging query issues.'
 URL = 'https://github.com/RouganStriker/django-query-debug'
 EMAIL = 'kelvinc.25@gmail.com'
 AUTHOR = 'Kelvin Chan'
-REQUIRES_PYTHON = '>=2.7.0'
+REQUIRES_PYTHON = '>=3.5.0'
 VERSION = None
 
 # What packages are required for this module to be executed?
 REQUIRED = [
     'depocs',
-    'django >= 1.11.0',
+    'django >= 2.0',
     'sqlparse',
     'six == 1.12.0',
 ]
@@ -111,7 +111,9 @@ setup(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=['django_query_debug'],
+    packages=['django_query_debug',
+              'django_query_debug.management',
+              'django_query_debug.management.commands'],
     install_requires=REQUIRED,
     extras_require=EXTRAS,
     setup_requires=["pytest-runner"],
@@ -132,10 +134,9 @@ setup(
         # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
         'License :: OSI Approved :: MIT License',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: Implementation :: CPython',
         'Programming Language :: Python :: Implementation :: PyPy'
     ],
@@ -1,3 +1,5 @@
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
 from django_query_debug.mixins import FieldUsageMixin
@@ -85,3 +87,15 @@ class InheritedChildModel(BaseModelWithMixin):
                                       on_delete=models.CASCADE,
                                       related_name="reverse_inherited_related_model",
                                       null=True)
+
+
+class GenericTaggedModel(models.Model):
+    name = models.CharField(max_length=255)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey()
+
+
+class GenericTargetModel(models.Model):
+    name = models.CharField(max_length=255)
+    tags = GenericRelation(GenericTaggedModel)
@@ -0,0 +1,62 @@
+from django.db import connection
+from django.db.models import Index
+from django.test import override_settings, TestCase
+
+from django_query_debug.advisor import advise_indexes, extract_column_usage, get_existing_indexes, IndexSuggestion
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+@override_settings(DEBUG=True)
+class TestIndexAdvisor(TestCase):
+    def test_extract_column_usage(self):
+        sql = str(SimpleRelatedModel.objects.filter(name="a", related_model__name__gt="b")
+                                            .order_by("-id").query)
+        usage = extract_column_usage(sql)
+
+        self.assertEqual(usage["mock_models_simplerelatedmodel"], {
+            'equality': ['name'],
+            'range': [],
+            'join': ['related_model_id'],
+            'order_by': ['id'],
+        })
+        self.assertEqual(usage["mock_models_simplemodel"]['range'], ['name'])
+        self.assertEqual(usage["mock_models_simplemodel"]['join'], ['id'])
+
+    def test_existing_indexes(self):
+        indexes, unique_indexes = get_existing_indexes(SimpleRelatedModel)
+
+        self.assertIn(("related_model_id",), indexes)
+        self.assertIn(("id",), unique_indexes)
+        self.assertIn(("one_to_one_model_id",), unique_indexes)
+
+    def test_advise_indexes(self):
+        SimpleModel.objects.create(name="Simple")
+
+        with analyze_block(count_results=False) as report:
+            for name in ("A", "B", "C"):
+                list(SimpleRelatedModel.objects.filter(name=name).order_by("related_model"))
+            list(SimpleModel.objects.filter(pk=1))
+            list(SimpleModel.objects.filter(name="Simple"))
+
+        suggestions = advise_indexes(report, verify=True)
+        suggestions_by_model = {suggestion.model: suggestion for suggestion in suggestions}
+
+        self.assertEqual(len(suggestions), 2)
+        self.assertEqual(suggestions_by_model[SimpleRelatedModel].fields, ["name", "related_model"])
+        self.assertEqual(suggestions_by_model[SimpleRelatedModel].query_count, 3)
+        self.assertEqual(suggestions_by_model[SimpleModel].fields, ["name"])
+        self.assertTrue(suggestions_by_model[SimpleModel].verified)
+        self.assertRegex(suggestions_by_model[SimpleModel].snippet(),
+                         r"^models.Index\(fields=\['name'\], name='simplemode_name_\w{5}_idx'\)$")
+        # The verification index was rolled back
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = %s",
+                           [suggestions_by_model[SimpleModel].name])
+            self.assertEqual(cursor.fetchall(), [])
+
+    def test_index_name_length(self):
+        suggestion = IndexSuggestion(SimpleRelatedModel, ["name", "related_model"])
+
+        self.assertLessEqual(len(suggestion.name), Index.max_name_length)
+        self.assertRegex(suggestion.name, r"^simplerela_name_rela_\w{5}_idx$")
@@ -0,0 +1,44 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SETUP_SCRIPT = """
+import json
+import sys
+
+import django
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=["django_query_debug"],
+                   DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+                   ENABLE_QUERY_WARNINGS=sys.argv[1] == "enabled")
+django.setup()
+
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+class TestAppStartup(SimpleTestCase):
+    def get_modules_after_setup(self, warnings):
+        output = subprocess.check_output([sys.executable, "-c", SETUP_SCRIPT, warnings], cwd=ROOT)
+
+        return set(json.loads(output.decode("utf-8")))
+
+    def test_disabled_app_imports_nothing(self):
+        modules = self.get_modules_after_setup("disabled")
+
+        self.assertEqual(sorted(module for module in modules if module.startswith("django_query_debug")),
+                         ["django_query_debug", "django_query_debug.apps"])
+        self.assertNotIn("depocs", modules)
+
+    def test_enabled_warnings_apply_patch(self):
+        modules = self.get_modules_after_setup("enabled")
+
+        self.assertIn("django_query_debug.patch", modules)
+        self.assertNotIn("depocs", modules)
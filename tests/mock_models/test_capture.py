@@ -0,0 +1,118 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+from unittest import skipIf
+
+from django.db import connection
+from django.db.backends.utils import CursorWrapper
+from django.test import TransactionTestCase
+
+from django_query_debug.capture import ContextQueryCapture, QueryCapture
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:
+    # Django < 3.0
+    sync_to_async = None
+
+
+def count_models():
+    try:
+        return SimpleModel.objects.count()
+    finally:
+        connection.close()
+
+
+@skipIf(sys.version_info < (3, 7), "ContextQueryCapture requires contextvars, available from Python 3.7")
+class TestContextQueryCapture(TransactionTestCase):
+    def setUp(self):
+        SimpleModel.objects.create(name="Simple")
+
+    def test_follows_threads(self):
+        with ContextQueryCapture() as capture:
+            SimpleModel.objects.count()
+            thread = threading.Thread(target=count_models, name="worker")
+            thread.start()
+            thread.join()
+
+        origins = capture.queries_by_origin()
+
+        self.assertEqual(list(origins), ["thread:{}".format(threading.current_thread().name), "thread:worker"])
+        self.assertEqual(len(origins["thread:worker"]), 1)
+        self.assertEqual(origins["thread:worker"][0].call_site[2], "count_models")
+
+    def test_follows_executor_jobs(self):
+        executor = ThreadPoolExecutor(max_workers=2)
+
+        try:
+            # Workers started before the capture are followed too
+            executor.submit(count_models).result()
+
+            with ContextQueryCapture() as capture:
+                for future in [executor.submit(count_models) for _ in range(4)]:
+                    future.result()
+
+            # Workers do not keep the capture after it closed
+            executor.submit(count_models).result()
+        finally:
+            executor.shutdown()
+
+        self.assertEqual(len(capture.queries), 4)
+        self.assertTrue(all(query.extra['origin'].startswith("thread:ThreadPoolExecutor")
+                            for query in capture.queries))
+
+    @skipIf(sys.version_info < (3, 8) or sync_to_async is None, "Task names need Python 3.8 and asgiref")
+    def test_follows_asyncio_tasks(self):
+        async def view(name):
+            return await sync_to_async(count_models, thread_sensitive=False)()
+
+        async def main():
+            await asyncio.gather(asyncio.create_task(view("a"), name="a"),
+                                 asyncio.create_task(view("b"), name="b"))
+
+        with ContextQueryCapture() as capture:
+            asyncio.run(main())
+
+        self.assertEqual(sorted(capture.queries_by_origin()), ["task:a", "task:b"])
+
+    def test_threads_started_outside(self):
+        thread = threading.Thread(target=count_models)
+
+        with ContextQueryCapture() as capture:
+            with QueryCapture() as thread_capture:
+                SimpleModel.objects.count()
+
+        thread.start()
+        thread.join()
+
+        self.assertEqual(len(capture.queries), 1)
+        self.assertEqual(len(thread_capture.queries), 1)
+
+    def test_analyze_block(self):
+        with analyze_block(follow_threads=True, count_results=False) as report:
+            SimpleModel.objects.count()
+            thread = threading.Thread(target=count_models, name="worker")
+            thread.start()
+            thread.join()
+
+        self.assertEqual(report.query_count, 2)
+        self.assertEqual(report.origins["thread:worker"]['count'], 1)
+
+    def test_patches_restored(self):
+        original_start = threading.Thread.start
+        original_submit = ThreadPoolExecutor.submit
+        original_execute = CursorWrapper._execute_with_wrappers
+
+        with ContextQueryCapture():
+            with ContextQueryCapture():
+                self.assertIsNot(threading.Thread.start, original_start)
+
+            # Still patched while the outer capture is open
+            self.assertIsNot(threading.Thread.start, original_start)
+
+        self.assertIs(threading.Thread.start, original_start)
+        self.assertIs(ThreadPoolExecutor.submit, original_submit)
+        self.assertIs(CursorWrapper._execute_with_wrappers, original_execute)
@@ -0,0 +1,83 @@
+from django.test import override_settings, TestCase
+
+from django_query_debug.jobs import OTHER, profile_job
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+@override_settings(ENABLE_QUERY_WARNINGS=False)
+class TestProfileJob(TestCase):
+    def setUp(self):
+        super(TestProfileJob, self).setUp()
+
+        self.related_ids = [
+            SimpleRelatedModel.objects.create(name="Related {}".format(index),
+                                              related_model=SimpleModel.objects.create(name="Simple")).pk
+            for index in range(5)
+        ]
+
+    def test_aggregates_invocations(self):
+        @profile_job(name="rename", flush_interval=3600)
+        def rename(pk):
+            related = SimpleRelatedModel.objects.get(pk=pk)
+            return related.related_model.name
+
+        for pk in self.related_ids:
+            rename(pk)
+
+        summary = rename.query_stats.summary()
+
+        self.assertEqual(summary['name'], "rename")
+        self.assertEqual((summary['invocations'], summary['errors']), (5, 0))
+        self.assertEqual((summary['query_count'], summary['max_query_count']), (10, 2))
+        self.assertEqual(sorted(summary['db_time_percentiles']), [50, 90, 99])
+        self.assertLessEqual(summary['db_time_percentiles'][50], summary['max_db_time'])
+        self.assertEqual(len(summary['fingerprints']), 2)
+        self.assertEqual([count for fingerprint, count, fingerprint_time in summary['fingerprints']], [5, 5])
+        self.assertEqual(summary['lazy_loads'], [("Accessing uncached ManyToOne field SimpleRelatedModel.related_model",
+                                                  5)])
+
+    def test_nested_calls_and_errors(self):
+        @profile_job(flush_interval=3600)
+        def count(depth):
+            SimpleModel.objects.count()
+
+            if depth:
+                count(depth - 1)
+            else:
+                raise ValueError("Done")
+
+        with self.assertRaises(ValueError):
+            count(2)
+
+        summary = count.query_stats.summary()
+
+        self.assertTrue(summary['name'].endswith(".count"))
+        self.assertEqual((summary['invocations'], summary['errors'], summary['query_count']), (1, 1, 3))
+
+    def test_periodic_flush(self):
+        @profile_job(flush_interval=0)
+        def count():
+            return SimpleModel.objects.count()
+
+        with self.assertLogs('query_debug', level='INFO') as logs:
+            count()
+
+        self.assertIn("1 invocations (0 failed)", logs.output[1])
+        self.assertEqual(count.query_stats.invocations, 0)
+
+    def test_constant_memory(self):
+        orderings = ("id", "-id", "name", "-name", "related_model_id")
+
+        @profile_job(flush_interval=3600, reservoir_size=10, max_fingerprints=3)
+        def job(index):
+            return list(SimpleRelatedModel.objects.order_by(orderings[index % len(orderings)])[:1])
+
+        for index in range(50):
+            job(index)
+
+        stats = job.query_stats
+        self.assertEqual(stats.invocations, 50)
+        self.assertEqual(len(stats.db_time_sample), 10)
+        self.assertEqual(len(stats.fingerprint_counts), 4)
+        self.assertEqual(stats.fingerprint_counts[OTHER], 20)
+        self.assertEqual(sum(stats.fingerprint_counts.values()), 50)
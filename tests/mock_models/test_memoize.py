@@ -0,0 +1,104 @@
+from django.db import transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase
+
+from django_query_debug.memoize import memoize_queries
+from django_query_debug.middleware import QueryMemoizationMiddleware
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestQueryMemoization(TestCase):
+    def setUp(self):
+        self.simple_model = SimpleModel.objects.create(name="Config")
+
+    def test_duplicate_reads_are_cached(self):
+        with self.assertNumQueries(3), memoize_queries() as memoizer:
+            for _ in range(3):
+                self.assertEqual(SimpleModel.objects.get(name="Config"), self.simple_model)
+                self.assertEqual(SimpleModel.objects.filter(name="Config").count(), 1)
+                self.assertTrue(SimpleModel.objects.filter(name="Config").exists())
+
+        self.assertEqual(memoizer.hits, 6)
+        self.assertEqual(memoizer.misses, 3)
+        self.assertGreaterEqual(memoizer.time_saved, 0)
+
+    def test_different_params_are_not_shared(self):
+        SimpleModel.objects.create(name="Other")
+
+        with self.assertNumQueries(2), memoize_queries() as memoizer:
+            self.assertEqual(SimpleModel.objects.get(name="Config").name, "Config")
+            self.assertEqual(SimpleModel.objects.get(name="Other").name, "Other")
+
+        self.assertEqual(memoizer.hits, 0)
+
+    def test_writes_invalidate_cache(self):
+        with memoize_queries() as memoizer:
+            self.assertEqual(SimpleModel.objects.count(), 1)
+            SimpleModel.objects.create(name="New")
+            self.assertEqual(SimpleModel.objects.count(), 2)
+            SimpleModel.objects.filter(name="New").update(name="Renamed")
+            self.assertTrue(SimpleModel.objects.filter(name="Renamed").exists())
+            SimpleModel.objects.filter(name="Renamed").delete()
+            self.assertEqual(SimpleModel.objects.count(), 1)
+
+        self.assertEqual(memoizer.hits, 0)
+        self.assertEqual(memoizer.invalidations, 3)
+
+    def test_rollback_invalidates_cache(self):
+        with memoize_queries():
+            try:
+                with transaction.atomic():
+                    SimpleModel.objects.create(name="Rolled back")
+                    self.assertEqual(SimpleModel.objects.count(), 2)
+                    raise ValueError()
+            except ValueError:
+                pass
+
+            self.assertEqual(SimpleModel.objects.count(), 1)
+
+    def test_uncacheable_queries(self):
+        # Each atomic block adds a savepoint and a release
+        with self.assertNumQueries(8), memoize_queries() as memoizer:
+            for _ in range(2):
+                list(SimpleModel.objects.all().iterator())
+                with transaction.atomic():
+                    list(SimpleModel.objects.select_for_update())
+
+        self.assertEqual(memoizer.hits, 0)
+
+    def test_scope_ends(self):
+        with memoize_queries():
+            list(SimpleRelatedModel.objects.all())
+
+        with self.assertNumQueries(1):
+            list(SimpleRelatedModel.objects.all())
+
+    def test_middleware(self):
+        def view(request):
+            return [SimpleModel.objects.get(name="Config") for _ in range(5)]
+
+        middleware = QueryMemoizationMiddleware(view)
+
+        with self.assertNumQueries(1):
+            response = middleware(RequestFactory().get("/"))
+
+        self.assertEqual(response, [self.simple_model] * 5)
+
+
+class TestQueryMemoizationRollback(TransactionTestCase):
+    def test_rollback_invalidates_outer_scopes(self):
+        SimpleModel.objects.create(name="Config")
+        transaction.set_autocommit(False)
+
+        try:
+            with memoize_queries() as outer:
+                SimpleModel.objects.create(name="Rolled back")
+                self.assertEqual(SimpleModel.objects.count(), 2)
+
+                with memoize_queries():
+                    transaction.rollback()
+
+                self.assertEqual(SimpleModel.objects.count(), 1)
+        finally:
+            transaction.set_autocommit(True)
+
+        self.assertEqual(outer.hits, 0)
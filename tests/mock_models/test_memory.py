@@ -0,0 +1,43 @@
+import tracemalloc
+
+from django.test import TestCase
+
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel
+
+
+class TestMemoryProfiling(TestCase):
+    def setUp(self):
+        super(TestMemoryProfiling, self).setUp()
+
+        SimpleModel.objects.bulk_create([SimpleModel(name="x" * 100) for index in range(500)])
+
+    def test_profile_memory(self):
+        with analyze_block(profile_memory=True, memory_threshold=1024) as report:
+            objs = list(SimpleModel.objects.all())
+            names = list(SimpleModel.objects.values_list("name", flat=True))
+            list(SimpleModel.objects.all())
+
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertEqual((len(objs), len(names)), (500, 500))
+        self.assertEqual(len(report.memory), 3)
+
+        stats_by_line = {stats.call_site[1]: stats for stats in report.memory}
+        instance_stats = min(stats_by_line.items())[1]
+        values_stats = sorted(stats_by_line.items())[1][1]
+
+        self.assertEqual(instance_stats.call_site[0], __file__)
+        self.assertEqual((instance_stats.evaluations, instance_stats.rows), (1, 500))
+        self.assertIs(instance_stats.model, SimpleModel)
+        self.assertGreater(instance_stats.peak, 500 * 100)
+        self.assertGreater(instance_stats.bytes_per_instance, values_stats.bytes_per_row)
+        self.assertIsNone(values_stats.bytes_per_instance)
+        self.assertIn(".values()", instance_stats.suggestion(1024))
+        self.assertNotIn(".values()", values_stats.suggestion(1024))
+        self.assertIsNone(instance_stats.suggestion(instance_stats.peak + 1))
+
+    def test_memory_not_profiled_by_default(self):
+        with analyze_block() as report:
+            list(SimpleModel.objects.all())
+
+        self.assertEqual(report.memory, [])
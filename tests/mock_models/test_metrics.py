@@ -0,0 +1,148 @@
+import threading
+
+from django.test import Client, override_settings, RequestFactory, TestCase
+
+from django_query_debug.metrics import (disable_query_metrics,
+                                        enable_query_metrics,
+                                        metrics_view,
+                                        OPENMETRICS_CONTENT_TYPE,
+                                        QueryMetrics)
+from mock_models.models import FieldTrackedSimpleModel, SimpleModel, SimpleRelatedModel
+
+
+class TestQueryMetrics(TestCase):
+    def test_counters_and_histograms(self):
+        metrics = QueryMetrics(buckets=(0.1, 1.0), count_buckets=(1, 5))
+        metrics.begin_request("books")
+        metrics.record_query("SELECT * FROM book WHERE id = %s", (1,), 0.05)
+        metrics.record_query("SELECT * FROM book WHERE id = %s", (1,), 0.05)
+        metrics.record_query("SELECT * FROM book WHERE id = %s", (2,), 0.05)
+        metrics.end_request()
+        metrics.record_query("SELECT 1", None, 0.5)
+        metrics.record_lazy_load("Accessing uncached ManyToOne field Book.author")
+
+        lines = metrics.render().splitlines()
+
+        self.assertIn('query_debug_queries_total{view="books"} 3', lines)
+        self.assertIn('query_debug_queries_total{view="none"} 1', lines)
+        self.assertIn('query_debug_duplicate_queries_total{view="books"} 1', lines)
+        self.assertIn('query_debug_fingerprint_queries_total{fingerprint="SELECT * FROM book WHERE id = ?"} 3', lines)
+        self.assertIn('query_debug_lazy_loads_total{lazy_load="Accessing uncached ManyToOne field Book.author"} 1',
+                      lines)
+        self.assertIn('query_debug_request_db_seconds_bucket{view="books",le="0.1"} 0', lines)
+        self.assertIn('query_debug_request_db_seconds_bucket{view="books",le="1.0"} 1', lines)
+        self.assertIn('query_debug_request_queries_bucket{view="books",le="+Inf"} 1', lines)
+        self.assertIn('query_debug_request_queries_count{view="books"} 1', lines)
+        self.assertIn("# TYPE query_debug_request_queries histogram", lines)
+        self.assertEqual(lines[-1], "# EOF")
+
+    def test_bounded_fingerprints(self):
+        metrics = QueryMetrics(max_fingerprints=2, max_tracked_fingerprints=3)
+
+        for index in range(5):
+            for _ in range(index + 1):
+                metrics.record_query("SELECT * FROM table_{}".format(index), None, 0.01)
+
+        fingerprint_lines = [line for line in metrics.render().splitlines()
+                             if line.startswith("query_debug_fingerprint_queries_total")]
+
+        # The last two fingerprints were not tracked and went to other directly
+        self.assertEqual(fingerprint_lines, [
+            'query_debug_fingerprint_queries_total{fingerprint="SELECT * FROM table_1"} 2',
+            'query_debug_fingerprint_queries_total{fingerprint="SELECT * FROM table_2"} 3',
+            'query_debug_fingerprint_queries_total{fingerprint="other"} 10',
+        ])
+
+    def test_threads_are_merged(self):
+        metrics = QueryMetrics()
+
+        def run():
+            for _ in range(100):
+                metrics.record_query("SELECT 1", None, 0.001)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn('query_debug_queries_total{view="none"} 400', metrics.render().splitlines())
+
+    def test_ended_threads_are_retired(self):
+        metrics = QueryMetrics(max_tracked_fingerprints=2)
+
+        def run(index):
+            metrics.record_query("SELECT {} FROM book_{}".format(index, index), None, 0.001)
+            metrics.record_lazy_load("Accessing uncached ManyToOne field Book.author")
+            metrics.begin_request("books")
+            metrics.end_request()
+
+        for index in range(5):
+            thread = threading.Thread(target=run, args=(index,))
+            thread.start()
+            thread.join()
+
+        lines = metrics.render().splitlines()
+
+        self.assertEqual(metrics._shards, [])
+        self.assertIn('query_debug_queries_total{view="none"} 5', lines)
+        self.assertIn('query_debug_fingerprint_queries_total{fingerprint="other"} 3', lines)
+        self.assertIn('query_debug_lazy_loads_total{lazy_load="Accessing uncached ManyToOne field Book.author"} 5',
+                      lines)
+        self.assertIn('query_debug_request_queries_count{view="books"} 5', lines)
+
+    def test_label_escaping(self):
+        metrics = QueryMetrics()
+        metrics.record_lazy_load('Accessing "quoted"\\field\n')
+
+        self.assertIn('query_debug_lazy_loads_total{lazy_load="Accessing \\"quoted\\"\\\\field\\n"} 1',
+                      metrics.render().splitlines())
+
+    def test_field_usage_ratio(self):
+        FieldTrackedSimpleModel.objects.create(name="Simple")
+        FieldTrackedSimpleModel.objects.get().name
+        # Usage is counted on the model class
+        field_usage = FieldTrackedSimpleModel._field_usage
+        expected_ratio = sum(1 for count in field_usage.values() if count) / float(len(field_usage))
+
+        self.assertGreater(expected_ratio, 0.0)
+        self.assertIn('query_debug_field_usage_ratio{{model="mock_models.FieldTrackedSimpleModel"}} {}'.format(
+            repr(round(expected_ratio, 9))
+        ), QueryMetrics().render().splitlines())
+
+
+@override_settings(MIDDLEWARE=["django_query_debug.metrics.QueryMetricsMiddleware"])
+class TestQueryMetricsMiddleware(TestCase):
+    def setUp(self):
+        self.metrics = enable_query_metrics()
+
+    def tearDown(self):
+        disable_query_metrics()
+
+    def test_requests_labeled_by_view(self):
+        for index in range(2):
+            SimpleRelatedModel.objects.create(name="Related", related_model=SimpleModel.objects.create(name="Simple"))
+
+        Client().get("/related/")
+        lines = self.metrics.render().splitlines()
+
+        self.assertIn('query_debug_queries_total{view="related-names"} 3', lines)
+        self.assertIn('query_debug_request_queries_count{view="related-names"} 1', lines)
+        self.assertIn('query_debug_request_queries_bucket{view="related-names",le="2.0"} 0', lines)
+        self.assertIn('query_debug_request_queries_bucket{view="related-names",le="5.0"} 1', lines)
+        self.assertIn('query_debug_lazy_loads_total{lazy_load="Accessing uncached ManyToOne field '
+                      'SimpleRelatedModel.related_model"} 2', lines)
+
+    def test_metrics_view(self):
+        SimpleModel.objects.count()
+        response = metrics_view(RequestFactory().get("/metrics"))
+
+        self.assertEqual(response['Content-Type'], OPENMETRICS_CONTENT_TYPE)
+        self.assertIn(b"query_debug_queries_total", response.content)
+
+    def test_disabled(self):
+        disable_query_metrics()
+        response = metrics_view(RequestFactory().get("/metrics"))
+
+        self.assertEqual(response.content, b"# EOF\n")
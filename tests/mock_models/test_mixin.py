@@ -63,6 +63,16 @@ class TestFieldUsageTracker(TestCase):
         self.assertEqual(test_related_model, test_model.reverse_one_to_one_model)
         self.assertIn(test_related_model, test_model.reverse_many_models.all())
 
+    def test_proxied_field_values_per_instance(self):
+        """
+        Test that field values are not shared between instances.
+        """
+        first_model = FieldTrackedSimpleModel(name="First")
+        second_model = FieldTrackedSimpleModel(name="Second")
+
+        self.assertEqual(first_model.name, "First")
+        self.assertEqual(second_model.name, "Second")
+
     def test_proxied_field_values_modification(self):
         """
         Test that the fields can still be modified.
@@ -0,0 +1,127 @@
+from django.test import override_settings, TestCase
+
+from django_query_debug.capture import QueryCapture
+from django_query_debug.overfetch import InstanceUsageTracker
+from django_query_debug.utils import analyze_block
+from mock_models.models import FieldTrackedRelatedModel, FieldTrackedSimpleModel, SimpleModel
+
+
+@override_settings(ENABLE_QUERY_WARNINGS=False)
+class TestOverFetching(TestCase):
+    def setUp(self):
+        super(TestOverFetching, self).setUp()
+
+        FieldTrackedSimpleModel.objects.bulk_create([
+            FieldTrackedSimpleModel(name="Simple model {}".format(index)) for index in range(100)
+        ])
+
+    def test_instances_not_used(self):
+        with analyze_block(track_instances=True) as report:
+            self.assertTrue(list(FieldTrackedSimpleModel.objects.all()))
+
+        self.assertEqual(len(report.over_fetching), 1)
+        finding = report.over_fetching[0]
+        self.assertIs(finding.model, FieldTrackedSimpleModel)
+        self.assertEqual((finding.rows, finding.instances, finding.used_instances), (100, 100, 0))
+        self.assertEqual(finding.wasted_bytes, finding.total_bytes)
+        self.assertIn("use .exists() or .count()", finding.suggestion)
+
+    def test_few_instances_used(self):
+        with analyze_block(track_instances=True) as report:
+            names = [obj.name for index, obj in enumerate(FieldTrackedSimpleModel.objects.all()) if index < 3]
+
+        self.assertEqual(len(names), 3)
+        self.assertEqual(report.over_fetching[0].used_instances, 3)
+        self.assertEqual(report.over_fetching[0].fields_read, ["name"])
+        self.assertIn("Only 3 of 100 FieldTrackedSimpleModel instances were used", report.over_fetching[0].suggestion)
+
+    def test_few_fields_used(self):
+        related = FieldTrackedSimpleModel.objects.first()
+        FieldTrackedRelatedModel.objects.bulk_create([
+            FieldTrackedRelatedModel(name="Related {}".format(index), related_model=related) for index in range(100)
+        ])
+
+        with analyze_block(track_instances=True) as report:
+            names = [obj.name for obj in FieldTrackedRelatedModel.objects.all()]
+            list(FieldTrackedSimpleModel.objects.all())
+
+        self.assertEqual(len(names), 100)
+        # Sorted by wasted bytes, the unused instances first
+        self.assertEqual([finding.model for finding in report.over_fetching],
+                         [FieldTrackedSimpleModel, FieldTrackedRelatedModel])
+        self.assertLess(report.over_fetching[1].wasted_bytes, report.over_fetching[0].wasted_bytes)
+        self.assertEqual(report.over_fetching[1].fields_read, ["name"])
+        self.assertIn("use .values_list() or .only()", report.over_fetching[1].suggestion)
+
+    def test_used_instances_and_untracked_models(self):
+        SimpleModel.objects.create(name="Untracked")
+
+        with analyze_block(track_instances=True) as report:
+            names = [obj.name for obj in FieldTrackedSimpleModel.objects.all()]
+            list(SimpleModel.objects.all())
+
+        self.assertEqual(len(names), 100)
+        self.assertEqual(report.over_fetching, [])
+
+    def test_attributed_to_the_iterated_query(self):
+        related = FieldTrackedSimpleModel.objects.first()
+        FieldTrackedRelatedModel.objects.bulk_create([
+            FieldTrackedRelatedModel(name="Related {}".format(index), related_model=related) for index in range(5)
+        ])
+
+        with QueryCapture() as capture, InstanceUsageTracker(capture) as tracker:
+            # The many to many table name starts with the iterated table name
+            for obj in FieldTrackedRelatedModel.objects.iterator(chunk_size=2):
+                list(obj.many_models.all())
+
+            raw_names = [obj.name for obj in FieldTrackedSimpleModel.objects.raw(
+                "SELECT * FROM mock_models_fieldtrackedsimplemodel LIMIT 3"
+            )]
+
+        fetches = {fetch.model: fetch for fetch in tracker.fetches.values()}
+        self.assertEqual(len(raw_names), 3)
+        self.assertEqual(fetches[FieldTrackedRelatedModel].instance_count, 5)
+        self.assertIs(fetches[FieldTrackedRelatedModel].query, capture.queries[0])
+        self.assertEqual(fetches[FieldTrackedSimpleModel].instance_count, 3)
+        self.assertIs(fetches[FieldTrackedSimpleModel].query, capture.queries[-1])
+
+
+@override_settings(ENABLE_QUERY_WARNINGS=False)
+class TestWastedJoins(TestCase):
+    def setUp(self):
+        super(TestWastedJoins, self).setUp()
+
+        for index in range(10):
+            FieldTrackedRelatedModel.objects.create(
+                name="Related {}".format(index),
+                related_model=FieldTrackedSimpleModel.objects.create(name="Simple {}".format(index)),
+                one_to_one_model=FieldTrackedSimpleModel.objects.create(name="One to one {}".format(index)),
+            )
+
+    def test_unused_join(self):
+        queryset = FieldTrackedRelatedModel.objects.select_related('related_model', 'one_to_one_model')
+
+        with analyze_block(track_instances=True) as report:
+            names = [obj.related_model.name for obj in queryset]
+
+        self.assertEqual(len(names), 10)
+        self.assertEqual(len(report.wasted_joins), 1)
+        finding = report.wasted_joins[0]
+        self.assertEqual(finding.path, "one_to_one_model")
+        self.assertIs(finding.model, FieldTrackedSimpleModel)
+        self.assertEqual((finding.instances, finding.used_instances), (10, 0))
+        self.assertGreater(finding.column_share, 0)
+        self.assertLess(finding.column_share, 1)
+        self.assertGreaterEqual(finding.populate_time, 0)
+        self.assertIn("Remove 'one_to_one_model' from select_related()", finding.suggestion)
+        # Joined instances are reported as joins, not as over-fetching of the query
+        self.assertNotIn(FieldTrackedSimpleModel, [finding.model for finding in report.over_fetching])
+
+    def test_used_joins(self):
+        queryset = FieldTrackedRelatedModel.objects.select_related('related_model', 'one_to_one_model')
+
+        with analyze_block(track_instances=True) as report:
+            names = [(obj.related_model.name, obj.one_to_one_model.name) for obj in queryset]
+
+        self.assertEqual(len(names), 10)
+        self.assertEqual(report.wasted_joins, [])
@@ -1,10 +1,20 @@
 from contextlib import contextmanager
+import logging
+import os
+import threading
 
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Prefetch
 from django.test import override_settings, TestCase
 from testfixtures import LogCapture
 
-from mock_models.models import ChildSimpleModel, SimpleModel, SimpleRelatedModel
+from django_query_debug.patch import add_lazy_load_listener, remove_lazy_load_listener
+
+from mock_models.models import (ChildSimpleModel,
+                                GenericTaggedModel,
+                                GenericTargetModel,
+                                SimpleModel,
+                                SimpleRelatedModel)
 
 
 @override_settings(DEBUG=True, ENABLE_QUERY_WARNINGS=True)
@@ -226,3 +236,101 @@ class TestPatchedDescriptors(TestCase):
         with self.assertNumQueriesAndLogs(1, expected_logs):
             models = list(test_model_with_custom_prefetch.reverse_many_models.all())
             self.assertEqual(models, [self.simple_related_model])
+
+    def test_generic_foreign_key_access_without_prefetch(self):
+        target = GenericTargetModel.objects.create(name="Target")
+        GenericTaggedModel.objects.create(name="Tag", content_object=target)
+        ContentType.objects.get_for_model(GenericTargetModel)
+        tag = GenericTaggedModel.objects.get(name="Tag")
+        expected_logs = ["Accessing uncached GenericForeignKey field GenericTaggedModel.content_object, "
+                         "use prefetch_related('content_object')"]
+
+        with self.assertNumQueriesAndLogs(1, expected_logs):
+            self.assertEqual(tag.content_object, target)
+
+        with self.assertNumQueriesAndLogs(0):
+            self.assertEqual(tag.content_object, target)
+
+    def test_generic_foreign_key_access_with_prefetch(self):
+        target = GenericTargetModel.objects.create(name="Target")
+        GenericTaggedModel.objects.create(name="Tag", content_object=target)
+        tag = GenericTaggedModel.objects.prefetch_related("content_object").get(name="Tag")
+
+        with self.assertNumQueriesAndLogs(0):
+            self.assertEqual(tag.content_object, target)
+
+    def test_generic_relation_access(self):
+        target = GenericTargetModel.objects.create(name="Target")
+        GenericTaggedModel.objects.create(name="Tag", content_object=target)
+        ContentType.objects.get_for_model(GenericTargetModel)
+        expected_logs = ["Accessing uncached GenericRelation field GenericTargetModel.tags, "
+                         "use prefetch_related('tags')"]
+
+        target = GenericTargetModel.objects.get(pk=target.pk)
+
+        with self.assertNumQueriesAndLogs(1, expected_logs):
+            self.assertEqual(len(target.tags.all()), 1)
+
+        prefetched_target = GenericTargetModel.objects.prefetch_related("tags").get(pk=target.pk)
+
+        with self.assertNumQueriesAndLogs(0):
+            self.assertEqual(len(prefetched_target.tags.all()), 1)
+
+    def test_content_type_cache_miss(self):
+        content_type = ContentType.objects.get_for_model(GenericTargetModel)
+        ContentType.objects.clear_cache()
+        expected_logs = ["ContentType cache miss for mock_models.GenericTargetModel",
+                         "ContentType cache miss for id {}".format(content_type.id)]
+
+        with self.assertNumQueriesAndLogs(1, expected_logs[:1]):
+            ContentType.objects.get_for_model(GenericTargetModel)
+
+        ContentType.objects.clear_cache()
+
+        with self.assertNumQueriesAndLogs(1, expected_logs[1:]):
+            ContentType.objects.get_for_id(content_type.id)
+
+        with self.assertNumQueriesAndLogs(0):
+            ContentType.objects.get_for_model(GenericTargetModel)
+            ContentType.objects.get_for_id(content_type.id)
+
+    def test_traceback_logged_at_debug_level(self):
+        test_model = SimpleRelatedModel.objects.get(name="Test Related")
+        query_debug_logger = logging.getLogger('query_debug')
+        original_level = query_debug_logger.level
+        query_debug_logger.setLevel(logging.DEBUG)
+
+        try:
+            with LogCapture('query_debug', level=logging.DEBUG) as log_capture:
+                self.assertEqual(test_model.related_model.name, "Test")
+        finally:
+            query_debug_logger.setLevel(original_level)
+
+        traceback_records = [record for record in log_capture.records if record.levelno == logging.DEBUG]
+
+        self.assertEqual(len(traceback_records), 1)
+        # Stack entries are stored without source lines until rendered
+        stack = traceback_records[0].args[0].stack
+        self.assertEqual(stack[-1][2], "test_traceback_logged_at_debug_level")
+        self.assertFalse(any("django" + os.sep + "db" in filename for filename, _, _ in stack))
+        self.assertIn("test_model.related_model.name", traceback_records[0].getMessage())
+
+    def test_lazy_load_listeners(self):
+        thread_messages = []
+        all_messages = []
+        add_lazy_load_listener(thread_messages.append)
+        add_lazy_load_listener(all_messages.append, all_threads=True)
+
+        try:
+            # Builds the uncached queryset without running it
+            other_thread = threading.Thread(target=lambda: self.simple_related_model.many_models.all())
+            other_thread.start()
+            other_thread.join()
+            self.simple_related_model.many_models.all()
+        finally:
+            remove_lazy_load_listener(thread_messages.append)
+            remove_lazy_load_listener(all_messages.append, all_threads=True)
+
+        message = "Accessing uncached ManyToMany field SimpleRelatedModel.many_models"
+        self.assertEqual(thread_messages, [message])
+        self.assertEqual(all_messages, [message, message])
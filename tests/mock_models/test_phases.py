@@ -0,0 +1,40 @@
+from django.test import TestCase
+from testfixtures import LogCapture
+
+from django_query_debug.phases import PHASE_HYDRATE, PHASES
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestPhaseTiming(TestCase):
+    def setUp(self):
+        super(TestPhaseTiming, self).setUp()
+
+        SimpleModel.objects.bulk_create([SimpleModel(name=str(index)) for index in range(1000)])
+
+    def test_profile_phases(self):
+        with LogCapture("query_debug") as log_capture:
+            with analyze_block(profile_phases=True) as report:
+                list(SimpleModel.objects.all())
+                list(SimpleModel.objects.values_list("name", flat=True))
+                SimpleRelatedModel.objects.create(name="Related")
+
+        stats_by_sql = {stats.fingerprint.split(" FROM ")[0]: stats for stats in report.phases}
+        instance_stats = stats_by_sql['SELECT "mock_models_simplemodel"."id", "mock_models_simplemodel"."name"']
+        values_stats = stats_by_sql['SELECT "mock_models_simplemodel"."name"']
+
+        self.assertEqual(len(report.phases), 3)
+        self.assertEqual(instance_stats.count, 1)
+        self.assertTrue(all(instance_stats.times[phase] > 0 for phase in PHASES))
+        self.assertEqual(values_stats.times[PHASE_HYDRATE], 0.0)
+        self.assertGreater(values_stats.times['fetch'], 0.0)
+        self.assertEqual(instance_stats.dominant_phase, PHASE_HYDRATE)
+        self.assertTrue(any(instance_stats.advice in record.getMessage() for record in log_capture.records))
+        self.assertIn(instance_stats.fingerprint, report.fingerprints)
+
+    def test_nested_subquery_compiled_once(self):
+        with analyze_block(profile_phases=True) as report:
+            list(SimpleRelatedModel.objects.filter(related_model__in=SimpleModel.objects.filter(name="1")))
+
+        self.assertEqual(len(report.phases), 1)
+        self.assertGreater(report.phases[0].times['compile'], 0.0)
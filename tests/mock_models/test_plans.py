@@ -0,0 +1,88 @@
+import json
+
+from django.test import TestCase
+
+from django_query_debug.plans import (explain_queryset_plan,
+                                      parse_plan,
+                                      SEVERITY_CRITICAL,
+                                      SEVERITY_INFO,
+                                      SEVERITY_WARNING)
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestQueryPlans(TestCase):
+    def assertFindings(self, plan, expected_findings):
+        self.assertEqual([(finding.severity, finding.message) for finding in plan.findings], expected_findings)
+
+    def test_sqlite_plan(self):
+        rows = [
+            (2, 0, 0, "SCAN orders"),
+            (5, 0, 0, "SCAN customers"),
+            (9, 0, 0, "SEARCH items USING INDEX items_order_id (order_id=?)"),
+            (14, 0, 0, "USE TEMP B-TREE FOR ORDER BY"),
+        ]
+        plan = parse_plan('sqlite', rows)
+
+        self.assertEqual([node.table for node in plan.root.children], ["orders", "customers", "items", None])
+        self.assertEqual(plan.root.children[2].index, "items_order_id")
+        self.assertEqual(plan.severity, SEVERITY_CRITICAL)
+        self.assertFindings(plan, [
+            (SEVERITY_CRITICAL, "Nested loop without an index on customers"),
+            (SEVERITY_WARNING, "Full scan on orders"),
+            (SEVERITY_WARNING, "Full scan on customers"),
+            (SEVERITY_WARNING, "Temporary B-tree for order by"),
+        ])
+
+    def test_postgres_plan(self):
+        data = [{
+            "Plan": {
+                "Node Type": "Nested Loop",
+                "Total Cost": 1520.5,
+                "Plan Rows": 5000,
+                "Plans": [
+                    {"Node Type": "Index Scan", "Relation Name": "orders", "Index Name": "orders_pkey",
+                     "Total Cost": 8.3, "Plan Rows": 1},
+                    {"Node Type": "Seq Scan", "Relation Name": "items", "Total Cost": 1500.0, "Plan Rows": 50000},
+                ],
+            },
+        }]
+        plan = parse_plan('postgresql', [(json.dumps(data),)])
+
+        self.assertEqual(plan.estimated_cost, 1520.5)
+        self.assertEqual(plan.estimated_rows, 5000)
+        self.assertEqual(plan.root.children[0].index, "orders_pkey")
+        self.assertFindings(plan, [
+            (SEVERITY_CRITICAL, "Nested loop without an index on items"),
+            (SEVERITY_CRITICAL, "Full scan on large table items (~50000 rows)"),
+        ])
+        self.assertIn("  Seq Scan on items (cost=1500.0, rows=50000)", str(plan))
+
+    def test_mysql_plan(self):
+        columns = ["id", "select_type", "table", "partitions", "type", "possible_keys",
+                   "key", "key_len", "ref", "rows", "filtered", "Extra"]
+        rows = [
+            (1, "SIMPLE", "orders", None, "ALL", None, None, None, None, 20, 100.0, "Using filesort"),
+            (1, "SIMPLE", "items", None, "ALL", None, None, None, None, 300, 10.0, "Using join buffer"),
+        ]
+        plan = parse_plan('mysql', rows, columns=columns)
+
+        self.assertEqual(plan.estimated_rows, 6000)
+        self.assertFindings(plan, [
+            (SEVERITY_CRITICAL, "Nested loop without an index on items"),
+            (SEVERITY_WARNING, "Filesort used for orders"),
+            (SEVERITY_INFO, "Full scan on small table orders"),
+        ])
+
+    def test_unsupported_vendor(self):
+        with self.assertRaises(ValueError):
+            parse_plan('oracle', [])
+
+    def test_explain_queryset_plan(self):
+        full_scan_plan = explain_queryset_plan(SimpleModel.objects.filter(name="Test"))
+        lookup_plan = explain_queryset_plan(SimpleModel.objects.filter(pk=1))
+        join_plan = explain_queryset_plan(SimpleRelatedModel.objects.select_related("related_model"))
+
+        self.assertEqual(full_scan_plan.vendor, 'sqlite')
+        self.assertEqual(full_scan_plan.severity, SEVERITY_WARNING)
+        self.assertEqual(lookup_plan.findings, [])
+        self.assertIn("mock_models_simplemodel", [node.table for node in join_plan.nodes()])
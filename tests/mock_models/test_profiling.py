@@ -0,0 +1,68 @@
+from django.core.management import call_command
+from django.test import TestCase
+from six import StringIO
+
+from django_query_debug.patch import PatchDjangoDescriptors
+from django_query_debug.profiling import get_sweep_urls, profile_endpoint
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestProfileEndpoint(TestCase):
+    def setUp(self):
+        for index in range(3):
+            SimpleRelatedModel.objects.create(name="Related",
+                                              related_model=SimpleModel.objects.create(name="Simple"))
+
+    def test_url(self):
+        profile = profile_endpoint("/related/", repeat=3)
+
+        self.assertEqual(len(profile.runs), 3)
+        self.assertEqual(profile.status_codes, [200])
+        self.assertEqual(profile.errors, [])
+        # One query for the list and one lazy load per row
+        self.assertEqual(profile.warm_query_count, 4)
+        self.assertEqual(profile.fingerprints()[0][1], 3)
+        self.assertEqual(len(profile.lazy_loads()), 1)
+        self.assertEqual(profile.lazy_loads()[0][1], 3)
+        self.assertGreaterEqual(profile.warm_elapsed_time, profile.warm_db_time)
+
+    def test_dotted_view(self):
+        profile = profile_endpoint("mock_models.views.related_names", repeat=2)
+
+        self.assertEqual(profile.status_codes, [200])
+        self.assertEqual(profile.cold.query_count, 4)
+
+    def test_error(self):
+        profile = profile_endpoint("/simple/0/", repeat=1)
+
+        self.assertEqual(profile.status_codes, [])
+        self.assertIn("DoesNotExist", profile.errors[0])
+
+    def test_rollback(self):
+        profile_endpoint("mock_models.views.related_names", repeat=1)
+
+        self.assertEqual(SimpleModel.objects.count(), 3)
+
+    def test_sweep_urls(self):
+        self.assertEqual(get_sweep_urls(), ["/related/"])
+
+    def test_patch_applied_once(self):
+        PatchDjangoDescriptors(force=True)
+        PatchDjangoDescriptors(force=True)
+        profile = profile_endpoint("/related/", repeat=1)
+
+        self.assertEqual(len(profile.cold.lazy_loads), 3)
+
+
+class TestProfileEndpointsCommand(TestCase):
+    def setUp(self):
+        SimpleRelatedModel.objects.create(name="Related", related_model=SimpleModel.objects.create(name="Simple"))
+
+    def test_command(self):
+        out = StringIO()
+        call_command("profile_endpoints", "--sweep", "--repeat", "2", stdout=out)
+        output = out.getvalue()
+
+        self.assertIn("/related/ (200)", output)
+        self.assertIn("Lazy loads per run:", output)
+        self.assertIn("Endpoints by warm query count:", output)
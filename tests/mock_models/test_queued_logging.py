@@ -0,0 +1,122 @@
+import logging
+import threading
+
+from django.test import SimpleTestCase
+
+from django_query_debug.queued_logging import (disable_queued_logging,
+                                               enable_queued_logging,
+                                               QueuedHandler)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self, gate=None):
+        super(ListHandler, self).__init__()
+        self.messages = []
+        self.gate = gate
+        self.picked_up = threading.Event()
+
+    def emit(self, record):
+        self.picked_up.set()
+
+        if self.gate is not None:
+            self.gate.wait()
+
+        self.messages.append(record.getMessage())
+
+
+class TestQueuedLogging(SimpleTestCase):
+    def make_record(self, msg):
+        return logging.LogRecord('query_debug', logging.INFO, __file__, 0, msg, None, None)
+
+    def test_records_written_in_background(self):
+        target = ListHandler()
+        handler = QueuedHandler([target])
+
+        for index in range(3):
+            handler.handle(self.make_record("Message {}".format(index)))
+
+        handler.flush()
+        handler.close()
+
+        self.assertEqual(target.messages, ["Message 0", "Message 1", "Message 2"])
+
+    def assertOverflowPolicy(self, overflow, expected_messages, block_timeout=1.0):
+        gate = threading.Event()
+        target = ListHandler(gate=gate)
+        handler = QueuedHandler([target], max_size=1, overflow=overflow, block_timeout=block_timeout)
+
+        handler.handle(self.make_record("Blocking"))
+        # Wait for the writer to pick up the first record and block on the gate
+        self.assertTrue(target.picked_up.wait(5))
+
+        handler.handle(self.make_record("First"))
+        handler.handle(self.make_record("Second"))
+        gate.set()
+        handler.close()
+
+        self.assertEqual(target.messages, expected_messages)
+
+    def test_drop_new_overflow(self):
+        self.assertOverflowPolicy('drop_new', [
+            "Blocking",
+            "First",
+            "Dropped 1 query_debug log records, log queue was full",
+        ])
+
+    def test_drop_old_overflow(self):
+        self.assertOverflowPolicy('drop_old', [
+            "Blocking",
+            "Second",
+            "Dropped 1 query_debug log records, log queue was full",
+        ])
+
+    def test_block_overflow(self):
+        # The writer stays blocked for longer than the timeout, so the second record is dropped
+        self.assertOverflowPolicy('block', [
+            "Blocking",
+            "First",
+            "Dropped 1 query_debug log records, log queue was full",
+        ], block_timeout=0.05)
+
+    def test_block_overflow_waits_for_room(self):
+        gate = threading.Event()
+        target = ListHandler(gate=gate)
+        handler = QueuedHandler([target], max_size=1, overflow='block', block_timeout=5)
+
+        handler.handle(self.make_record("Blocking"))
+        self.assertTrue(target.picked_up.wait(5))
+        handler.handle(self.make_record("First"))
+
+        releaser = threading.Timer(0.05, gate.set)
+        releaser.start()
+        handler.handle(self.make_record("Second"))
+        handler.close()
+        releaser.join()
+
+        self.assertEqual(target.messages, ["Blocking", "First", "Second"])
+
+    def test_invalid_overflow_policy(self):
+        with self.assertRaises(ValueError):
+            QueuedHandler([], overflow='unknown')
+
+    def test_enable_and_disable(self):
+        query_debug_logger = logging.getLogger('query_debug')
+        original_handlers = list(query_debug_logger.handlers)
+        target = ListHandler()
+        query_debug_logger.addHandler(target)
+        original_level = query_debug_logger.level
+        query_debug_logger.setLevel(logging.INFO)
+
+        try:
+            handler = enable_queued_logging()
+
+            self.assertEqual(query_debug_logger.handlers, [handler])
+            query_debug_logger.info("Queued")
+            handler.flush()
+            self.assertEqual(target.messages, ["Queued"])
+        finally:
+            disable_queued_logging()
+            query_debug_logger.setLevel(original_level)
+            query_debug_logger.removeHandler(target)
+
+        self.assertEqual(query_debug_logger.handlers, original_handlers)
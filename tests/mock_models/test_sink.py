@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management import call_command
+from django.test import override_settings, TestCase
+from six import StringIO
+
+from django_query_debug import sink as sink_module
+from django_query_debug.sink import get_stats_sink, merge_stats, StatsSink
+from django_query_debug.utils import analyze_block, fingerprint_sql
+from mock_models.models import FieldTrackedSimpleModel, SimpleModel
+
+
+class TestStatsSink(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_batches(self, sink):
+        with open(sink.path) as stats_file:
+            return [json.loads(line) for line in stats_file]
+
+    def test_fingerprint_sql(self):
+        self.assertEqual(fingerprint_sql("SELECT * FROM t WHERE name = 'a' AND id IN (1, 2,  3)"),
+                         "SELECT * FROM t WHERE name = ? AND id IN (...)")
+        self.assertEqual(fingerprint_sql('SELECT "t"."col1" FROM "t" WHERE "t"."id" = 5'),
+                         'SELECT "t"."col1" FROM "t" WHERE "t"."id" = ?')
+
+    def test_records_are_batched(self):
+        sink = StatsSink(self.directory, flush_interval=60)
+        sink.record_query("SELECT ?", query_time=0.5, num_results=1)
+        sink.record_query("SELECT ?", query_time=0.25, num_results=1)
+        sink.record_field_usage("mock_models.SimpleModel", {"name": 2})
+        sink.flush()
+        # Nothing pending, no extra line written
+        sink.flush()
+
+        batches = self.read_batches(sink)
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]['queries'], {"SELECT ?": [2, 0.75, 2]})
+        self.assertEqual(batches[0]['field_usage'], {"mock_models.SimpleModel": {"name": 2}})
+        sink.close()
+
+    def test_overflow_wakes_writer(self):
+        sink = StatsSink(self.directory, flush_interval=60, max_pending=2)
+        sink.record_query("SELECT 1")
+        sink.record_query("SELECT 2")
+
+        # Written by the background thread long before the flush interval
+        for _ in range(100):
+            if os.path.exists(sink.path) and open(sink.path).read().endswith("\n"):
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(sum(len(batch['queries']) for batch in self.read_batches(sink)), 2)
+        sink.close()
+
+    def test_merge_stats(self):
+        for pid in range(2):
+            with open(os.path.join(self.directory, "worker-{}.jsonl".format(pid)), 'w') as stats_file:
+                stats_file.write(json.dumps({'queries': {"SELECT ?": [1, 0.5, 3]},
+                                             'field_usage': {"app.Model": {"id": 1}}}) + "\n")
+                stats_file.write('{"queries": {"SELECT')
+
+        merged = merge_stats([self.directory])
+
+        self.assertEqual(merged['queries'], {"SELECT ?": [2, 1.0, 6]})
+        self.assertEqual(merged['field_usage'], {"app.Model": {"id": 2}})
+
+    @override_settings(DEBUG=True)
+    def test_analyze_block_and_field_usage_export(self):
+        with override_settings(QUERY_DEBUG_STATS_DIR=self.directory):
+            sink = get_stats_sink()
+            self.addCleanup(setattr, sink_module, "_stats_sink", None)
+            self.addCleanup(sink.close)
+            tracked_model = FieldTrackedSimpleModel.objects.create(name="Tracked")
+
+            with analyze_block() as report:
+                list(SimpleModel.objects.filter(name="A"))
+                list(SimpleModel.objects.filter(name="B"))
+
+            self.assertEqual(report.query_count, 2)
+            self.assertAlmostEqual(report.total_query_time,
+                                   sum(stats['time'] for stats in report.fingerprints.values()))
+            tracked_model.reset_field_usage()
+            self.assertEqual(tracked_model.name, "Tracked")
+            tracked_model.export_field_usage()
+            sink.flush()
+
+        self.assertEqual(tracked_model.get_field_usage()["name"], 0)
+
+        output = StringIO()
+        call_command("merge_query_stats", self.directory, stdout=output)
+        merged = merge_stats([self.directory])
+        counts = [stats[0] for fingerprint, stats in merged['queries'].items() if "mock_models_simplemodel" in fingerprint]
+
+        self.assertEqual(counts, [2])
+        self.assertEqual(merged['field_usage']["mock_models.FieldTrackedSimpleModel"]["name"], 1)
+        self.assertIn("mock_models.FieldTrackedSimpleModel:", output.getvalue())
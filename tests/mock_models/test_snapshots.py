@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command, CommandError
+from django.db import connection
+from django.test import TestCase
+from six import StringIO
+
+from django_query_debug.snapshots import (assert_plans_unchanged,
+                                          capture_plans,
+                                          check_plan_snapshot,
+                                          PlanSnapshot)
+from mock_models.models import SimpleRelatedModel
+
+
+def snapshot_queries():
+    return [SimpleRelatedModel.objects.filter(name="Test")]
+
+
+class TestPlanSnapshots(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "plans.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_name_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE INDEX "snapshot_name_idx" ON "mock_models_simplerelatedmodel" ("name")')
+
+    def drop_name_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX "snapshot_name_idx"')
+
+    def test_plan_shape_ignores_literals(self):
+        snapshot = capture_plans([SimpleRelatedModel.objects.filter(name="A"),
+                                  SimpleRelatedModel.objects.filter(name="B")])
+
+        self.assertEqual(len(snapshot.plans), 1)
+        shape = list(snapshot.plans.values())[0]['shape']
+        self.assertEqual(shape[0]['table'], "mock_models_simplerelatedmodel")
+        self.assertEqual(shape[0]['access'], "full scan")
+
+    def test_detect_plan_flip(self):
+        self.create_name_index()
+        # New queries are reported as changes when the snapshot is created
+        self.assertEqual([change.old_shape for change in check_plan_snapshot(self.path, snapshot_queries())], [None])
+        self.assertEqual(check_plan_snapshot(self.path, snapshot_queries()), [])
+        self.assertEqual(list(PlanSnapshot(self.path).plans.values())[0]['shape'][0]['access'], "index")
+
+        self.drop_name_index()
+        changes = check_plan_snapshot(self.path, snapshot_queries())
+
+        self.assertEqual(len(changes), 1)
+        self.assertTrue(changes[0].is_regression)
+        self.assertEqual(changes[0].flips, [("mock_models_simplerelatedmodel", "index", "full scan")])
+
+        with self.assertRaises(AssertionError):
+            assert_plans_unchanged(self.path, snapshot_queries())
+
+        # Adding the index back is a change, but not a regression
+        with self.assertRaises(CommandError):
+            call_command("query_plan_snapshot", "mock_models.test_snapshots.snapshot_queries",
+                         snapshot=self.path, stdout=StringIO())
+
+        call_command("query_plan_snapshot", "mock_models.test_snapshots.snapshot_queries",
+                     snapshot=self.path, update=True, stdout=StringIO())
+        self.create_name_index()
+        assert_plans_unchanged(self.path, snapshot_queries())
+
+        with self.assertRaises(AssertionError):
+            assert_plans_unchanged(self.path, snapshot_queries(), allow_changes=False)
@@ -0,0 +1,68 @@
+from django.template.loader import render_to_string
+from django.test import TestCase
+from testfixtures import LogCapture
+
+from django_query_debug.capture import QueryCapture
+from django_query_debug.templates import TemplateTracker
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestTemplateTracker(TestCase):
+    def setUp(self):
+        super(TestTemplateTracker, self).setUp()
+
+        for index in range(3):
+            SimpleRelatedModel.objects.create(name="Related {}".format(index),
+                                              related_model=SimpleModel.objects.create(name="Simple"))
+
+    def test_attribute_to_template_node(self):
+        with TemplateTracker() as tracker:
+            render_to_string("related_list.html", {'related_models': SimpleRelatedModel.objects.all()})
+
+        stats_list = tracker.get_stats()
+        lazy_stats = stats_list[0]
+
+        self.assertEqual(len(stats_list), 2)
+        self.assertEqual(lazy_stats.location.template_name, "related_list.html")
+        self.assertEqual(lazy_stats.location.lineno, 3)
+        self.assertEqual(lazy_stats.location.source, "{{ related.related_model.name }}")
+        self.assertEqual(lazy_stats.count, 3)
+        self.assertEqual(lazy_stats.loop.lineno, 2)
+        self.assertEqual(lazy_stats.loop.source, "{% for related in related_models %}")
+        self.assertEqual(list(lazy_stats.lazy_loads.values()), [3])
+        self.assertIn("prefetch_related", lazy_stats.suggestion)
+
+        # The queryset itself is evaluated by the for tag
+        self.assertEqual(stats_list[1].location.source, "{% for related in related_models %}")
+        self.assertEqual(stats_list[1].count, 1)
+        self.assertIsNone(stats_list[1].suggestion)
+
+    def test_queries_outside_templates(self):
+        with TemplateTracker() as tracker:
+            list(SimpleModel.objects.all())
+
+        self.assertEqual(tracker.get_stats(), [])
+
+    def test_tag_captured_queries(self):
+        with QueryCapture() as capture:
+            list(SimpleModel.objects.all())
+
+            with TemplateTracker(capture):
+                render_to_string("related_list.html",
+                                 {'related_models': SimpleRelatedModel.objects.select_related("related_model")})
+
+        self.assertEqual(len(capture.queries), 2)
+        self.assertNotIn('template', capture.queries[0].extra)
+        self.assertEqual(str(capture.queries[1].extra['template']),
+                         "related_list.html:2 {% for related in related_models %}")
+        self.assertIsNone(capture.queries[1].extra['template_loop'])
+
+    def test_analyze_block(self):
+        with LogCapture("query_debug") as log_capture:
+            with analyze_block(track_templates=True) as report:
+                render_to_string("related_list.html", {'related_models': SimpleRelatedModel.objects.all()})
+
+        self.assertEqual(len(report.templates), 2)
+        self.assertEqual(report.templates[0].count, 3)
+        self.assertTrue(any("related_list.html:3" in record.getMessage() for record in log_capture.records))
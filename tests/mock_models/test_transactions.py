@@ -0,0 +1,96 @@
+import threading
+
+from django.db import connections, IntegrityError, transaction
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.test import TestCase, TransactionTestCase
+
+from django_query_debug.utils import analyze_block
+from mock_models.models import SimpleModel
+
+
+class TestTransactionTracking(TestCase):
+    def test_savepoints_and_atomic_blocks(self):
+        with analyze_block(atomic_time_threshold=0) as report:
+            with transaction.atomic():
+                SimpleModel.objects.create(name="Outer")
+
+                try:
+                    with transaction.atomic():
+                        SimpleModel.objects.create(name="Inner")
+                        raise IntegrityError()
+                except IntegrityError:
+                    pass
+
+            with transaction.atomic(savepoint=False):
+                SimpleModel.objects.create(name="No savepoint")
+
+        stats = report.transactions
+        # Savepoints are released after being rolled back
+        self.assertEqual((stats.savepoints, stats.savepoint_releases, stats.savepoint_rollbacks), (2, 2, 1))
+        # The test case already runs in a transaction
+        self.assertEqual((stats.transactions, stats.commits), (0, 0))
+
+        inner, outer, no_savepoint = stats.atomic_blocks
+        # Including the SAVEPOINT, RELEASE and ROLLBACK TO statements
+        self.assertEqual((outer.query_count, inner.query_count, no_savepoint.query_count), (7, 4, 1))
+        self.assertTrue(inner.savepoint and inner.rolled_back)
+        self.assertEqual(inner.depth, outer.depth + 1)
+        self.assertFalse(outer.rolled_back)
+        self.assertFalse(no_savepoint.savepoint)
+        self.assertEqual(outer.call_site[0], __file__)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+        self.assertEqual(len(stats.slow_atomic_blocks(0)), 3)
+
+
+class TestConnectionTracking(TransactionTestCase):
+    def test_transactions_and_connections(self):
+        with analyze_block() as report:
+            with transaction.atomic():
+                SimpleModel.objects.create(name="Simple")
+
+            new_connection = connections.create_connection("default")
+            new_connection.ensure_connection()
+            # SQLite does not close in-memory test databases in close()
+            BaseDatabaseWrapper.close(new_connection)
+
+        stats = report.transactions
+        self.assertEqual((stats.transactions, stats.commits, stats.rollbacks), (1, 1, 0))
+        self.assertEqual((stats.connections_opened, stats.connections_closed), (1, 1))
+        self.assertGreater(stats.connect_time, 0)
+        self.assertEqual(stats.atomic_blocks[0].depth, 0)
+
+    def test_atomic_decorator_shared_by_threads(self):
+        entered = threading.Event()
+        other_thread_done = threading.Event()
+
+        @transaction.atomic
+        def count(wait):
+            if wait:
+                entered.set()
+                other_thread_done.wait(5)
+                # Run once the other thread left the shared block
+                SimpleModel.objects.count()
+
+            SimpleModel.objects.count()
+
+        def other_thread():
+            entered.wait(5)
+
+            try:
+                count(wait=False)
+            finally:
+                connections.close_all()
+                other_thread_done.set()
+
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+
+        with analyze_block() as report:
+            count(wait=True)
+
+        thread.join()
+
+        blocks = report.transactions.atomic_blocks
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0].depth, 0)
+        self.assertGreaterEqual(blocks[0].query_count, 2)
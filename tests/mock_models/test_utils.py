@@ -1,6 +1,14 @@
+from django.db import connection, OperationalError, reset_queries
 from django.test import override_settings, TestCase
+from testfixtures import LogCapture
 
-from django_query_debug.utils import analyze_block, analyze_queryset
+from django_query_debug import utils
+from django_query_debug.utils import (_statement_timeout,
+                                      analyze_block,
+                                      analyze_queryset,
+                                      explain_queryset,
+                                      get_explain_prefix,
+                                      LazyFormattedSQL)
 from mock_models.models import SimpleModel, SimpleRelatedModel
 
 
@@ -20,3 +28,86 @@ class TestPatchedDescriptors(TestCase):
 
             m = SimpleRelatedModel.objects.get(name="Test 2")
             self.assertEqual(m.related_model.name, "Simple")
+
+    def test_analyze_block_without_counting_results(self):
+        SimpleModel.objects.create(name="Simple")
+        reset_queries()
+
+        with analyze_block(count_results=False) as report:
+            list(SimpleModel.objects.all())
+
+        # No queries re-executed to count the results
+        self.assertEqual(len(connection.queries), 1)
+        self.assertEqual(report.query_count, 1)
+        self.assertEqual(report.total_objects_fetched, 0)
+
+    def test_analyze_block_defers_sql_formatting(self):
+        with LogCapture("query_debug") as capture:
+            with analyze_block():
+                list(SimpleModel.objects.all())
+
+        sql_records = [record for record in capture.records if record.msg.startswith("SQL Statement")]
+
+        self.assertEqual(len(sql_records), 1)
+        self.assertIsInstance(sql_records[0].args[0], LazyFormattedSQL)
+        self.assertIn("FROM", sql_records[0].getMessage())
+
+    def test_analyze_block_explains_slow_fingerprints(self):
+        SimpleModel.objects.create(name="Simple")
+        utils._plan_cache.clear()
+
+        with analyze_block(explain_count_threshold=2) as report:
+            list(SimpleModel.objects.filter(name="A"))
+            list(SimpleModel.objects.filter(name="B"))
+            list(SimpleRelatedModel.objects.all())
+
+        self.assertEqual(len(report.plans), 1)
+        fingerprint, plan = list(report.plans.items())[0]
+        self.assertIn("mock_models_simplemodel", fingerprint)
+        self.assertIn("SCAN", str(plan))
+
+        # Plans are fetched once per fingerprint
+        reset_queries()
+        with analyze_block(explain_count_threshold=1) as report:
+            list(SimpleModel.objects.filter(name="C"))
+
+        self.assertEqual(report.plans[fingerprint], plan)
+        self.assertFalse(any(query['sql'].startswith("EXPLAIN") for query in connection.queries))
+
+    def test_explain_prefixes(self):
+        self.assertEqual(get_explain_prefix('postgresql'), 'EXPLAIN')
+        self.assertEqual(get_explain_prefix('postgresql', mode='analyze'), 'EXPLAIN (ANALYZE)')
+        self.assertEqual(get_explain_prefix('postgresql', mode='buffers', format='json'),
+                         'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)')
+        self.assertEqual(get_explain_prefix('mysql', format='json'), 'EXPLAIN FORMAT=JSON')
+        self.assertEqual(get_explain_prefix('mysql', mode='analyze'), 'EXPLAIN ANALYZE')
+        self.assertEqual(get_explain_prefix('sqlite'), 'EXPLAIN QUERY PLAN')
+        self.assertIsNone(get_explain_prefix('oracle'))
+
+        with self.assertRaises(ValueError):
+            get_explain_prefix('sqlite', mode='analyze')
+        with self.assertRaises(ValueError):
+            get_explain_prefix('postgresql', mode='unknown')
+
+    def test_explain_queryset_timeout(self):
+        self.assertIn("SCAN", explain_queryset(SimpleModel.objects.all(), timeout=5))
+
+        slow_query = ("WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter) "
+                      "SELECT x FROM counter WHERE x < 0")
+
+        # SQLite only plans the query, so check the timeout on the query itself
+        with self.assertRaises(OperationalError), _statement_timeout(connection, 0.01):
+            with connection.cursor() as cursor:
+                cursor.execute(slow_query)
+                cursor.fetchall()
+
+        # The progress handler is removed afterwards
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+
+class TestFieldUsageSessionImport(TestCase):
+    def test_reexported_from_utils(self):
+        from django_query_debug.mixins import FieldUsageSession
+
+        self.assertIs(utils.FieldUsageSession, FieldUsageSession)
@@ -0,0 +1,135 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from six import StringIO
+
+from django_query_debug import workload as workload_module
+from django_query_debug.workload import (capture_workload,
+                                         enable_workload_capture,
+                                         read_workload,
+                                         replay_workload,
+                                         WorkloadWriter)
+from mock_models.models import SimpleModel
+
+
+class TestWorkloadCapture(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_capture_and_read(self):
+        with capture_workload(self.directory, flush_interval=60) as capture:
+            SimpleModel.objects.create(name="Simple")
+            list(SimpleModel.objects.filter(name="Simple", id__gt=0))
+
+        records = list(read_workload([self.directory]))
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(sorted(records[1]['params'], key=str), [0, "Simple"])
+        self.assertEqual(records[1]['alias'], "default")
+        self.assertEqual(records[1]['call_site'][0], __file__)
+        self.assertIn("?", records[1]['fingerprint'])
+        self.assertEqual(capture.writer.dropped_count, 0)
+
+    def test_params_are_serialized(self):
+        writer = WorkloadWriter(self.directory, flush_interval=60)
+        writer.record({'sql': "SELECT %s", 'params': [datetime.date(2020, 1, 2)]})
+        writer.close()
+
+        self.assertEqual(list(read_workload([writer.path]))[0]['params'], ["2020-01-02"])
+
+    def test_bounded_queue(self):
+        writer = WorkloadWriter(self.directory, max_pending=2, flush_interval=60)
+
+        for index in range(5):
+            writer.record({'sql': "SELECT {}".format(index), 'params': []})
+
+        writer.close()
+
+        self.assertEqual(writer.dropped_count, 3)
+        self.assertEqual(len(list(read_workload([self.directory]))), 2)
+
+    def test_rotation(self):
+        writer = WorkloadWriter(self.directory, max_file_size=100, max_files=2, flush_interval=60)
+
+        for index in range(4):
+            writer.record({'sql': "SELECT {}".format("x" * 100), 'params': [index]})
+            writer.flush()
+
+        writer.close()
+
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual([record['params'] for record in read_workload([self.directory])], [[2], [3]])
+
+    def test_truncated_file(self):
+        writer = WorkloadWriter(self.directory, flush_interval=60)
+        writer.record({'sql': "SELECT 1", 'params': []})
+        writer.close()
+
+        with open(writer.path, 'rb') as workload_file:
+            data = workload_file.read()
+        with open(writer.path, 'wb') as workload_file:
+            workload_file.write(data + gzip.compress(b'{"sql": "SELECT 2"}\n')[:-10])
+
+        self.assertEqual([record['sql'] for record in read_workload([writer.path])], ["SELECT 1"])
+
+    def test_enable_workload_capture(self):
+        self.addCleanup(workload_module.disable_workload_capture)
+        enable_workload_capture(self.directory)
+        list(SimpleModel.objects.all())
+        workload_module.disable_workload_capture()
+
+        self.assertNotIn(workload_module._recorder, connection.execute_wrappers)
+        self.assertEqual(len(list(read_workload([self.directory]))), 1)
+
+
+class TestWorkloadReplay(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+        with capture_workload(self.directory, flush_interval=60):
+            SimpleModel.objects.create(name="Simple")
+
+            for index in range(3):
+                list(SimpleModel.objects.filter(name=str(index)))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        result = replay_workload(read_workload([self.directory]))
+
+        self.assertEqual(result.query_count, 3)
+        self.assertEqual(len(result.stats), 1)
+        stats = list(result.stats.values())[0]
+        self.assertEqual((stats.count, stats.errors), (3, 0))
+        self.assertGreater(result.throughput, 0)
+        self.assertLessEqual(stats.percentile(50), stats.percentile(99))
+        self.assertEqual(SimpleModel.objects.count(), 1)
+
+    def test_replay_threads(self):
+        result = replay_workload(list(read_workload([self.directory])) * 4, threads=3)
+
+        self.assertEqual(result.threads, 3)
+        self.assertEqual(result.query_count, 12)
+
+    def test_replay_writes(self):
+        result = replay_workload(read_workload([self.directory]), include_writes=True)
+
+        self.assertEqual(result.query_count, 4)
+        self.assertEqual(SimpleModel.objects.count(), 2)
+
+    def test_replay_command(self):
+        output = StringIO()
+        call_command("replay_workload", self.directory, "--repeat", "2", stdout=output)
+
+        self.assertIn("Count: 6, Errors: 0", output.getvalue())
+        self.assertIn("Replayed 6 queries", output.getvalue())
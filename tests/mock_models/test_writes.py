@@ -0,0 +1,81 @@
+from django.db import connection
+from django.test import TestCase
+from testfixtures import LogCapture
+
+from django_query_debug.capture import QueryCapture
+from django_query_debug.utils import analyze_block
+from django_query_debug.writes import detect_row_by_row_writes
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+class TestQueryCapture(TestCase):
+    def test_capture_without_debug(self):
+        with QueryCapture() as capture:
+            list(SimpleModel.objects.filter(name="A"))
+
+        self.assertEqual(len(capture.queries), 1)
+        query = capture.queries[0]
+        self.assertEqual(query.params, ("A",))
+        self.assertEqual(query.alias, "default")
+        self.assertEqual(query.statement_type, "SELECT")
+        self.assertIn("'A'", query.display_sql)
+        self.assertEqual(query.call_site[0], __file__)
+        self.assertEqual(query.call_site[2], "test_capture_without_debug")
+        self.assertNotIn(capture, connection.execute_wrappers)
+
+
+class TestRowByRowWrites(TestCase):
+    def test_inserts(self):
+        with QueryCapture() as capture:
+            for index in range(5):
+                SimpleModel.objects.create(name=str(index))
+            SimpleModel.objects.bulk_create([SimpleModel(name="bulk") for index in range(5)])
+
+        write_runs = detect_row_by_row_writes(capture.queries)
+
+        self.assertEqual(len(write_runs), 1)
+        self.assertEqual(write_runs[0].count, 5)
+        self.assertIs(write_runs[0].model, SimpleModel)
+        self.assertEqual(write_runs[0].fields, ["name"])
+        self.assertEqual(write_runs[0].suggestion,
+                         "Use SimpleModel.objects.bulk_create(objs) instead of saving each object")
+
+    def test_updates(self):
+        SimpleModel.objects.bulk_create([SimpleModel(name=str(index)) for index in range(5)])
+        objs = list(SimpleModel.objects.all())
+
+        with QueryCapture() as capture:
+            for obj in objs:
+                obj.name = "same"
+                obj.save(update_fields=["name"])
+
+        self.assertEqual(detect_row_by_row_writes(capture.queries)[0].suggestion,
+                         "Use SimpleModel.objects.filter(...).update(...) to set ['name'] in one query")
+
+        with QueryCapture() as capture:
+            for obj in objs:
+                obj.name = "name {}".format(obj.pk)
+                obj.save(update_fields=["name"])
+
+        self.assertEqual(detect_row_by_row_writes(capture.queries)[0].suggestion,
+                         "Use SimpleModel.objects.bulk_update(objs, ['name'])")
+
+    def test_writes_below_threshold(self):
+        with QueryCapture() as capture:
+            for index in range(4):
+                SimpleModel.objects.create(name=str(index))
+
+        self.assertEqual(detect_row_by_row_writes(capture.queries), [])
+
+    def test_analyze_block_reports_writes(self):
+        related = SimpleModel.objects.create(name="Simple")
+
+        with LogCapture("query_debug") as log_capture:
+            with analyze_block() as report:
+                for index in range(6):
+                    SimpleRelatedModel.objects.create(name=str(index), related_model=related)
+
+        self.assertEqual(len(report.write_runs), 1)
+        self.assertEqual(report.write_runs[0].fields, ["name", "related_model", "one_to_one_model"])
+        self.assertIn("Use SimpleRelatedModel.objects.bulk_create(objs) instead of saving each object",
+                      [record.getMessage() for record in log_capture.records])
@@ -0,0 +1,14 @@
+from django.http import HttpResponse
+
+from mock_models.models import SimpleModel, SimpleRelatedModel
+
+
+def related_names(request):
+    # Lazy loads related_model for every row
+    names = [related.related_model.name for related in SimpleRelatedModel.objects.all()]
+
+    return HttpResponse(", ".join(names))
+
+
+def simple_name(request, pk):
+    return HttpResponse(SimpleModel.objects.get(pk=pk).name)
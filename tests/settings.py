@@ -21,6 +21,7 @@ DEBUG = True
 ENABLE_QUERY_WARNINGS = True
 
 INSTALLED_APPS = [
+    'django.contrib.contenttypes',
     'django_query_debug',
     'mock_models',
 ]
@@ -54,3 +55,12 @@ LOGGING = {
         }
     }
 }
+
+ROOT_URLCONF = 'urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [os.path.join(BASE_DIR, 'templates')],
+    },
+]
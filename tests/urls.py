@@ -0,0 +1,8 @@
+from django.conf.urls import url
+
+from mock_models import views
+
+urlpatterns = [
+    url(r'^related/$', views.related_names, name="related-names"),
+    url(r'^simple/(?P<pk>\d+)/$', views.simple_name, name="simple-name"),
+]